@@ -0,0 +1,119 @@
+'''
+Benchmark memory usage of issyours.data objects
+
+Creates N synthetic issues with comments, events and labels, keeps all of
+them in memory and reports allocated bytes per object (tracemalloc). The
+same data is also loaded into equivalent classes with per-instance __dict__
+and without value interning for comparison.
+
+Usage: python benchmarks/data_memory.py [N]
+'''
+
+
+import os
+import sys
+import tracemalloc
+from datetime import datetime, timedelta
+
+import attr
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from issyours.data import Issue, IssueComment, IssueEvent, IssueLabel, Person
+from issyours.reader import ReaderBase
+
+
+COMMENTS = 5
+EVENTS = 3
+LABELS = (('bug', 'ee0701'), ('enhancement', '84b6eb'), ('question', 'cc317c'))
+ROLES = ('OWNER', 'CONTRIBUTOR', 'NONE')
+USERS = 20
+
+
+class Reader(ReaderBase):
+    '''Dummy reader, data objects require one'''
+    def __init__(self): super().__init__()
+    def issue_uids(self, *a, **ka): return []
+    def person_uids(self): return []
+    def _read_issue(self, uid): pass
+    def _read_person(self, login): pass
+    def _get_comments(self, issue, sort_by='created_at', desc=False): return []
+    def _get_events(self, issue, sort_by='created_at', desc=False): return []
+
+
+def unslotted(cls):
+    '''Copy of attrs class with instance __dict__ and no converters'''
+    fields = {f.name: attr.ib(default=f.default) for f in attr.fields(cls)}
+    return attr.make_class(cls.__name__, fields, frozen=True, slots=False)
+
+
+CURRENT = dict(
+    issue=Issue, comment=IssueComment, event=IssueEvent, person=Person,
+    label=IssueLabel.interned,
+)
+PLAIN = dict(
+    issue=unslotted(Issue), comment=unslotted(IssueComment), event=unslotted(IssueEvent),
+    person=unslotted(Person), label=unslotted(IssueLabel),
+)
+
+
+def load(classes, count, reader):
+    '''Create synthetic issues, return all created objects'''
+    persons = [classes['person'](reader=reader, nickname='user{}'.format(n)) for n in range(USERS)]
+    start = datetime(2020, 1, 1)
+    objects = []
+    for number in range(count):
+        created = start + timedelta(hours=number)
+        issue = classes['issue'](
+            reader=reader,
+            uid=str(number),
+            author=persons[number % USERS],
+            author_role=''.join(ROLES[number % len(ROLES)]),  # new string object every time
+            status=''.join('closed' if number % 3 else 'open'),
+            title='Issue number {}'.format(number),
+            body='Body of issue {}'.format(number),
+            labels=[classes['label'](''.join(name), '#' + color)
+                    for name, color in LABELS[:number % len(LABELS) + 1]],
+            created_at=created,
+            modified_at=created,
+        )
+        objects.append(issue)
+        for index in range(COMMENTS):
+            objects.append(classes['comment'](
+                issue=issue,
+                author=persons[index % USERS],
+                author_role=''.join(ROLES[index % len(ROLES)]),
+                body='Comment {} on issue {}'.format(index, number),
+                created_at=created + timedelta(minutes=index),
+            ))
+        for index in range(EVENTS):
+            objects.append(classes['event'](
+                issue=issue,
+                author=persons[index % USERS],
+                type=''.join('labeled'),
+                data={},
+                created_at=created + timedelta(minutes=index, seconds=30),
+            ))
+    return objects
+
+
+def measure(classes, count, reader):
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    objects = load(classes, count, reader)
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return used, len(objects)
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    reader = Reader()
+    print('Issues: {} ({} comments, {} events each)'.format(count, COMMENTS, EVENTS))
+    for title, classes in (('dict, no interning', PLAIN), ('slots, interning', CURRENT)):
+        used, objects = measure(classes, count, reader)
+        print('{:>20}: {:.1f} MiB total, {:.0f} bytes per object'.format(
+            title, used / 2**20, used / objects))
+
+
+if __name__ == '__main__':
+    main()
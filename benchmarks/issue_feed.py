@@ -0,0 +1,82 @@
+'''
+Benchmark merging of comments and events into Issue.feed
+
+Compares the heap-based k-way merge used by Issue.feed with the previous
+hand-written two-way merge on synthetic sorted streams of various lengths.
+
+Usage: python benchmarks/issue_feed.py [REPEAT]
+'''
+
+
+import heapq
+import os
+import sys
+from datetime import datetime, timedelta
+from itertools import repeat
+from time import perf_counter
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from issyours.data import _feed_key
+
+
+SIZES = (0, 5, 50, 500, 5000)  # comments per issue, half as many events
+
+
+def two_way(comments, events):
+    '''Previous implementation of Issue.feed'''
+    def get_next(iterator, default=None):
+        try:
+            return next(iterator)
+        except StopIteration:
+            return default
+    comment, event = get_next(comments), get_next(events)
+    while True:
+        if not comment and not event:
+            break
+        elif (not event and comment) \
+        or (comment and (comment.created_at <= event.created_at)):
+            yield comment, 'comment'
+            comment = get_next(comments)
+        else:
+            yield event, 'event'
+            event = get_next(events)
+
+
+def heap_merge(comments, events):
+    '''Current implementation of Issue.feed'''
+    sources = [zip(comments, repeat('comment')), zip(events, repeat('event'))]
+    return heapq.merge(*sources, key=_feed_key)
+
+
+def stream(count, step):
+    start = datetime(2020, 1, 1)
+    return [SimpleNamespace(created_at=start + timedelta(minutes=n * step)) for n in range(count)]
+
+
+def measure(merge, comments, events, repeat):
+    start = perf_counter()
+    for _ in range(repeat):
+        for item in merge(iter(comments), iter(events)):
+            pass
+    return (perf_counter() - start) / repeat
+
+
+def main():
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    print('{:>9}  {:>14}  {:>14}'.format('comments', 'two-way, us', 'heap, us'))
+    for size in SIZES:
+        comments, events = stream(size, 2), stream(size // 2, 3)
+        expected = [(i.created_at, k) for i, k in two_way(iter(comments), iter(events))]
+        actual = [(i.created_at, k) for i, k in heap_merge(iter(comments), iter(events))]
+        if expected != actual:
+            sys.exit('merge results differ for {} comments'.format(size))
+        print('{:>9}  {:14.2f}  {:14.2f}'.format(
+            size,
+            measure(two_way, comments, events, repeat) * 1e6,
+            measure(heap_merge, comments, events, repeat) * 1e6,
+        ))
+
+
+if __name__ == '__main__':
+    main()
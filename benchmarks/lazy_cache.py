@@ -0,0 +1,94 @@
+'''
+Benchmark insert and lookup cost of LazyAwareCache for various cache sizes
+
+The cache is filled to its maximum size and then receives a stream of
+inserts of new lazy objects (every other one initialized) mixed with lookups
+of recently inserted keys. The previous sort-based eviction is included for
+comparison at smaller sizes, where it still finishes in reasonable time.
+
+Usage: python benchmarks/lazy_cache.py [OPERATIONS]
+'''
+
+
+import os
+import sys
+from time import perf_counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from issyours.lazy import LazyAwareCache, LazyObject
+
+
+SIZES = (50, 500, 5000, 50000, 100000)
+SORTED_MAX_SIZE = 5000
+
+
+class Item:
+    def __init__(self, number):
+        self.number = number
+
+
+class SortedLazyAwareCache:
+    '''Previous implementation: sort all items by recency on every eviction'''
+
+    def __init__(self, maxsize):
+        self._strong_cache = dict()
+        self._cache_worth = dict()
+        self._lru_clock = 0
+        self._maxsize = maxsize
+
+    def __setitem__(self, key, value):
+        self._strong_cache[key] = value
+        self._lru_clock += 1
+        self._cache_worth[key] = self._lru_clock
+        if len(self._strong_cache) <= self._maxsize:
+            return
+        droppable = {k for k, v in self._strong_cache.items() if v._lazy.inner is None}
+        for key in sorted(self._cache_worth, key=self._cache_worth.get):
+            if len(self._strong_cache) <= self._maxsize:
+                break
+            if droppable and key not in droppable:
+                continue
+            self._strong_cache.pop(key)
+            self._cache_worth.pop(key)
+
+    def __getitem__(self, key):
+        value = self._strong_cache[key]
+        self._lru_clock += 1
+        self._cache_worth[key] = self._lru_clock
+        return value
+
+
+def measure(cache_class, size, operations):
+    cache = cache_class(maxsize=size)
+    keep = []  # strong references keep weak cache tier populated
+    for number in range(size):
+        lazy = LazyObject(Item, number)
+        keep.append(lazy)
+        cache[number] = lazy
+    start = perf_counter()
+    for number in range(size, size + operations):
+        lazy = LazyObject(Item, number)
+        if number % 2:
+            lazy.number
+        cache[number] = lazy
+        try:
+            cache[number - 1]
+        except KeyError:
+            pass
+    return (perf_counter() - start) / operations
+
+
+def main():
+    operations = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    print('{:>8}  {:>14}  {:>14}'.format('size', 'ordered, us', 'sorted, us'))
+    for size in SIZES:
+        ordered = measure(LazyAwareCache, size, operations)
+        if size <= SORTED_MAX_SIZE:
+            old = '{:14.2f}'.format(measure(SortedLazyAwareCache, size, operations // 20) * 1e6)
+        else:
+            old = '{:>14}'.format('-')
+        print('{:>8}  {:14.2f}  {}'.format(size, ordered * 1e6, old))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+'''
+Benchmark per-body latency of markdown rendering in GitHubReader
+
+Compares creating a new Markdown object for each body (markdown() function)
+with reusing a single instance (render_markdown). Bodies are read from
+GitHubFetcher storage directory if provided, otherwise a small built-in
+corpus is used.
+
+Usage: python benchmarks/markdown_rendering.py [STORAGE_DIR]
+'''
+
+
+import json
+import os
+import sys
+from glob import glob
+from time import perf_counter
+
+from markdown import markdown
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from issyours_github.reader import MARKDOWN_CONFIG, render_markdown
+
+
+BUILTIN_CORPUS = [
+    'Thanks! :+1:',
+    'Fixed in #42',
+    'Steps to reproduce:\n\n1. Run `make demo`\n2. Open http://localhost:8000\n3. See error',
+    '```python\nimport issyours\nprint(issyours.__doc__)\n```\n\nThis fails with `ImportError` :confused:',
+    '- [x] tests\n- [ ] docs\n- [ ] changelog\n\ncc @octocat',
+    '| Option | Value |\n|---|---|\n| a | ~~1~~ 2 |\n| b | 3 |\n\n> quoted text\n> with two lines',
+    '![screenshot](https://user-images.githubusercontent.com/1/2.png)\n\nSee the image above',
+]
+
+
+def corpus(directory=None):
+    if not directory:
+        return BUILTIN_CORPUS * 50
+    bodies = []
+    patterns = ('issue.json', 'comment-*.json')
+    for pattern in patterns:
+        for filename in glob(os.path.join(directory, 'issues', '*', pattern)):
+            with open(filename, encoding='utf-8') as f:
+                body = json.load(f).get('body')
+            if body:
+                bodies.append(body)
+    return bodies
+
+
+def measure(render, bodies):
+    timings = []
+    for body in bodies:
+        start = perf_counter()
+        render(body)
+        timings.append(perf_counter() - start)
+    timings.sort()
+    return dict(
+        mean=sum(timings) / len(timings),
+        median=timings[len(timings) // 2],
+        p95=timings[int(len(timings) * 0.95)],
+    )
+
+
+def main():
+    bodies = corpus(sys.argv[1] if len(sys.argv) > 1 else None)
+    if not bodies:
+        sys.exit('no issue bodies found')
+    fresh = lambda text: markdown(text, **MARKDOWN_CONFIG)
+    for body in bodies:
+        if fresh(body) != render_markdown(body):
+            sys.exit('rendered output differs for body: {!r}'.format(body[:80]))
+    print('Bodies: {}'.format(len(bodies)))
+    for title, render in (('new instance per body', fresh), ('reused instance', render_markdown)):
+        stats = measure(render, bodies)
+        print('{:>22}: mean {mean:.3f} ms, median {median:.3f} ms, p95 {p95:.3f} ms'.format(
+            title,
+            **{k: v * 1000 for k, v in stats.items()}
+        ))
+
+
+if __name__ == '__main__':
+    main()
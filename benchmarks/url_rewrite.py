@@ -0,0 +1,73 @@
+'''
+Benchmark URLRewriter on issue bodies with many rewrite rules
+
+Compares the combined single-pass regex used by URLRewriter with the
+previous approach that applied every rule to the whole string separately.
+Bodies with links are followed by the same number of plain text bodies.
+
+Usage: python benchmarks/url_rewrite.py [RULES]
+'''
+
+
+import os
+import re
+import sys
+from time import perf_counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from issyours.pelican import URLRewriter, _increment_backrefs
+
+
+BODIES = 500
+PARAGRAPH = ('<p>Steps to reproduce are described in <a href="https://github.com/'
+             'project{n}/repo/issues/{n}">issue {n}</a>, see also '
+             '<a href="https://docs.example.com/page{n}.html">the docs</a>.</p>\n')
+TEXT = '<p>Thanks, this works for me now. Closing the issue.</p>\n'
+
+
+def rules(count):
+    return {
+        r'https://github.com/project{}/([^"]+)'.format(n): r'/mirror/{}/\1'.format(n)
+        for n in range(count)
+    }
+
+
+def per_rule_loop(config):
+    '''Previous implementation of URLRewriter'''
+    compiled = {}
+    for prefix, rules in config.items():
+        compiled[prefix] = {
+            re.compile(r'(?P<_prefix><[^>]+href=\s*"\s*){}(?P<_postfix>\s*"[^>]*>)'.format(regex)):
+            r'\g<_prefix>{}\g<_postfix>'.format(_increment_backrefs(substitution))
+            for regex, substitution in rules.items()
+        }
+    def rewrite(html_string, reader_prefix):
+        output = html_string
+        for prefix in (None, reader_prefix):
+            for regex, substitution in compiled.get(prefix, {}).items():
+                output = regex.sub(substitution, output)
+        return output
+    return rewrite
+
+
+def measure(rewrite, bodies):
+    start = perf_counter()
+    output = [rewrite(body, 'GH') for body in bodies]
+    return (perf_counter() - start) / len(bodies), output
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 30
+    config = {None: {}, 'GH': rules(count)}
+    bodies = [PARAGRAPH.format(n=n % count) * 3 for n in range(BODIES)] + [TEXT * 3] * BODIES
+    old, expected = measure(per_rule_loop(config), bodies)
+    new, actual = measure(URLRewriter({'ISSYOURS_REWRITE_URLS': config}).rewrite, bodies)
+    if expected != actual:
+        sys.exit('rewritten bodies differ')
+    print('Rules: {}, bodies: {}'.format(count, len(bodies)))
+    print('{:>16}: {:.1f} us per body'.format('per-rule loop', old * 1e6))
+    print('{:>16}: {:.1f} us per body'.format('combined regex', new * 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -3,9 +3,13 @@ Data classes to be used across Issyours project
 '''
 
 
+import heapq
 import logging
 import re
+import sys
 from datetime import datetime
+from functools import lru_cache
+from itertools import repeat
 
 import attr
 from attr.validators import instance_of, optional
@@ -16,13 +20,53 @@ log = logging.getLogger(__name__)
 
 
 
-@attr.s(frozen=True)
+def trusted_construction(cls):
+    '''
+    Class decorator that adds `trusted()` classmethod to attrs class.
+
+    trusted() accepts the same arguments as the regular constructor
+    and applies defaults and converters but skips validators. It is meant
+    for readers that load data from storage written by Issyours itself
+    '''
+    namespace = dict(new=object.__new__, setattr=object.__setattr__, NOTHING=attr.NOTHING)
+    params, body = [], []
+    for field in attr.fields(cls):
+        name = getattr(field, 'alias', None) or field.name.lstrip('_')  # __init__ argument
+        value = name
+        if field.default is attr.NOTHING:
+            params.append(name)
+        elif isinstance(field.default, attr.Factory):
+            params.append('{}=NOTHING'.format(name))
+            namespace['factory_' + name] = field.default.factory
+            value = 'factory_{0}() if {0} is NOTHING else {0}'.format(name)
+        else:
+            params.append('{0}=default_{0}'.format(name))
+            namespace['default_' + name] = field.default
+        if field.converter is not None:
+            namespace['converter_' + name] = field.converter
+            value = 'converter_{}({})'.format(name, value)
+        body.append('    setattr(self, {!r}, {})'.format(field.name, value))
+    source = '\n'.join([
+        'def trusted(cls, {}):'.format(', '.join(params)),
+        '    \'\'\'Create instance without running validators\'\'\'',
+        '    self = new(cls)',
+    ] + body + ['    return self'])
+    exec(source, namespace)
+    cls.trusted = classmethod(namespace['trusted'])
+    return cls
+
+
+
+@trusted_construction
+@attr.s(frozen=True, slots=True)
 class Person:
     '''
     Minimal information about a person involved in discussion
 
     Attributes
     picture: stream object containing an image in one of common web formats
+             (file objects with `name` attribute may be published without
+             reading them, see issyours.lazy.LazyFile)
     '''
     reader = attr.ib(validator=instance_of(ReaderBase))
     nickname = attr.ib()
@@ -35,16 +79,72 @@ class Person:
 def _role(text):
     if not text or text.strip().lower() in {'none', 'null', 'nul', 'nil'}:
         return ''
-    return text.strip()
+    return sys.intern(text.strip())
+
+
+class _DeferredSlot:
+    '''
+    Data descriptor that wraps a slot of a frozen attrs class. If the stored
+    value is callable, it is called on first access and the result replaces it
+    '''
+
+    def __init__(self, slot):
+        self.slot = slot
+
 
+    def __get__(self, instance, owner=None):
+        if instance is None:
+            return self
+        value = self.slot.__get__(instance, owner)
+        if callable(value):
+            value = value()
+            self.slot.__set__(instance, value)
+        return value
 
 
-@attr.s(frozen=True)
+    def __set__(self, instance, value):
+        self.slot.__set__(instance, value)
+
+
+    def __delete__(self, instance):
+        self.slot.__delete__(instance)
+
+
+    def raw(self, instance):
+        '''Return stored value without calling it'''
+        return self.slot.__get__(instance, type(instance))
+
+
+def deferred(*names):
+    '''
+    Class decorator for slotted attrs classes: listed attributes accept
+    callables with zero arguments that are called when the value is first read
+    '''
+    def decorate(cls):
+        for name in names:
+            setattr(cls, name, _DeferredSlot(cls.__dict__[name]))
+        return cls
+    return decorate
+
+
+def _intern(text):
+    '''Share a single copy of frequently repeated strings'''
+    if type(text) is str:
+        return sys.intern(text)
+    return text
+
+
+
+@trusted_construction
+@deferred('body')
+@attr.s(frozen=True, slots=True)
 class Issue:
     '''
     Contents of individual issue.
 
     Attributes
+    body: HTML string or a callable that accepts zero arguments and returns
+          it (called on first access to `body`)
     attachments: callable that accepts zero arguments and returns a sequence of
                  stream-like objects
     '''
@@ -52,7 +152,7 @@ class Issue:
     uid         = attr.ib()
     author      = attr.ib(type=Person)
     author_role = attr.ib(default='', converter=_role)
-    status      = attr.ib(default='')
+    status      = attr.ib(default='', converter=_intern)
     title       = attr.ib(default='')
     body        = attr.ib(default='')
     original_url         = attr.ib(default='')
@@ -85,39 +185,69 @@ class Issue:
 
     def feed(self, desc=False):
         '''
-        Yield comments and events in chronological order
+        Yield comments, events and other related objects in chronological
+        order (see ReaderBase._feed_sources)
 
         Generates tuples of (object, string) where string describes the kind of
-        object being returned
+        object being returned. Objects with the same timestamp are yielded in
+        the order of their sources
         '''
         sort_by = 'created_at'
+        sources = [
+            zip(iterable, repeat(kind))
+            for kind, iterable in self.reader._feed_sources(self, sort_by, desc)
+        ]
+        yield from heapq.merge(*sources, key=_feed_key, reverse=desc)
 
-        comments = self.comments(sort_by, desc)
-        events = self.events(sort_by, desc)
 
-        comment, event = _get_next(comments), _get_next(events)
-        while True:
-            if not comment and not event:
-                break
-            elif (not event and comment) \
-            or (comment and (comment.created_at <= event.created_at)):
-                yield comment, 'comment'
-                comment = _get_next(comments)
-            else:
-                yield event, 'event'
-                event = _get_next(events)
 
+@trusted_construction
+@attr.s(frozen=True, slots=True)
+class IssueSummary:
+    '''
+    Compact subset of issue fields for listings, see ReaderBase.issue_summaries()
 
+    Attributes
+    author_nickname: nickname of the person who has opened the issue
+    comments: number of comments, None if unknown
+    '''
+    uid             = attr.ib()
+    title           = attr.ib(default='')
+    status          = attr.ib(default='', converter=_intern)
+    author_nickname = attr.ib(default='')
+    labels          = attr.ib(factory=list)
+    comments        = attr.ib(default=None)
+    created_at      = attr.ib(default=None, validator=optional(instance_of(datetime)))
+    modified_at     = attr.ib(default=None, validator=optional(instance_of(datetime)))
+    closed_at       = attr.ib(default=None, validator=optional(instance_of(datetime)))
+
+
+    @classmethod
+    def from_issue(cls, issue):
+        '''
+        Create summary from a full Issue object. Comments are not counted:
+        that would require reading all of them
+        '''
+        return cls(
+            uid=issue.uid,
+            title=issue.title,
+            status=issue.status,
+            author_nickname=issue.author.nickname,
+            labels=issue.labels,
+            created_at=issue.created_at,
+            modified_at=issue.modified_at,
+            closed_at=issue.closed_at,
+        )
 
-def _get_next(iterator, default=None):
-    try:
-        return next(iterator)
-    except StopIteration:
-        return default
 
 
+def _feed_key(item):
+    return item[0].created_at
 
-@attr.s(frozen=True)
+
+
+@trusted_construction
+@attr.s(frozen=True, slots=True)
 class IssueAttachment:
     '''A file that was attached to the issue'''
     name   = attr.ib()
@@ -126,9 +256,16 @@ class IssueAttachment:
 
 
 
-@attr.s(frozen=True)
+@trusted_construction
+@deferred('body')
+@attr.s(frozen=True, slots=True)
 class IssueComment:
-    '''A comment on an issue'''
+    '''
+    A comment on an issue
+
+    Attributes
+    body: HTML string or a callable that returns it, see Issue
+    '''
     issue       = attr.ib(type=Issue)
     author      = attr.ib(type=Person)
     author_role = attr.ib(default='', converter=_role)
@@ -139,12 +276,13 @@ class IssueComment:
 
 
 
-@attr.s(frozen=True)
+@trusted_construction
+@attr.s(frozen=True, slots=True)
 class IssueEvent:
     '''An event that has affected the issue in some way'''
     issue       = attr.ib(type=Issue)
     author      = attr.ib(type=Person)
-    type        = attr.ib()
+    type        = attr.ib(converter=_intern)
     data        = attr.ib()
     created_at  = attr.ib(default=None, validator=optional(instance_of(datetime)))
 
@@ -171,7 +309,8 @@ class IssueEvent:
 
 
 
-@attr.s(frozen=True)
+@trusted_construction
+@attr.s(frozen=True, slots=True)
 class IssueLabel:
     '''
     A label (tag) used to categorize issues
@@ -187,6 +326,13 @@ class IssueLabel:
             raise ValueError('color must be valid RGB hex string starting with #')
 
 
+    @classmethod
+    @lru_cache(maxsize=1024)
+    def interned(cls, name, color):
+        '''Return a shared label object for repeated name and color values'''
+        return cls(name, color)
+
+
     @property
     def is_dark(self):
         '''Return True if label color is considered dark by human eye'''
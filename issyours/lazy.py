@@ -3,9 +3,20 @@ Lazy evaluation and caching tools
 '''
 
 
+import hashlib
+import logging
+import os
+import sys
+import threading
+import weakref
+from collections import OrderedDict
+from functools import partial
+from tempfile import mkstemp
 from types import SimpleNamespace
 from weakref import WeakValueDictionary
 
+log = logging.getLogger(__name__)
+
 
 
 class LazyObject:
@@ -41,17 +52,106 @@ class LazyMetadata(SimpleNamespace):
 
 
     def __init__(self, constructor, args, kwargs):
-        super().__init__(constructor=constructor, args=args, kwargs=kwargs, inner=None)
+        super().__init__(constructor=constructor, args=args, kwargs=kwargs, inner=None,
+                         lock=threading.Lock(), on_init=None)
 
 
     def init(self):
-        '''Actually initialize inner object'''
-        self.inner = self.constructor(*self.args, **self.kwargs)
-        if self.inner is None:
-            raise ValueError('constructor returned None: {}'.format(self.constructor))
+        '''
+        Actually initialize inner object.
+        Constructor is called only once even if many threads need the object.
+        Callable stored in `on_init` (if any) is called afterwards
+        '''
+        with self.lock:
+            if self.inner is not None:
+                return
+            inner = self.constructor(*self.args, **self.kwargs)
+            if inner is None:
+                raise ValueError('constructor returned None: {}'.format(self.constructor))
+            self.inner = inner
+
+            del self.constructor, self.args, self.kwargs
+            self.init = lambda: None
+            on_init, self.on_init = self.on_init, None
+        if on_init is not None:
+            on_init()
+
+
+
+class LazyFile:
+    '''
+    Read-only file object that opens the underlying file on first read and
+    closes it as soon as the end of file is reached
+
+    Any number of these objects may exist at the same time without holding
+    file descriptors. Path to the file is available as `name` attribute
+    '''
+
+
+    def __init__(self, path, mode='rb'):
+        self.name = path
+        self.mode = mode
+        self._file = None
+        self._position = 0
+
+
+    def __repr__(self):
+        return '<{}: {!r}>'.format(self.__class__.__name__, self.name)
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+    def __del__(self):
+        self.close()
+
+
+    def read(self, size=-1):
+        data = self._open().read(size)
+        if not data or size is None or size < 0:
+            self.close()
+        return data
+
+
+    def readinto(self, buffer):
+        count = self._open().readinto(buffer)
+        if not count:
+            self.close()
+        return count
+
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if self._file is None and whence == os.SEEK_SET:
+            self._position = offset
+            return offset
+        return self._open().seek(offset, whence)
 
-        del self.constructor, self.args, self.kwargs
-        self.init = lambda: None
+
+    def tell(self):
+        if self._file is None:
+            return self._position
+        return self._file.tell()
+
+
+    def close(self):
+        '''Close the underlying file, it will be reopened on next read'''
+        if self._file is not None:
+            self._position = self._file.tell()
+            self._file.close()
+            self._file = None
+
+
+    def _open(self):
+        if self._file is None:
+            self._file = open(self.name, self.mode)
+            if self._position:
+                self._file.seek(self._position)
+        return self._file
 
 
 
@@ -62,72 +162,116 @@ class MultiCache:
     This cache stores most recently used items in a regular Python dictionary
     and also keeps weak references to all seen items until they are garbage
     collected
+
+    Number of items in regular dictionary is limited by `maxsize`. If
+    `maxbytes` is provided, their total size as estimated by `sizeof`
+    function is limited too (the most recently used item is always kept).
+
+    All operations are thread safe
     '''
-    # TODO: MultiCache is not thread safe
 
 
-    def __init__(self, maxsize=128):
+    def __init__(self, maxsize=128, maxbytes=None, sizeof=sys.getsizeof):
+        self._lock = threading.RLock()
         self._weak_cache = WeakValueDictionary()
-        self._strong_cache = dict()
+        self._strong_cache = OrderedDict()  # least recently used items first
         self._maxsize = maxsize
-        self._cache_worth = dict()
-        self._lru_clock = 0
+        self._maxbytes = maxbytes
+        self._sizeof = sizeof
+        self._sizes = dict()
+        self._bytes = 0
 
 
-    def _droppable(self):
-        '''
-        Provide the sequence of cache keys that can be dropped safely.
-        Return None if any cache item may be dropped without extra selection step
-        '''
-        # Intended to be implemented in child classes
+    def _touch(self, key, value):
+        '''Mark cache item as the most recently used one'''
+        self._strong_cache[key] = value
+        self._strong_cache.move_to_end(key)
+        if self._maxbytes is not None and key not in self._sizes:
+            self._account(key, self._size(value))
+
+
+    def _size(self, value):
+        '''Estimate memory usage of cache item'''
+        return self._sizeof(value)
+
+
+    def _account(self, key, size):
+        '''Remember size of cache item and update the total'''
+        self._bytes += size - self._sizes.get(key, 0)
+        self._sizes[key] = size
+
+
+    def _oversize(self):
+        '''Check if cache limits are exceeded'''
+        if len(self._strong_cache) > self._maxsize:
+            return True
+        return self._maxbytes is not None \
+               and self._bytes > self._maxbytes \
+               and len(self._strong_cache) > 1
+
+
+    def _victim(self):
+        '''Return the key of cache item that should be dropped next'''
+        return next(iter(self._strong_cache))
+
+
+    def _discard(self, key):
+        '''Remove item from strong cache'''
+        del self._strong_cache[key]
+        self._bytes -= self._sizes.pop(key, 0)
 
 
     def _drop(self):
         '''Drop items that are worth the lowest to maintain max cache size'''
-        oversize = len(self._strong_cache) - self._maxsize
-        if oversize <= 0:
-            return
-
-        droppable_keys = self._droppable()
-        if droppable_keys is not None:
-            droppable_keys = set(droppable_keys)
-            if oversize > len(droppable_keys):
-                # In our use case this should never happen because _drop() is
-                # being called after each __setitem__, so oversize can't be
-                # more than 1
-                raise ValueError('provided set of droppable keys is too small')
-
-        for key in sorted(self._cache_worth, key=self._cache_worth.get):
-            if len(self._strong_cache) > self._maxsize:
-                if droppable_keys and key not in droppable_keys:
-                    continue
-                elif droppable_keys:
-                    droppable_keys.remove(key)
-                self._strong_cache.pop(key)
-                self._cache_worth.pop(key)
-            else:
-                break
+        while self._oversize():
+            self._discard(self._victim())
 
 
     def __setitem__(self, key, value):
-        self._weak_cache[key] = value
-        self._strong_cache[key] = value
-
-        self._lru_clock += 1
-        self._cache_worth[key] = self._lru_clock
-
-        self._drop()
+        with self._lock:
+            if key in self._strong_cache and self._strong_cache[key] is not value:
+                self._discard(key)
+            self._weak_cache[key] = value
+            self._touch(key, value)
+            self._drop()
 
 
     def __getitem__(self, key):
-        value = self._weak_cache[key]
-        self._lru_clock += 1
-        self._cache_worth[key] = self._lru_clock
-        return value
+        with self._lock:
+            value = self._weak_cache[key]
+            self._touch(key, value)  # items referenced elsewhere return to strong cache
+            self._drop()
+            return value
 
 
     def __contains__(self, key):
-        return key in self._weak_cache
+        with self._lock:
+            return key in self._weak_cache
+
+
+    def setdefault(self, key, default):
+        '''
+        Return cached value for the key. If there is none, store and return
+        the default value. Concurrent callers always get the same object
+        '''
+        with self._lock:
+            try:
+                return self[key]
+            except KeyError:
+                self[key] = default
+                return default
+
+
+    def stats(self):
+        '''Return current cache usage'''
+        with self._lock:
+            return dict(
+                weaksize=len(self._weak_cache),
+                lrusize=len(self._strong_cache),
+                maxsize=self._maxsize,
+                bytes=self._bytes if self._maxbytes is not None else None,
+                maxbytes=self._maxbytes,
+            )
 
 
     def __repr__(self):
@@ -141,15 +285,189 @@ class MultiCache:
 
 
 class LazyAwareCache(MultiCache):
-    '''Cache object that drops uninitialized LazyObjects first'''
-
-    def _droppable(self):
-        droppable_keys = set()
-        for key, item in self._strong_cache.items():
-            if item._lazy.inner is None:
-                droppable_keys.add(key)
-        if droppable_keys:
-            return droppable_keys  # Select items to drop from this set
+    '''
+    Cache object that drops uninitialized LazyObjects first
+
+    When `maxbytes` is provided, `sizeof` is applied to the inner object
+    once it is initialized, uninitialized objects are counted as
+    LAZY_OBJECT_SIZE bytes
+    '''
+
+    LAZY_OBJECT_SIZE = 500  # bytes, including metadata and cache entries
+
+
+    def __init__(self, maxsize=128, maxbytes=None, sizeof=sys.getsizeof):
+        super().__init__(maxsize, maxbytes, sizeof)
+        self._uninitialized = OrderedDict()  # keys of strong cache items, least recently used first
+
+
+    def _touch(self, key, value):
+        super()._touch(key, value)
+        if value._lazy.inner is None:
+            self._uninitialized[key] = None
+            self._uninitialized.move_to_end(key)
+            if self._maxbytes is not None:
+                # weak reference avoids cycle value -> on_init -> value that
+                # would keep evicted objects alive until garbage collection
+                value._lazy.on_init = partial(self._initialized, key, weakref.ref(value))
         else:
-            return None  # Use all existing cache items
-                         # if there are no uninitialized ones
+            self._uninitialized.pop(key, None)
+
+
+    def _size(self, value):
+        inner = value._lazy.inner
+        if inner is None:
+            return self.LAZY_OBJECT_SIZE
+        return self.LAZY_OBJECT_SIZE + self._sizeof(inner)
+
+
+    def _initialized(self, key, ref):
+        '''Update size of cache item after LazyObject initialization'''
+        value = ref()
+        with self._lock:
+            if value is None or self._strong_cache.get(key) is not value:
+                return
+            self._uninitialized.pop(key, None)
+            self._account(key, self._size(value))
+            self._drop()
+
+
+    def _victim(self):
+        while self._uninitialized:
+            key = next(iter(self._uninitialized))
+            if self._strong_cache[key]._lazy.inner is None:
+                return key
+            del self._uninitialized[key]  # initialized since it was last used
+        return super()._victim()  # use all existing cache items
+                                  # if there are no uninitialized ones
+
+
+    def _discard(self, key):
+        super()._discard(key)
+        self._uninitialized.pop(key, None)
+
+
+
+class DiskCache:
+    '''
+    Persistent content-addressed cache of text values
+
+    Values are stored in separate files named after SHA-256 hash of their
+    keys. When total size of cached files exceeds `maxsize` bytes, least
+    recently used files are removed until cache shrinks to `shrink_to` of
+    its maximum size.
+    '''
+
+    ENCODING = 'utf-8'
+
+
+    def __init__(self, directory, maxsize=256 * 2**20, shrink_to=0.8):
+        self.directory = directory
+        self.maxsize = maxsize
+        self.shrink_to = shrink_to
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._size = None
+
+
+    def __repr__(self):
+        return '<{cls}: {directory}, hits={hits}, misses={misses}, evictions={evictions}>'.format(
+            cls=self.__class__.__name__,
+            **self.stats()
+        )
+
+
+    def stats(self):
+        '''Return cache usage counters'''
+        return dict(
+            directory=self.directory,
+            hits=self.hits,
+            misses=self.misses,
+            evictions=self.evictions,
+        )
+
+
+    def get(self, key, default=None):
+        '''Return cached value for a given key (string)'''
+        path = self._path(key)
+        try:
+            with open(path, encoding=self.ENCODING) as f:
+                value = f.read()
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+            return default
+        try:
+            os.utime(path)  # mark as recently used
+        except OSError:
+            pass
+        with self._lock:
+            self.hits += 1
+        return value
+
+
+    def set(self, key, value):
+        '''Save value (string) into cache'''
+        path = self._path(key)
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        content = value.encode(self.ENCODING)
+        tmp, tmppath = mkstemp(prefix='.tmp-', dir=directory)
+        try:
+            os.write(tmp, content)
+        finally:
+            os.close(tmp)
+        os.replace(tmppath, path)
+        with self._lock:
+            if self._size is None:
+                self._size = sum(size for _, _, size in self._files())
+            else:
+                self._size += len(content)
+            if self._size > self.maxsize:
+                self._evict()
+
+
+    def cached(self, function, key, *a, **ka):
+        '''Return cached value for the key or calculate it with function(*a, **ka)'''
+        value = self.get(key)
+        if value is None:
+            value = function(*a, **ka)
+            self.set(key, value)
+        return value
+
+
+    def _path(self, key):
+        '''Path to cache file for a given key'''
+        digest = hashlib.sha256(key.encode(self.ENCODING)).hexdigest()
+        return os.path.join(self.directory, digest[:2], digest)
+
+
+    def _files(self):
+        '''Yield (mtime, path, size) for all cached files'''
+        for root, dirs, files in os.walk(self.directory):
+            for filename in files:
+                path = os.path.join(root, filename)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                yield stat.st_mtime, path, stat.st_size
+
+
+    def _evict(self):
+        '''Remove least recently used files (must be called with lock held)'''
+        files = sorted(self._files())
+        self._size = sum(size for _, _, size in files)
+        target = self.maxsize * self.shrink_to
+        for mtime, path, size in files:
+            if self._size <= target:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            self._size -= size
+            self.evictions += 1
+        log.debug('Evicted old items from %r', self)
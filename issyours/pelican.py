@@ -3,16 +3,25 @@ Pelican plugin for rendering issues archive on static website
 '''
 
 
+import errno
+import hashlib
+import json
 import logging
+import multiprocessing
 import os
+import pickle
 import re
+from functools import lru_cache, partial
 from itertools import chain
+
+import pkg_resources
 from pkg_resources import resource_string
 from shutil import copyfileobj
 from types import SimpleNamespace
 
 from pelican import signals
 from pelican.generators import Generator, PelicanTemplateNotFound
+from pelican.utils import get_relative_path, path_to_url
 
 log = logging.getLogger(__name__)
 
@@ -23,6 +32,8 @@ class IssueGenerator(Generator):
     Obtain issue information from storage and create nice pages for each issue
     '''
 
+    CHUNK_SIZE = 8  # issues per task sent to worker process
+
 
     def get_template(self, name):
         try:
@@ -56,6 +67,10 @@ class IssueGenerator(Generator):
                 raise ValueError('non-unique prefix in ISSYOURS_SOURCES: {!r}'.format(prefix))
             self.issue_readers[prefix] = reader
 
+        self.publish_mode = self.settings.get('ISSYOURS_PUBLISH_MODE', 'copy')
+        if self.publish_mode not in {'copy', 'link'}:
+            raise ValueError('unsupported ISSYOURS_PUBLISH_MODE: {!r}'.format(self.publish_mode))
+
         self.issue_template = self.get_template('issue')
         self.index_template = self.get_template('issues')
 
@@ -89,69 +104,288 @@ class IssueGenerator(Generator):
 
 
     def generate_output(self, writer):
+        manifest = BuildManifest(
+            path=self._manifest_path(writer.output_path),
+            fingerprint=self._site_fingerprint(),
+        )
         for prefix, reader in self.issue_readers.items():
-            def get_issue(uid):
-                issue = reader.issue(uid)
-                return IssueWrapper(
-                    issue=issue,
-                    prefix=prefix,
-                    url_pattern=self.url_pattern,
-                    dest_pattern=self.dest_pattern,
-                    rewriter=self.url_rewriter,
-                )
-
-            avatar_pattern = self.settings['ISSYOURS_AVATAR_SAVE_AS']
-            def avatar_url(person):
-                if not person.picture:
-                    return None
-                return avatar_pattern.format(slug=person.nickname, prefix=prefix)
-
-            def attachment_url(attachment, issue):
-                return self.attach_pattern.format(issue=issue.slug, name=attachment.name)
-
+            helpers = self._helpers(prefix, reader)
             issue_uids = list(reader.issue_uids())
-            context = self.context.copy()
-            context['get_issue'] = get_issue
-            writer.write_file(
-                name=_pattern(self.index_dest, prefix=prefix),
-                template=self.index_template,
-                context=context,
-                relative_urls=self.settings['RELATIVE_URLS'],
-                paginated={'issues': issue_uids},
-                template_name='issues',
-                url=_pattern(self.index_url, prefix=prefix),
-            )
-            for uid in issue_uids:
+            reader_fingerprint = reader.fingerprint()
+            previous = manifest.previous(prefix, reader_fingerprint)
+            fingerprints = {uid: reader.issue_fingerprint(uid) for uid in issue_uids}
+            manifest.update(prefix, reader_fingerprint, fingerprints)
+            outdated = [
+                uid for uid in issue_uids
+                if previous is None
+                or fingerprints[uid] is None
+                or previous.get(uid) != fingerprints[uid]
+                or not os.path.exists(os.path.join(
+                    writer.output_path,
+                    _pattern(self.dest_pattern, prefix=prefix, uid=uid, slug=prefix + uid),
+                ))
+            ]
+            if len(outdated) < len(issue_uids):
+                log.info('Rendering %s of %s issues from %r, others are unchanged since last build',
+                         len(outdated), len(issue_uids), reader)
+
+            index_dest = _pattern(self.index_dest, prefix=prefix)
+            if outdated or previous is None or set(previous) != set(issue_uids) \
+            or not os.path.exists(os.path.join(writer.output_path, index_dest)):
+                summaries = [helpers.wrap(summary) for summary in reader.issue_summaries()]
                 context = self.context.copy()
-                context['issue'] = issue = get_issue(uid)
-                context['avatar_url'] = avatar_url
-                context['attachment_url'] = attachment_url
+                context['get_issue'] = helpers.get_issue
                 writer.write_file(
-                    name=issue.save_as,
-                    template=self.issue_template,
+                    name=index_dest,
+                    template=self.index_template,
                     context=context,
                     relative_urls=self.settings['RELATIVE_URLS'],
-                    url=issue.url,
+                    paginated={'issues': summaries},
+                    template_name='issues',
+                    url=_pattern(self.index_url, prefix=prefix),
                 )
-                comment_attachments = (a for c in issue.comments() for a in c.attachments())
-                for attach in chain(issue.attachments(), comment_attachments):
-                    attach_filename = os.path.join(writer.output_path, attachment_url(attach, issue))
-                    os.makedirs(os.path.dirname(attach_filename), exist_ok=True)
-                    with open(attach_filename, 'wb') as attachment:
-                        copyfileobj(attach.stream, attachment)
-                        log.debug('Written attachment for issue %s: %s', issue.slug, attach_filename)
-
 
-            if not avatar_pattern:
+            pool = self._process_pool(reader) if outdated else None
+            if pool is None:
+                for uid in outdated:
+                    context = self._issue_context(helpers, uid)
+                    issue = context['issue']
+                    writer.write_file(
+                        name=issue.save_as,
+                        template=self.issue_template,
+                        context=context,
+                        relative_urls=self.settings['RELATIVE_URLS'],
+                        url=issue.url,
+                    )
+                    self._copy_attachments(helpers, issue, writer.output_path)
+            else:
+                with pool:
+                    tasks = ((prefix, chunk, writer.output_path)
+                             for chunk in _chunks(outdated, self.CHUNK_SIZE))
+                    for pages in pool.imap(_render_issues, tasks):
+                        for save_as, url, html in pages:
+                            writer.write_file(
+                                name=save_as,
+                                template=PrerenderedTemplate(html),
+                                context=self.context.copy(),
+                                relative_urls=self.settings['RELATIVE_URLS'],
+                                url=url,
+                            )
+
+            if not helpers.avatar_pattern:
                 continue
             for person in reader.persons():
                 if not person.picture:
                     continue
-                avatar_path = os.path.join(writer.output_path, avatar_url(person))
-                os.makedirs(os.path.dirname(avatar_path), exist_ok=True)
-                with open(avatar_path, 'wb') as avatar:
-                    copyfileobj(person.picture, avatar)
+                avatar_path = os.path.join(writer.output_path, helpers.avatar_url(person))
+                if previous is not None and _file_path(person.picture) is None \
+                and os.path.exists(avatar_path):
+                    continue  # files are compared by _publish_file, other streams are not
+                if _publish_file(person.picture, avatar_path, self.publish_mode):
                     log.debug('Written user picture for %s: %s', person.nickname, avatar_path)
+        manifest.save()
+        log.debug('URL rewrite cache: %s', self.url_rewriter.stats())
+
+
+    def _manifest_path(self, output_path):
+        '''Path to build manifest, None if incremental builds are disabled'''
+        manifest = self.settings.get('ISSYOURS_MANIFEST', '.issyours-manifest.json')
+        if not manifest:
+            return None
+        return os.path.join(output_path, manifest)
+
+
+    def _site_fingerprint(self):
+        '''
+        Hash of everything besides issue data that affects rendered pages:
+        Pelican settings, templates and the list of other site content
+        '''
+        digest = hashlib.sha256()
+        def update(value):
+            digest.update(_stable_repr(value).encode('utf-8'))
+            digest.update(b'\0')
+
+        try:
+            update(pkg_resources.get_distribution('issyours').version)
+        except pkg_resources.DistributionNotFound:
+            pass
+        update(self.settings)
+        try:
+            template_names = self.env.list_templates()
+        except TypeError:  # loader does not support listing
+            template_names = []
+        for name in sorted(template_names):
+            update(self.env.loader.get_source(self.env, name)[0])
+        package = __name__.split('.')[0]
+        for name in ('issue', 'issues'):
+            update(resource_string(package, 'templates/{}.html'.format(name)))
+        for key in ('articles', 'pages', 'hidden_pages'):
+            update([(c.url, c.title) for c in self.context.get(key, ())])
+        for key in ('categories', 'tags', 'authors'):
+            update([item[0] if isinstance(item, tuple) else item
+                    for item in self.context.get(key, ())])
+        return digest.hexdigest()
+
+
+    def _helpers(self, prefix, reader):
+        '''Functions used by templates to render issues from a given reader'''
+        def wrap(issue):
+            return IssueWrapper(
+                issue=issue,
+                prefix=prefix,
+                url_pattern=self.url_pattern,
+                dest_pattern=self.dest_pattern,
+                rewriter=self.url_rewriter,
+            )
+
+        def get_issue(uid):
+            if not isinstance(uid, str):  # IssueSummary or its wrapper
+                uid = uid.uid
+            return wrap(reader.issue(uid))
+
+        avatar_pattern = self.settings['ISSYOURS_AVATAR_SAVE_AS']
+        def avatar_url(person):
+            if not person.picture:
+                return None
+            return avatar_pattern.format(slug=person.nickname, prefix=prefix)
+
+        def attachment_url(attachment, issue):
+            return self.attach_pattern.format(issue=issue.slug, name=attachment.name)
+
+        return SimpleNamespace(
+            wrap=wrap,
+            get_issue=get_issue,
+            avatar_pattern=avatar_pattern,
+            avatar_url=avatar_url,
+            attachment_url=attachment_url,
+        )
+
+
+    def _issue_context(self, helpers, uid):
+        '''Template context for a single issue page'''
+        context = self.context.copy()
+        context['issue'] = helpers.get_issue(uid)
+        context['avatar_url'] = helpers.avatar_url
+        context['attachment_url'] = helpers.attachment_url
+        return context
+
+
+    def _copy_attachments(self, helpers, issue, output_path):
+        '''Copy issue and comment attachments to output directory'''
+        comment_attachments = (a for c in issue.comments() for a in c.attachments())
+        for attach in chain(issue.attachments(), comment_attachments):
+            attach_filename = os.path.join(output_path, helpers.attachment_url(attach, issue))
+            if _publish_file(attach.stream, attach_filename, self.publish_mode):
+                log.debug('Written attachment for issue %s: %s', issue.slug, attach_filename)
+
+
+    def _render_issue(self, helpers, uid, output_path):
+        '''
+        Render issue page without writing it and copy its attachments.
+        Return (save_as, url, html) tuple
+        '''
+        context = self._issue_context(helpers, uid)
+        issue = context['issue']
+        html = _render_page(
+            template=self.issue_template,
+            context=context,
+            name=issue.save_as,
+            relative_urls=self.settings['RELATIVE_URLS'],
+        )
+        self._copy_attachments(helpers, issue, output_path)
+        return issue.save_as, issue.url, html
+
+
+    def _process_pool(self, reader):
+        '''
+        Create a pool of worker processes for rendering issues from a given
+        reader. Return None if issues should be rendered sequentially.
+
+        Worker processes inherit the generator state via fork() and construct
+        their own copy of reader from its pickled representation.
+        '''
+        jobs = self.settings.get('ISSYOURS_JOBS', 1)
+        if jobs == 0:
+            jobs = os.cpu_count() or 1
+        if jobs <= 1:
+            return None
+        if 'fork' not in multiprocessing.get_all_start_methods():
+            log.warning('ISSYOURS_JOBS requires fork() support, rendering issues sequentially')
+            return None
+        try:
+            pickled_reader = pickle.dumps(reader)
+        except Exception as exc:
+            log.warning('Can not pass %r to worker processes (%s), '
+                        'rendering issues sequentially', reader, exc)
+            return None
+        return multiprocessing.get_context('fork').Pool(
+            processes=jobs,
+            initializer=_init_worker,
+            initargs=(self, pickled_reader),
+        )
+
+
+
+class BuildManifest:
+    '''
+    Fingerprints of issues rendered by previous build, stored in output
+    directory. Previous fingerprints are discarded if site fingerprint
+    (settings, templates, etc) has changed
+    '''
+
+    VERSION = 1
+
+
+    def __init__(self, path, fingerprint):
+        self.path = path
+        self.fingerprint = fingerprint
+        self.sources = {}
+        self._previous = self._load()
+
+
+    def _load(self):
+        if not self.path:
+            return {}
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as exc:
+            log.warning('Ignoring unreadable build manifest %s: %s', self.path, exc)
+            return {}
+        if data.get('version') != self.VERSION or data.get('fingerprint') != self.fingerprint:
+            log.info('Settings or templates have changed since last build, rendering all issues')
+            return {}
+        return data.get('sources', {})
+
+
+    def previous(self, prefix, reader_fingerprint):
+        '''
+        Return issue fingerprints from previous build as {uid: fingerprint}
+        or None if there was no previous build for this reader state
+        '''
+        source = self._previous.get(prefix)
+        if reader_fingerprint is None or source is None \
+        or source['reader'] != reader_fingerprint:
+            return None
+        return source['issues']
+
+
+    def update(self, prefix, reader_fingerprint, issues):
+        '''Record fingerprints of current build'''
+        self.sources[prefix] = dict(reader=reader_fingerprint, issues=issues)
+
+
+    def save(self):
+        if not self.path:
+            return
+        data = dict(version=self.VERSION, fingerprint=self.fingerprint, sources=self.sources)
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        temp = self.path + '.tmp'
+        with open(temp, 'w', encoding='utf-8') as f:
+            json.dump(data, f, indent=2, sort_keys=True)
+        os.replace(temp, self.path)
 
 
 
@@ -183,8 +417,8 @@ class IssueWrapper:
             yield CommentWrapper(comment, self._issue.prefix, self._issue.rewriter)
 
 
-    def feed(self):
-        for item, kind in self._issue.ref.feed():
+    def feed(self, desc=False):
+        for item, kind in self._issue.ref.feed(desc):
             if kind == 'comment':
                 yield CommentWrapper(item, self._issue.prefix, self._issue.rewriter), kind
             else:
@@ -249,37 +483,226 @@ class CommentWrapper:
 class URLRewriter:
     '''
     Handle custom URL rewrites in issue body and in comments
+
+    Rules of each scope (global or reader prefix) are combined into a single
+    regular expression, the first matching rule is applied to each link.
+    Global rules are applied before the reader-specific ones.
+    Results are cached, because templates may access the same body many times
     '''
 
     HREF = r'(?P<_prefix><[^>]+href=\s*"\s*){}(?P<_postfix>\s*"[^>]*>)'
     SUB  = r'\g<_prefix>{}\g<_postfix>'
+    COMBINED = r'<[^>]+href=\s*"\s*(?:{})\s*"[^>]*>'
+    RULE = r'(?P<_rule{index}>{regex})'
+    CACHE_SIZE = 1024  # rewritten bodies
 
     def __init__(self, settings):
         config = settings.get('ISSYOURS_REWRITE_URLS', {})
         self.rules = {}
         for prefix, rules in config.items():
-            self.rules[prefix] = self._compile(rules)
+            if rules:
+                self.rules[prefix] = self._compile(rules)
+        self._cached_rewrite = lru_cache(maxsize=self.CACHE_SIZE)(self._rewrite)
+
+
+    def stats(self):
+        '''Return cache usage counters'''
+        info = self._cached_rewrite.cache_info()
+        return dict(hits=info.hits, misses=info.misses, size=info.currsize)
 
 
     def _compile(self, rules):
-        compiled = {}
-        for regex, substitution in rules.items():
-            regex = re.compile(self.HREF.format(regex))
-            subst = self.SUB.format(_increment_backrefs(substitution))
-            compiled[regex] = subst
-        return compiled
+        '''Return a function that applies all rules to a string'''
+        separate = [
+            (re.compile(self.HREF.format(regex)), self.SUB.format(_increment_backrefs(substitution)))
+            for regex, substitution in rules.items()
+        ]
+        if len(separate) == 1:
+            regex, substitution = separate[0]
+            return partial(regex.sub, substitution)
+        try:
+            combined = re.compile(self.COMBINED.format('|'.join(
+                self.RULE.format(regex=regex, index=index)
+                for index, regex in enumerate(rules)
+            )))
+        except re.error as exc:  # e.g. the same group name used in several rules
+            log.warning('Can not combine URL rewrite rules (%s), '
+                        'applying them one by one', exc)
+            return self._compile_separately(rules)
+
+        substitutions = {
+            '_rule{}'.format(index): partial(regex.sub, substitution, count=1)
+            for index, (regex, substitution) in enumerate(separate)
+        }
+        def substitute(match):
+            # Combined regex finds the link and the first matching rule,
+            # then rule's own regex replaces the link
+            return substitutions[match.lastgroup](match.group(0))
+        return partial(combined.sub, substitute)
+
+
+    def _compile_separately(self, rules):
+        '''Return a function that applies rules one after another'''
+        compiled = [self._compile({regex: substitution})
+                    for regex, substitution in rules.items()]
+        def rewrite(html_string):
+            for function in compiled:
+                html_string = function(html_string)
+            return html_string
+        return rewrite
 
 
     def rewrite(self, html_string, reader_prefix):
         '''Apply rewrite rules to HTML string'''
+        if 'href' not in html_string:
+            return html_string
+        if None not in self.rules and reader_prefix not in self.rules:
+            return html_string
+        return self._cached_rewrite(html_string, reader_prefix)
+
+
+    def _rewrite(self, html_string, reader_prefix):
         output = html_string
         for prefix in (None, reader_prefix):
-            for regex, substitution in self.rules.get(prefix, {}).items():
-                output = regex.sub(substitution, output)
+            rewrite = self.rules.get(prefix)
+            if rewrite is not None:
+                output = rewrite(output)
         return output
 
 
 
+class PrerenderedTemplate:
+    '''Template-like object that returns HTML rendered in worker process'''
+
+    def __init__(self, html):
+        self.html = html
+
+    def render(self, *a, **ka):
+        return self.html
+
+
+
+def _render_page(template, context, name, relative_urls):
+    '''Render template exactly like pelican.writers.Writer.write_file() does'''
+    localcontext = context.copy()
+    localcontext['localsiteurl'] = localcontext.get('localsiteurl', None)
+    if relative_urls:
+        relative_url = path_to_url(get_relative_path(name))
+        localcontext['SITEURL'] = relative_url
+        localcontext['localsiteurl'] = relative_url
+    localcontext['output_file'] = name
+    return template.render(localcontext)
+
+
+_worker = SimpleNamespace(generator=None, reader=None)
+
+
+def _init_worker(generator, pickled_reader):
+    '''Initialize worker process'''
+    _worker.generator = generator
+    _worker.reader = pickle.loads(pickled_reader)
+
+
+def _render_issues(task):
+    '''Render a chunk of issues in worker process'''
+    prefix, uids, output_path = task
+    generator = _worker.generator
+    helpers = generator._helpers(prefix, _worker.reader)
+    return [generator._render_issue(helpers, uid, output_path) for uid in uids]
+
+
+def _chunks(sequence, size):
+    '''Split sequence into chunks of given size'''
+    for start in range(0, len(sequence), size):
+        yield sequence[start:start + size]
+
+
+def _publish_file(stream, dest, mode='copy'):
+    '''
+    Write the contents of stream to dest. Return False if dest is already
+    up to date.
+
+    Streams backed by regular files are hardlinked (mode='link') or copied
+    with copy_file_range() which creates a reflink on filesystems that
+    support it. Copies keep modification time of the source, so files with
+    the same size and mtime are skipped on the next build.
+    Other streams are copied byte by byte every time.
+    '''
+    source = _file_path(stream)
+    if source:
+        source_stat = os.stat(source)
+        try:
+            dest_stat = os.stat(dest)
+        except FileNotFoundError:
+            dest_stat = None
+        if dest_stat is not None:
+            if os.path.samestat(source_stat, dest_stat):
+                if mode == 'link':
+                    return False
+            elif dest_stat.st_size == source_stat.st_size \
+            and dest_stat.st_mtime_ns == source_stat.st_mtime_ns:
+                return False
+
+    os.makedirs(os.path.dirname(dest), exist_ok=True)
+    if os.path.lexists(dest):
+        os.unlink(dest)  # never write through a hardlink into storage directory
+    if source and mode == 'link':
+        try:
+            os.link(source, dest)
+            return True
+        except OSError as exc:
+            log.debug('Can not hardlink %s (%s), copying instead', source, exc)
+    if source:
+        with open(source, 'rb') as src, open(dest, 'wb') as dst:
+            _copy_file(src, dst, source_stat.st_size)
+        os.utime(dest, ns=(source_stat.st_atime_ns, source_stat.st_mtime_ns))
+    else:
+        with open(dest, 'wb') as dst:
+            copyfileobj(stream, dst)
+    return True
+
+
+def _file_path(stream):
+    '''Path to the regular file behind stream object, None for other streams'''
+    name = getattr(stream, 'name', None)
+    if isinstance(name, str) and os.path.isfile(name):
+        return name
+    return None
+
+
+def _copy_file(src, dst, size):
+    '''Copy file contents in kernel space if possible'''
+    copy_file_range = getattr(os, 'copy_file_range', None)
+    if copy_file_range:
+        copied = 0
+        try:
+            while copied < size:
+                chunk = copy_file_range(src.fileno(), dst.fileno(), size - copied)
+                if not chunk:
+                    break
+                copied += chunk
+            return
+        except OSError as exc:
+            if exc.errno not in {errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.EPERM}:
+                raise
+            src.seek(0)
+            dst.seek(0)
+            dst.truncate()
+    copyfileobj(src, dst)
+
+
+def _stable_repr(obj, __address=re.compile(r' at 0x[0-9a-fA-F]+')):
+    '''String representation that does not change between Python processes'''
+    if isinstance(obj, dict):
+        items = sorted('{}: {}'.format(_stable_repr(k), _stable_repr(v)) for k, v in obj.items())
+        return '{' + ', '.join(items) + '}'
+    if isinstance(obj, (set, frozenset)):
+        return '{' + ', '.join(sorted(_stable_repr(x) for x in obj)) + '}'
+    if isinstance(obj, (list, tuple)):
+        return '[' + ', '.join(_stable_repr(x) for x in obj) + ']'
+    return __address.sub('', repr(obj))
+
+
 def _increment_backrefs(pattern, increment=1):
     '''Increment all backreferences by a number'''
     BACKSLASH = '\\'
@@ -3,7 +3,12 @@ Common methods for reading issues data from any storage
 '''
 
 
+import sys
 from abc import ABC, abstractmethod
+from functools import partial
+from inspect import Parameter, signature
+
+import attr
 
 from issyours.lazy import LazyAwareCache, LazyObject
 
@@ -13,21 +18,62 @@ class ReaderBase(ABC):
     '''
     Abstract base class that implements caching and lazy evaluation for any
     issue reader
+
+    Readers should be picklable (preferably by storing only the source
+    configuration) to be used with parallel rendering in worker processes.
+    Cached issue and person objects may be shared between threads, so
+    storage access methods should be thread safe
     '''
 
     ISSUE_CACHE_SIZE = 50
     PERSON_CACHE_SIZE = 50
+    ISSUE_CACHE_BYTES = None  # approximate memory budget, no limit if None
+    PERSON_CACHE_BYTES = None
+    TRUSTED_STORAGE = False  # skip validation of data read from storage
 
 
     @abstractmethod
     def __init__(self):
-        self._issues_cache = LazyAwareCache(maxsize=self.ISSUE_CACHE_SIZE)
-        self._persons_cache = LazyAwareCache(maxsize=self.PERSON_CACHE_SIZE)
+        self._issues_cache = LazyAwareCache(
+            maxsize=self.ISSUE_CACHE_SIZE,
+            maxbytes=self.ISSUE_CACHE_BYTES,
+            sizeof=approximate_size,
+        )
+        self._persons_cache = LazyAwareCache(
+            maxsize=self.PERSON_CACHE_SIZE,
+            maxbytes=self.PERSON_CACHE_BYTES,
+            sizeof=approximate_size,
+        )
+
+
+    def _new(self, cls, *a, **ka):
+        '''
+        Create data object (see issyours.data). Validators are skipped if the
+        reader trusts its storage
+        '''
+        if self.TRUSTED_STORAGE:
+            return cls.trusted(*a, **ka)
+        return cls(*a, **ka)
+
+
+    def cache_stats(self):
+        '''Return current usage of issue and person caches'''
+        return dict(
+            issues=self._issues_cache.stats(),
+            persons=self._persons_cache.stats(),
+        )
 
 
     @abstractmethod
-    def issue_uids(self, sort_by='created_at', desc=True):
-        '''Yield unique identificators for all issues contained in Storage'''
+    def issue_uids(self, sort_by='created_at', desc=True, status=None, label=None):
+        '''
+        Yield unique identificators for all issues contained in Storage.
+
+        Issues may be sorted by 'created_at', 'modified_at', 'closed_at',
+        'comments' (number of comments) and 'status', and filtered by status
+        and by label name. Readers should raise NotImplementedError for
+        unsupported sorting methods and filters.
+        '''
 
 
     @abstractmethod
@@ -55,12 +101,70 @@ class ReaderBase(ABC):
         '''Yield events for a given issue object'''
 
 
-    def issues(self, sort_by='created_at', desc=True):
+    def fingerprint(self):
+        '''
+        Return a string that changes whenever data shared by all issues
+        (person details, rendering options) changes, or None if unknown.
+        Used together with issue_fingerprint() for incremental builds.
+        Contents of avatar images are not included: they are published
+        separately and do not affect issue pages
+        '''
+        return None
+
+
+    def issue_fingerprint(self, uid):
+        '''
+        Return a string that changes whenever any data shown on the issue
+        page (issue, comments, events, attachments) changes, or None if
+        unknown. Issues without fingerprint are rendered on every build
+        '''
+        return None
+
+
+    def _feed_sources(self, issue, sort_by='created_at', desc=False):
+        '''
+        Return a list of (kind, iterable) pairs for all kinds of objects shown
+        in issue feed. Each iterable must be sorted by the same key.
+        Readers may add other kinds of objects (reviews, cross-references)
+        '''
+        return [
+            ('comment', self._get_comments(issue, sort_by, desc)),
+            ('event', self._get_events(issue, sort_by, desc)),
+        ]
+
+
+    def issue_summaries(self, sort_by='created_at', desc=True, status=None, label=None):
+        '''
+        Return the list of IssueSummary objects in the specified order (see
+        issue_uids). Default implementation reads all issues, readers should
+        override it if summaries can be obtained in a cheaper way
+        '''
+        from issyours.data import IssueSummary
+        return [IssueSummary.from_issue(issue) for issue in self.issues(sort_by, desc, status, label)]
+
+
+    def issues(self, sort_by='created_at', desc=True, status=None, label=None):
         '''Yield Issue objects in the specified order'''
-        for uid in self.issue_uids(sort_by, desc):
+        for uid in self._filtered_uids(sort_by, desc, status=status, label=label):
             yield self.issue(uid)
 
 
+    def _filtered_uids(self, sort_by, desc, **filters):
+        '''
+        Call issue_uids() with the filters that are set. Readers that do not
+        accept filter arguments keep working as long as no filter is used
+        '''
+        filters = {name: value for name, value in filters.items() if value is not None}
+        parameters = signature(self.issue_uids).parameters
+        if not any(p.kind is Parameter.VAR_KEYWORD for p in parameters.values()):
+            unsupported = sorted(set(filters) - set(parameters))
+            if unsupported:
+                raise NotImplementedError('{} can not filter issues by {}'.format(
+                    self.__class__.__name__, ', '.join(unsupported)
+                ))
+        return self.issue_uids(sort_by, desc, **filters)
+
+
     def issue(self, uid):
         '''
         Return a single Issue object from Storage.
@@ -94,6 +198,34 @@ def lazy_method(cache, method, key):
     try:
         return cache[key]
     except KeyError:
-        value = LazyObject(method, key)
-        cache[key] = value
-        return value
+        return cache.setdefault(key, LazyObject(method, key))
+
+
+def approximate_size(obj):
+    '''
+    Estimate memory usage of an issue or a person object in bytes.
+
+    Text fields, labels and attachment metadata are counted, related persons
+    are not (they are cached separately)
+    '''
+    size = sys.getsizeof(obj)
+    for field in attr.fields(obj.__class__):
+        descriptor = getattr(obj.__class__, field.name, None)
+        if hasattr(descriptor, 'raw'):  # do not evaluate deferred values
+            value = descriptor.raw(obj)
+        else:
+            value = getattr(obj, field.name)
+        if isinstance(value, str):
+            size += sys.getsizeof(value)
+        elif field.name == 'labels':
+            size += sys.getsizeof(value)
+            size += sum(sys.getsizeof(l.name) + sys.getsizeof(l.color) for l in value)
+        elif field.name == 'attachments':
+            size += sum(sys.getsizeof(a) + sys.getsizeof(a.name) + sys.getsizeof(a.original_url)
+                        for a in value())
+        elif isinstance(value, list):
+            size += sys.getsizeof(value)
+        elif isinstance(value, partial):  # deferred value, e.g. markdown source of body
+            size += sys.getsizeof(value)
+            size += sum(sys.getsizeof(a) for a in value.args if isinstance(a, str))
+    return size
@@ -0,0 +1,299 @@
+'''
+Interact with GitHub REST API (v3) using asyncio
+
+This module requires aiohttp (install Issyours with "async" extras)
+and Python 3.6+
+'''
+
+
+import asyncio
+import json
+import logging
+import time
+from urllib.parse import urljoin
+
+import aiohttp
+
+from issyours_github.api import (
+    GitHubAPICaller,
+    GitHubAPIError,
+    GitHubNotModifiedException,
+    GitHubTimestamp,
+)
+
+log = logging.getLogger('issyours.' + __name__.strip('issyours_'))
+
+
+
+class AsyncGitHubRateLimit:
+    '''
+    Rate limiter for GitHub that does not block the event loop
+
+    Only the coroutines that are about to make a request wait for the rate
+    limit to be reset, all other tasks keep running
+    '''
+
+    def __init__(self):
+        self.lock = None  # asyncio.Lock must be created within the event loop
+        self.clock = time.time
+        self.reset_time = None
+        self.remaining = None
+
+
+    def __repr__(self):
+        return '<{}: remaining={}, reset_time={}>'.format(
+            self.__class__.__name__,
+            self.remaining,
+            self.reset_time,
+        )
+
+
+    async def sleep(self):
+        '''Sleep until rate limit is reset'''
+        if self.lock is None:
+            self.lock = asyncio.Lock()
+        async with self.lock:
+            if self.remaining is not None and not self.remaining:
+                log.debug('Sleeping until rate limit is reset')
+                await asyncio.sleep(max(self.reset_time - self.clock(), 0))
+                self.remaining = None
+
+
+    def update(self, response):
+        '''Update rate limit stats from HTTP response headers'''
+        self.reset_time = int(response.headers['X-RateLimit-Reset'])
+        self.remaining = int(response.headers['X-RateLimit-Remaining'])
+
+
+
+class AsyncGitHubResponse:
+    '''
+    Fully read HTTP response.
+    Mimics the subset of requests.Response interface used by Issyours.
+    '''
+
+    def __init__(self, url, status_code, headers, links, content):
+        self.url = url
+        self.status_code = status_code
+        self.headers = headers
+        self.links = links
+        self.content = content
+
+
+    def __repr__(self):
+        return '<{}: {} {}>'.format(self.__class__.__name__, self.status_code, self.url)
+
+
+    def json(self):
+        return json.loads(self.content.decode('utf-8'))
+
+
+    def raise_for_status(self):
+        if 400 <= self.status_code < 600:
+            raise GitHubAPIError('HTTP {} for url: {}'.format(self.status_code, self.url))
+
+
+
+class AsyncGitHubAPICaller:
+    '''
+    Low level read only GitHub REST API (v3) client for asyncio
+
+    Must be used as an asynchronous context manager or closed explicitly
+    with close() coroutine. Up to `pool_size` keep-alive connections are
+    shared by all concurrent requests, the rest are waiting in the queue.
+    '''
+
+    API_ROOT = GitHubAPICaller.API_ROOT
+    USER_AGENT = GitHubAPICaller.USER_AGENT
+    ACCEPT = GitHubAPICaller.ACCEPT
+
+
+    def __init__(self, token, pool_size=10):
+        '''Initialize API client with OAuth token'''
+        self._rate_limit = AsyncGitHubRateLimit()
+        self._token = token
+        self._pool_size = pool_size
+        self._session = None
+
+
+    async def __aenter__(self):
+        return self
+
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+
+    async def close(self):
+        '''Close all open connections'''
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+
+    @property
+    def _requests(self):
+        '''HTTP client session (must be created within a running event loop)'''
+        if self._session is None:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self._pool_size),
+                headers={
+                    'Accept': self.ACCEPT,
+                    'Authorization': 'token {}'.format(self._token),
+                    'User-Agent': self.USER_AGENT,
+                },
+            )
+        return self._session
+
+
+    async def single(self, endpoint=None, params=None, since=None, url=None):
+        '''Fetch a single API response'''
+        headers = self._headers(since=since)
+        return await self._call(endpoint, params, headers, url)
+
+
+    async def pages(self, endpoint=None, params=None, since=None, url=None):
+        '''Iterate over paginated API responses'''
+        headers = self._headers(since=since)
+        response = await self._call(endpoint, params, headers, url)
+        yield response
+        while 'next' in response.links:
+            response = await self._call(url=response.links['next']['url'], headers=headers)
+            yield response
+
+
+    async def _get(self, url, params=None, headers=None):
+        '''Execute GET request to a given URL'''
+        await self._rate_limit.sleep()
+        async with self._requests.get(url, params=params, headers=headers) as raw:
+            response = AsyncGitHubResponse(
+                url=str(raw.url),
+                status_code=raw.status,
+                headers=raw.headers,
+                links={rel: {'url': str(link['url'])} for rel, link in raw.links.items()},
+                content=await raw.read(),
+            )
+        self._rate_limit.update(response)
+        self._check(response)
+        return response
+
+
+    async def _call(self, endpoint=None, params=None, headers=None, url=None):
+        '''Make a single API call'''
+        if endpoint:
+            url = urljoin(self.API_ROOT, endpoint)
+        if not url:
+            raise ValueError('either url or endpoint must be provided')
+        return await self._get(url, params=params, headers=headers)
+
+
+    _check = GitHubAPICaller._check
+    _headers = GitHubAPICaller._headers
+
+
+
+class AsyncGitHubAPI:
+    '''
+    High level read only GitHub REST API (v3) client for asyncio
+    '''
+
+    def __init__(self, token, pool_size=10):
+        '''Initialize API client with OAuth token'''
+        self.api = AsyncGitHubAPICaller(token, pool_size=pool_size)
+
+
+    async def __aenter__(self):
+        return self
+
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+
+    async def close(self):
+        '''Close all open connections'''
+        await self.api.close()
+
+
+    async def issues(self, owner, repo, since=None, refetch=False):
+        '''
+        Iterate over issue dictionaries.
+        See GitHubAPI.issues() for the meaning of `refetch`. When enabled,
+        issues from each list page are requested concurrently.
+        '''
+        endpoint = 'repos/{owner}/{repo}/issues'.format(owner=owner, repo=repo)
+        params = {
+            'filter': 'all',
+            'state': 'all',
+            'per_page': 100,
+        }
+        if since:
+            params['since'] = GitHubTimestamp(since).isotime
+
+        async for response in self.api.pages(endpoint, params=params):
+            if not refetch:
+                for issue in response.json():
+                    yield issue
+                continue
+            page = [self._issue(issue['url'], since) for issue in response.json()]
+            for data in await asyncio.gather(*page):
+                if data is not None:
+                    yield data
+
+
+    async def _issue(self, url, since=None):
+        '''Fetch a single issue, return None if it was not modified'''
+        try:
+            response = await self.api.single(url=url, since=since)
+        except GitHubNotModifiedException:
+            return None
+        data = response.json()
+        if 'Last-Modified' in response.headers:
+            data['header-last-modified'] = response.headers['Last-Modified']
+        return data
+
+
+    async def comments(self, owner=None, repo=None, issue_no=None, since=None, url=None):
+        '''Iterate over comment dictionaries'''
+        kwargs = self._nested(owner, repo, issue_no, since, url, 'comments')
+        async for response in self.api.pages(**kwargs):
+            for comment in response.json():
+                yield comment
+
+
+    async def events(self, owner=None, repo=None, issue_no=None, since=None, url=None):
+        '''Iterate over event dictionaries'''
+        kwargs = self._nested(owner, repo, issue_no, since, url, 'events')
+        async for response in self.api.pages(**kwargs):
+            for event in response.json():
+                yield event
+
+
+    async def person(self, nickname=None, since=None, url=None):
+        '''Get information about specific GitHub user'''
+        kwargs = {'since': since}
+        if not url:
+            kwargs['endpoint'] = 'users/{}'.format(nickname)
+        else:
+            kwargs['url'] = url
+        response = await self.api.single(**kwargs)
+        return response.json()
+
+
+    @staticmethod
+    def _nested(owner, repo, issue_no, since, url, kind):
+        '''Build keyword arguments for requesting issue comments or events'''
+        kwargs = {}
+        if not url:
+            kwargs['endpoint'] = 'repos/{owner}/{repo}/issues/{number}/{kind}'.format(
+                owner=owner,
+                repo=repo,
+                number=issue_no,
+                kind=kind,
+            )
+        else:
+            kwargs['url'] = url
+        kwargs['params'] = {'per_page': 100}
+        if since:
+            kwargs['params']['since'] = GitHubTimestamp(since).isotime
+        return kwargs
@@ -10,7 +10,7 @@ import threading
 import time
 from datetime import datetime, timezone
 from functools import total_ordering
-from urllib.parse import urljoin
+from urllib.parse import parse_qsl, urlencode, urljoin, urlsplit, urlunsplit
 
 import requests
 
@@ -74,17 +74,31 @@ class GitHubAPICaller:
 
     API_ROOT = 'https://api.github.com'
     USER_AGENT = 'Issue backup fetcher v0.7.0 <https://github.com/sio/issyours/>'
+    ACCEPT = ('application/vnd.github.v3+json,'
+              'application/vnd.github.symmetra-preview+json,'
+              'application/vnd.github.squirrel-girl-preview+json')
 
 
-    def __init__(self, token):
-        '''Initialize API client with OAuth token'''
+    def __init__(self, token, pool_size=10, cache=None):
+        '''
+        Initialize API client with OAuth token.
+        Up to `pool_size` HTTP connections will be kept open for reuse by
+        concurrent threads.
+
+        Optional `cache` object must provide get(url) and set(url, entry)
+        methods (see GitHubResponseCache in fetcher module). Cached responses
+        are revalidated with conditional requests and reused when GitHub
+        replies with 304 Not Modified.
+        '''
         self._rate_limit = GitHubRateLimit()
+        self._cache = cache
 
         session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
         session.headers.update({
-            'Accept': ('application/vnd.github.v3+json,'
-                       'application/vnd.github.symmetra-preview+json,'
-                       'application/vnd.github.squirrel-girl-preview+json'),
+            'Accept': self.ACCEPT,
             'Authorization': 'token {}'.format(token),
             'User-Agent': self.USER_AGENT,
         })
@@ -107,12 +121,30 @@ class GitHubAPICaller:
             yield response
 
 
-    def _get(self, url, *a, **ka):
+    def _get(self, url, params=None, headers=None):
         '''Execute GET request to a given URL'''
+        headers = headers or {}
+        cache_key = cached = None
+        if self._cache is not None and 'If-Modified-Since' not in headers:
+            # Explicit If-Modified-Since means that caller wants to skip
+            # unchanged objects altogether, cache is not useful then
+            cache_key = _cache_key(url, params)
+            cached = self._cache.get(cache_key)
+            if cached:
+                headers = dict(headers, **CachedResponse.validators(cached))
+
         self._rate_limit.sleep()
-        response = self._requests.get(url, *a, **ka)
+        response = self._requests.get(url, params=params, headers=headers)
         self._rate_limit.update(response)
+
+        if cached and response.status_code == 304:
+            log.debug('Not modified, using cached response: %s', cache_key)
+            return CachedResponse(cached)
         self._check(response)
+        if cache_key and response.status_code == 200:
+            entry = CachedResponse.entry(response)
+            if entry:
+                self._cache.set(cache_key, entry)
         return response
 
 
@@ -152,18 +184,79 @@ class GitHubAPICaller:
 
 
 
+class CachedResponse:
+    '''
+    API response restored from cache.
+    Mimics the subset of requests.Response interface used by Issyours.
+    '''
+
+    status_code = 200
+
+
+    def __init__(self, entry):
+        self.url = entry['url']
+        self.headers = requests.structures.CaseInsensitiveDict(entry['headers'])
+        self.links = entry['links']
+        self.text = entry['content']
+
+
+    def __repr__(self):
+        return '<{}: {}>'.format(self.__class__.__name__, self.url)
+
+
+    def json(self):
+        return json.loads(self.text)
+
+
+    @staticmethod
+    def entry(response):
+        '''
+        Create cache entry (JSON serializable dictionary) from HTTP response.
+        Return None if response can not be validated later.
+        '''
+        headers = {h: response.headers[h] for h in ('ETag', 'Last-Modified')
+                   if h in response.headers}
+        if not headers:
+            return None
+        return dict(
+            url=response.url,
+            headers=headers,
+            links=response.links,
+            content=response.text,
+        )
+
+
+    @staticmethod
+    def validators(entry):
+        '''Headers for conditional request based on cache entry'''
+        headers = {}
+        if 'ETag' in entry['headers']:
+            headers['If-None-Match'] = entry['headers']['ETag']
+        if 'Last-Modified' in entry['headers']:
+            headers['If-Modified-Since'] = entry['headers']['Last-Modified']
+        return headers
+
+
+
 class GitHubAPI:
     '''
     High level read only GitHub REST API (v3) client
     '''
 
-    def __init__(self, token):
+    def __init__(self, token, pool_size=10, cache=None):
         '''Initialize API client with OAuth token'''
-        self.api = GitHubAPICaller(token)
+        self.api = GitHubAPICaller(token, pool_size=pool_size, cache=cache)
 
 
-    def issues(self, owner, repo, since=None):
-        '''Iterate over issue dictionaries'''
+    def issues(self, owner, repo, since=None, refetch=False):
+        '''
+        Iterate over issue dictionaries.
+
+        By default issues are taken from the list pages as is. If `refetch` is
+        True, each issue is additionally requested on its own with a
+        conditional GET, which doubles the number of API calls but provides
+        complete issue objects and the Last-Modified header
+        '''
         endpoint = 'repos/{owner}/{repo}/issues'.format(owner=owner, repo=repo)
         params = {
             'filter': 'all',
@@ -175,6 +268,9 @@ class GitHubAPI:
 
         for response in self.api.pages(endpoint, params=params):
             for issue in response.json():
+                if not refetch:
+                    yield issue
+                    continue
                 url = issue['url']
                 try:
                     response = self.api.single(url=url, since=since)
@@ -314,6 +410,21 @@ class GitHubTimestamp:
 
 
 
+def _cache_key(url, params=None):
+    '''
+    Cache key for GET request: full URL without `since` parameter.
+
+    Fetcher moves `since` forward on every run, keeping it in the key would
+    make cached validators useless. A response to the newer `since` value
+    is reused only if GitHub confirms it is the same (304 Not Modified)
+    '''
+    url = requests.Request('GET', url, params=params).prepare().url
+    parts = urlsplit(url)
+    query = [(key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+             if key != 'since']
+    return urlunsplit(parts._replace(query=urlencode(query)))
+
+
 def readable(response, payload=True):
     '''Make response readable'''
     overview = dict(
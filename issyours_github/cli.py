@@ -8,7 +8,11 @@ import os
 from argparse import ArgumentParser
 
 from issyours_github import GitHubFetcher
+from issyours_github.index import GitHubIndex, GitHubIndexError
+from issyours_github.packed import convert_layout
+from issyours_github.storage import GitHubFileStorage
 
+log = logging.getLogger('issyours.' + __name__.strip('issyours_'))
 
 ENV_TOKEN = 'ISSYOURS_GITHUB_TOKEN'
 
@@ -16,7 +20,25 @@ ENV_TOKEN = 'ISSYOURS_GITHUB_TOKEN'
 def run(*a, **ka):
     args = parse_args(*a, **ka)
     configure_logging(args.verbose)
-    github = GitHubFetcher(args.repo, args.dest, args.oauth_token)
+    if args.convert_layout:
+        # SQLite index stays valid: record names match file names of the other layout
+        storage = GitHubFileStorage(args.repo, args.dest)
+        converted = convert_layout(storage, args.layout)
+        log.warning('Converted %s issues into %s layout', converted, args.layout)
+        return
+    if args.rebuild_index:
+        try:
+            index = GitHubIndex(GitHubFileStorage(args.repo, args.dest))
+        except GitHubIndexError as exc:
+            raise SystemExit('Can not rebuild index: {} (remove the file and try again)'.format(exc))
+        index.rebuild()
+        index.close()
+        return
+    github = GitHubFetcher(args.repo, args.dest, args.oauth_token, jobs=args.jobs,
+                           download_jobs=args.download_jobs,
+                           refetch_issues=args.refetch_issues,
+                           index=not args.no_index,
+                           layout=args.layout)
     github.fetch()
 
 
@@ -44,6 +66,51 @@ def parse_args(*a, **ka):
               'Using a commandline option is less secure and should be avoided.')
              .format(ENV_TOKEN)
     )
+    parser.add_argument(
+        '-j',
+        '--jobs',
+        type=int,
+        default=1,
+        metavar='N',
+        help='Number of issues to fetch concurrently (default: 1)',
+    )
+    parser.add_argument(
+        '--download-jobs',
+        type=int,
+        default=4,
+        metavar='N',
+        help='Number of attachments and avatars to download concurrently (default: 4)',
+    )
+    parser.add_argument(
+        '--refetch-issues',
+        action='store_true',
+        help=('Request each issue individually after reading the list of issues. '
+              'This doubles the number of API calls and is rarely needed.'),
+    )
+    parser.add_argument(
+        '--no-index',
+        action='store_true',
+        help='Do not maintain SQLite index of stored files (existing index is removed)',
+    )
+    parser.add_argument(
+        '--rebuild-index',
+        action='store_true',
+        help='Rebuild SQLite index of previously stored files and exit (no API calls are made)',
+    )
+    parser.add_argument(
+        '--layout',
+        choices=GitHubFileStorage.LAYOUTS,
+        default='files',
+        help=('How to store comments and events: as separate JSON files or packed '
+              'into a single file per issue (default: files). Previously stored '
+              'issues are converted when they are fetched again.'),
+    )
+    parser.add_argument(
+        '--convert-layout',
+        action='store_true',
+        help=('Convert all previously stored issues into the layout selected '
+              'with --layout and exit (no API calls are made)'),
+    )
     parser.add_argument(
         '-v',
         '--verbose',
@@ -58,7 +125,11 @@ def parse_args(*a, **ka):
     if len(repo_parts) != 2 or not all(repo_parts):
         parser.error('Invalid repo identificator: {}'.format(args.repo))
 
-    if not args.oauth_token:
+    for jobs in (args.jobs, args.download_jobs):
+        if jobs < 1:
+            parser.error('Number of jobs must be positive: {}'.format(jobs))
+
+    if not args.oauth_token and not (args.rebuild_index or args.convert_layout):
         parser.error('GitHub OAuth token was not provided')
 
     return args
@@ -6,16 +6,34 @@ import json
 import logging
 import os
 import re
+import threading
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    CancelledError,
+    Future,
+    ThreadPoolExecutor,
+    as_completed,
+    wait,
+)
 from datetime import datetime
-from tempfile import mkstemp
+from functools import partial
 
 import requests
 
-from issyours_github.api import GitHubAPI, GitHubTimestamp, GitHubNotModifiedException
-from issyours_github.storage import GitHubFileStorage
+from issyours_github.api import (
+    GitHubAPI,
+    GitHubAPICaller,
+    GitHubNotModifiedException,
+    GitHubTimestamp,
+)
+from issyours_github.index import GitHubIndex, GitHubIndexError
+from issyours_github.packed import PackedRecords, convert_issue
+from issyours_github.storage import GitHubFileStorage, write_json
 
 log = logging.getLogger('issyours.' + __name__.strip('issyours_'))
 
+DOWNLOAD_TIMEOUT = 30  # seconds
+
 
 
 class GitHubFetcher(GitHubFileStorage):
@@ -25,14 +43,46 @@ class GitHubFetcher(GitHubFileStorage):
 
     ABOUT = 'GitHub Issues Archive made with <https://github.com/sio/issyours>'
     STAMP_VERSION = 2
+    QUEUE_FACTOR = 2  # how many issues per worker may wait in the queue
 
 
-    def __init__(self, repo, directory, token):
-        '''Initialize fetcher with GitHub repo name, target directory and OAuth token'''
+    def __init__(self, repo, directory, token, jobs=1, refetch_issues=False, http_cache=True,
+                 download_jobs=4, index=True, layout='files'):
+        '''
+        Initialize fetcher with GitHub repo name, target directory and OAuth token.
+        Up to `jobs` issues will be fetched concurrently, attachments, patches
+        and avatars are downloaded by separate `download_jobs` workers. If `refetch_issues`
+        is True, every issue is requested individually after being seen in
+        the list (see GitHubAPI.issues). If `http_cache` is True, API
+        responses are cached in storage directory and revalidated with
+        conditional requests on subsequent runs. If `index` is True, SQLite
+        index of stored files is maintained for the use by GitHubReader,
+        otherwise existing index is removed to keep readers from using
+        stale data.
+        Comments and events are saved in a given storage `layout` (see
+        GitHubFileStorage), issues stored differently are converted when
+        they are fetched again.
+        '''
         super().__init__(repo, directory)
-        self.api = GitHubAPI(token)
+        if jobs < 1 or download_jobs < 1:
+            raise ValueError('number of jobs must be positive, got {!r}'.format(
+                min(jobs, download_jobs)
+            ))
+        if layout not in self.LAYOUTS:
+            raise ValueError('unknown storage layout: {!r}'.format(layout))
+        self.layout = layout
+        self.response_cache = GitHubResponseCache(self) if http_cache else None
+        self.api = GitHubAPI(token, pool_size=max(jobs + download_jobs, 10),
+                             cache=self.response_cache)
+        self.jobs = jobs
+        self.download_jobs = download_jobs
+        self.downloads = None
+        self.refetch_issues = refetch_issues
+        self.use_index = index
+        self.index = None
         self._last_modified = None
         self._persons_seen = set()
+        self._lock = threading.RLock()
 
 
     def fetch(self):
@@ -42,50 +92,154 @@ class GitHubFetcher(GitHubFileStorage):
         since = self.read_stamp()
         log.warning('Fetching issues for %r (modified since: %s)', self.repo, since)
 
-        for issue in self.api.issues(owner, project, since):
-            users = set()
-            since = self.read_stamp(issue['number'])
-            self.last_modified = GitHubTimestamp(isotime=issue['updated_at'])
-            write_json(issue, self.issue_path(issue))
-            log.info('Saved issue #%s', issue['number'])
-            self.fetch_attachments(issue, issue['body'])
+        if self.use_index:
+            self.open_index()
+        elif os.path.exists(self.index_path()):
+            log.warning('Removing index file that will not be updated: %s', self.index_path())
+            os.remove(self.index_path())
+        self.open_downloads()
+        try:
+            with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+                pending = set()
+                try:
+                    for issue in self.api.issues(owner, project, since, refetch=self.refetch_issues):
+                        if len(pending) >= self.QUEUE_FACTOR * self.jobs:
+                            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                            for future in done:
+                                future.result()  # re-raise exceptions from workers
+                        pending.add(executor.submit(self.fetch_issue, issue))
+                    for future in as_completed(pending):
+                        future.result()
+                except BaseException:
+                    for future in pending:
+                        future.cancel()
+                    raise
+        except BaseException:
+            self.downloads.cancel()  # keep the original exception
+            raise
+        self.downloads.join()
+        self.write_stamp()
+        if self.response_cache:
+            self.response_cache.prune()
 
-            if 'pull_request' in issue:
-                patch_url = issue['pull_request']['patch_url']
-                download(patch_url, self.patch_path(issue))
-                log.info('Saved patch file for pull request #%s', issue['number'])
 
+    def fetch_issue(self, issue):
+        '''
+        Fetch all data related to a single issue.
+        Issue stamp is written only after everything else has been saved
+        (including files from download queue).
+        '''
+        users = set()
+        downloads = []
+        since = self.read_stamp(issue['number'])
+        self.last_modified = GitHubTimestamp(isotime=issue['updated_at'])
+        write_json(issue, self.issue_path(issue))
+        if self.index:
+            self.index.add_issue(issue)
+        log.info('Saved issue #%s', issue['number'])
+        downloads.extend(self.fetch_attachments(issue, issue['body']))
+
+        if 'pull_request' in issue:
+            patch_url = issue['pull_request']['patch_url']
+            downloads.append(self.downloads.put(
+                patch_url,
+                self.patch_path(issue),
+                'patch file for pull request #{}'.format(issue['number']),
+            ))
+
+        convert_issue(self, issue['number'], self.layout)
+        records = None
+        if self.layout == 'packed':
+            records = PackedRecords(self.packed_path(issue))
+        try:
             comments_url = issue['comments_url']
             for comment in self.api.comments(url=comments_url, since=since):
-                write_json(comment, self.comment_path(issue, comment))
+                comment_path = self.comment_path(issue, comment)
+                self._save_record(records, comment, comment_path)
+                if self.index:
+                    self.index.add_file(issue['number'], 'comment', comment_path)
                 log.info('Saved comment #%s', comment['id'])
                 users.add(comment['user']['login'])
-                self.fetch_attachments(issue, comment['body'])
+                downloads.extend(self.fetch_attachments(issue, comment['body']))
 
             events_url = issue['events_url']
             for event in self.api.events(url=events_url, since=since):
-                write_json(event, self.event_path(issue, event))
+                event_path = self.event_path(issue, event)
+                self._save_record(records, event, event_path)
+                if self.index:
+                    self.index.add_file(issue['number'], 'event', event_path)
                 log.info('Saved event #%s', event['id'])
                 if event.get('actor'):
                     users.add(event.get('actor').get('login'))
+        finally:
+            if records is not None:
+                records.close()
 
-            users.add(issue['user']['login'])
-            for assignee in issue['assignees']:
-                users.add(assignee['login'])
-            if issue['closed_by']:
-                users.add(issue['closed_by']['login'])
-            self.fetch_persons(nicknames=users)
+        users.add(issue['user']['login'])
+        for assignee in issue['assignees']:
+            users.add(assignee['login'])
+        if issue.get('closed_by'):  # not provided in issue lists
+            users.add(issue['closed_by']['login'])
+        downloads.extend(self.fetch_persons(nicknames=users))
 
-            self.write_stamp(issue)
-        self.write_stamp()
+        self.downloads.after(downloads, partial(self._finish_issue, issue, downloads))
+
+
+    def _save_record(self, records, data, path):
+        '''Save comment or event into a separate file or into packed records'''
+        if records is None:
+            write_json(data, path)
+        else:
+            records.append(os.path.basename(path), data)
+
+
+    def _finish_issue(self, issue, downloads):
+        '''Final step of fetching a single issue'''
+        if self.index:
+            for future in downloads:
+                path = future.result()
+                if path:
+                    self.index.add_path(path)
+        self.write_stamp(issue)
+
+
+    def open_index(self):
+        '''Open SQLite index, rebuild it if necessary'''
+        exists = os.path.exists(self.index_path())
+        try:
+            self.index = GitHubIndex(self)
+        except GitHubIndexError as exc:
+            log.warning('%s, index will be rebuilt', exc)
+            os.remove(self.index_path())
+            exists = False
+            self.index = GitHubIndex(self)
+        if not exists and os.path.isdir(self.issue_dir()):
+            self.index.rebuild()
+
+
+    def open_downloads(self):
+        '''
+        Start download queue. Files are requested without API credentials:
+        attachment URLs come from user-provided content
+        '''
+        self.downloads = DownloadQueue(
+            session=download_session(pool_size=self.download_jobs),
+            jobs=self.download_jobs,
+            maxsize=self.QUEUE_FACTOR * self.download_jobs,
+        )
 
 
     def fetch_persons(self, nicknames):
-        '''Fetch data about GitHub user. Execute only once for each nickname seen'''
+        '''
+        Fetch data about GitHub user. Execute only once for each nickname seen.
+        Return the list of queued avatar downloads
+        '''
+        downloads = []
         for nickname in nicknames:
-            if not nickname or nickname in self._persons_seen:
-                continue
-            self._persons_seen.add(nickname)
+            with self._lock:
+                if not nickname or nickname in self._persons_seen:
+                    continue
+                self._persons_seen.add(nickname)
 
             person_file = self.person_path(nickname=nickname)
             if not os.path.exists(person_file):
@@ -97,29 +251,36 @@ class GitHubFetcher(GitHubFileStorage):
             try:
                 person = self.api.person(nickname, timestamp)
                 write_json(person, person_file)
+                if self.index:
+                    self.index.add_person(
+                        nickname,
+                        person,
+                        picture=os.path.exists(self.person_image(nickname)),
+                    )
                 log.info('Saved user @%s', person['login'])
             except GitHubNotModifiedException:
                 continue
 
-            try:
-                image_file = self.person_image(person=person)
-                download(person['avatar_url'], image_file)
-                log.info('Saved avatar for @%s', person['login'])
-            except requests.HTTPError:
-                log.error('Can not fetch: %s', person['avatar_url'])
+            downloads.append(self.downloads.put(
+                person['avatar_url'],
+                self.person_image(person=person),
+                'avatar for @{}'.format(person['login']),
+            ))
+        return downloads
 
 
     def fetch_attachments(self, issue, body):
-        '''Fetch attachments linked in the issue/comment body'''
+        '''
+        Fetch attachments linked in the issue/comment body.
+        Return the list of queued downloads
+        '''
+        downloads = []
         for url in attachment_urls(body):
             dest = self.attachment_path(url, issue)
             if os.path.exists(dest):
                 continue
-            try:
-                download(url, dest)
-                log.info('Saved attachment: %s', url)
-            except requests.HTTPError:
-                log.error('Can not fetch: %s', url)
+            downloads.append(self.downloads.put(url, dest, 'attachment'))
+        return downloads
 
 
     @property
@@ -139,9 +300,10 @@ class GitHubFetcher(GitHubFileStorage):
 
     @last_modified.setter
     def last_modified(self, value):
-        if self._last_modified is None \
-        or self._last_modified < value:
-            self._last_modified = value
+        with self._lock:
+            if self._last_modified is None \
+            or self._last_modified < value:
+                self._last_modified = value
 
 
     def read_stamp(self, issue_no=None):
@@ -160,9 +322,14 @@ class GitHubFetcher(GitHubFileStorage):
 
     def write_stamp(self, issue=None):
         '''Write signature file after successful completion of whole job or its atomic part'''
+        if self.index:
+            self.index.commit()
         if issue:
             issue_no = issue['number']
-            timestamp = GitHubTimestamp(header=issue['header-last-modified']).unix
+            if 'header-last-modified' in issue:
+                timestamp = GitHubTimestamp(header=issue['header-last-modified']).unix
+            else:
+                timestamp = GitHubTimestamp(isotime=issue['updated_at']).unix
         else:
             issue_no = None
             timestamp = self.last_modified.unix
@@ -198,6 +365,179 @@ class GitHubFetcher(GitHubFileStorage):
 
 
 
+class DownloadQueue:
+    '''
+    Bounded queue of files to be downloaded by a pool of worker threads.
+
+    Each destination path is downloaded only once, producers block when
+    there are already `maxsize` files waiting in the queue.
+    '''
+
+    def __init__(self, session, jobs=4, maxsize=8):
+        self.session = session
+        self._executor = ThreadPoolExecutor(max_workers=jobs)
+        self._slots = threading.BoundedSemaphore(maxsize)
+        self._condition = threading.Condition()
+        self._queued = dict()  # destination path -> Future
+        self._unfinished = 0
+        self._errors = []
+        self._cancelled = False
+
+
+    def put(self, url, dest, description='file'):
+        '''
+        Schedule file download. Return Future object that completes after
+        the file has been saved (or has failed with HTTP error)
+        '''
+        with self._condition:
+            if self._errors:
+                raise self._errors[0]
+            if dest in self._queued:
+                return self._queued[dest]
+            future = self._queued[dest] = Future()
+            self._unfinished += 1
+        self._slots.acquire()
+        self._executor.submit(self._download, future, url, dest, description)
+        return future
+
+
+    def after(self, futures, callback):
+        '''Execute callback when all futures complete successfully'''
+        futures = list(futures)
+        if not futures:
+            return callback()
+        remaining = len(futures)
+        def countdown(future):
+            nonlocal remaining
+            if future.exception() is not None:
+                return
+            with self._condition:
+                remaining -= 1
+                if remaining:
+                    return
+            try:
+                callback()
+            except BaseException as exc:
+                with self._condition:
+                    self._errors.append(exc)
+        for future in futures:
+            future.add_done_callback(countdown)
+
+
+    def join(self):
+        '''Wait for all downloads to complete'''
+        with self._condition:
+            while self._unfinished:
+                self._condition.wait()
+        self._executor.shutdown()
+        if self._errors:
+            raise self._errors[0]
+
+
+    def cancel(self):
+        '''
+        Skip downloads that have not started yet and wait for the running
+        ones. Errors are not raised: this is meant for cleaning up after
+        another failure
+        '''
+        with self._condition:
+            self._cancelled = True
+        self._executor.shutdown()
+
+
+    def _download(self, future, url, dest, description):
+        '''Worker routine'''
+        try:
+            if self._cancelled:
+                future.set_exception(CancelledError(url))
+                return
+            download(url, dest, self.session)
+            log.info('Saved %s: %s', description, url)
+        except requests.HTTPError:
+            log.error('Can not fetch: %s', url)
+            future.set_result(None)
+        except BaseException as exc:
+            with self._condition:
+                self._errors.append(exc)
+            future.set_exception(exc)
+        else:
+            future.set_result(dest)
+        finally:
+            self._slots.release()
+            with self._condition:
+                self._unfinished -= 1
+                self._condition.notify_all()
+
+
+
+class GitHubResponseCache:
+    '''
+    Persistent cache of GitHub API responses keyed by URL.
+
+    Each entry holds ETag/Last-Modified validators and the response body
+    (see CachedResponse in api module). Least recently used entries are
+    removed by prune() when total size of cache exceeds `maxsize` bytes
+    '''
+
+    MAXSIZE = 128 * 2**20  # bytes
+
+    def __init__(self, storage, maxsize=MAXSIZE):
+        self.storage = storage
+        self.maxsize = maxsize
+
+
+    def get(self, url):
+        '''Return cache entry for a given URL or None'''
+        path = self.storage.cache_path(url)
+        if not os.path.exists(path):
+            return None
+        with open(path, encoding=self.storage.ENCODING) as f:
+            entry = json.load(f)
+        if entry.get('key') != url:  # hash collision
+            return None
+        try:
+            os.utime(path)  # mark as recently used
+        except OSError:
+            pass
+        return entry
+
+
+    def set(self, url, entry):
+        '''Save cache entry for a given URL'''
+        entry = dict(entry, key=url)
+        write_json(entry, self.storage.cache_path(url))
+
+
+    def prune(self):
+        '''Remove least recently used entries until cache fits into maxsize'''
+        directory = self.storage.cache_dir()
+        if not os.path.isdir(directory):
+            return
+        files = []
+        for filename in os.listdir(directory):
+            path = os.path.join(directory, filename)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            files.append((stat.st_mtime, path, stat.st_size))
+        files.sort()
+        total = sum(size for _, _, size in files)
+        removed = 0
+        for mtime, path, size in files:
+            if total <= self.maxsize:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            removed += 1
+        if removed:
+            log.info('Removed %s old entries from API response cache', removed)
+
+
+
 class FetcherStampValidationError(ValueError):
     '''
     Raised when stamp data does not match current fetcher object.
@@ -214,32 +554,10 @@ class FetcherStampValidationError(ValueError):
 
 
 
-def write_json(dictionary, filepath):
-    '''Serialize a dictionary into a JSON file'''
-    serialized = json.dumps(dictionary, indent=2, sort_keys=True, ensure_ascii=False)
-    safe_write(filepath, serialized)
-
-
-def safe_write(filepath, content, mode='w'):
-    '''Safely (over)write a small file'''
-    directory, filename = os.path.split(os.path.abspath(filepath))
-    if not os.path.exists(directory):
-        os.makedirs(directory)
-
-    text_mode = 'b' not in mode
-    if text_mode:
-        content = content.encode('utf-8')
-
-    tmp, tmppath = mkstemp(prefix=filename, dir=directory, text=text_mode)
-    os.write(tmp, content)
-    os.close(tmp)
-    os.replace(tmppath, filepath)
-
-
 def attachment_urls(body, _pattern=re.compile(
             '('
-            r'http[s]?://[^/]*githubusercontent.com/[\.\w/&%+-]+'
-            r'|http[s]?://github.com/[^\s/]+/[^\s/]+/files/[\.\w/&%+-]+'
+            r'https?://(?:[\w-]+\.)*githubusercontent\.com/[\.\w/&%+-]+'
+            r'|https?://github\.com/[\w.-]+/[\w.-]+/files/[\.\w/&%+-]+'
             ')')):
     '''Detect attachment URLs in the body of GitHub issue/comment'''
     # URL regex from http://urlregex.com/
@@ -250,9 +568,106 @@ def attachment_urls(body, _pattern=re.compile(
         yield from ()
 
 
-def download(url, dest):  # TODO: do not store the whole file in memory
-    '''Download regular files from web'''
-    response = requests.get(url, allow_redirects=True)
-    response.raise_for_status()
-    with open(dest, 'wb') as output:
-        output.write(response.content)
+def download_session(pool_size=10):
+    '''
+    HTTP session with a pool of reusable connections for downloading
+    regular files. Unlike API sessions it carries no credentials
+    '''
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.headers['User-Agent'] = GitHubAPICaller.USER_AGENT
+    return session
+
+
+def download(url, dest, session=None, chunk_size=64 * 1024):
+    '''
+    Download regular files from web.
+
+    Response body is streamed in chunks into a partial file next to the
+    destination, which is renamed into place only after the download has
+    completed. Partial files left by interrupted runs are resumed with
+    HTTP Range requests when the server supports them.
+
+    Validator of the original response (strong ETag or Last-Modified) is
+    saved next to the partial file and is sent back in If-Range header, so
+    that the server restarts the download if the file has changed. Partial
+    files without validator are downloaded again from scratch
+    '''
+    if session is None:
+        session = requests
+    directory = os.path.dirname(os.path.abspath(dest))
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+
+    part_path = dest + '.part'
+    meta = part_path + '.meta'
+    headers = {'Accept': '*/*'}
+    offset = 0
+    validator = _read_validator(meta, url) if os.path.exists(part_path) else None
+    if validator:
+        offset = os.path.getsize(part_path)
+    if offset:
+        headers['Range'] = 'bytes={}-'.format(offset)
+        headers['If-Range'] = validator
+
+    response = session.get(url, headers=headers, stream=True, allow_redirects=True,
+                           timeout=DOWNLOAD_TIMEOUT)
+    with response:
+        if offset and response.status_code == 416:  # Range Not Satisfiable
+            response.close()
+            _remove(part_path, meta)
+            return download(url, dest, session, chunk_size)
+        response.raise_for_status()
+        if response.status_code == 206:  # Partial Content
+            content_range = response.headers.get('Content-Range', '')
+            if not offset or not content_range.startswith('bytes {}-'.format(offset)):
+                log.debug('Unexpected Content-Range (%r), restarting download: %s',
+                          content_range, url)
+                response.close()
+                _remove(part_path, meta)
+                return download(url, dest, session, chunk_size)
+            log.debug('Resuming download from byte %s: %s', offset, url)
+            mode = 'ab'
+        else:
+            mode = 'wb'
+            validator = _response_validator(response)
+            if validator:
+                write_json(dict(url=url, validator=validator), meta)
+            else:
+                _remove(meta)
+        with open(part_path, mode) as output:
+            for chunk in response.iter_content(chunk_size=chunk_size):
+                output.write(chunk)
+    os.replace(part_path, dest)
+    _remove(meta)
+
+
+def _response_validator(response):
+    '''Return the value that may be used in If-Range header (or None)'''
+    etag = response.headers.get('ETag')
+    if etag and not etag.startswith('W/'):  # weak validators are not allowed
+        return etag
+    return response.headers.get('Last-Modified')
+
+
+def _read_validator(path, url):
+    '''Read validator saved for partially downloaded file'''
+    try:
+        with open(path, encoding=GitHubFileStorage.ENCODING) as f:
+            meta = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+    if meta.get('url') != url:
+        return None
+    return meta.get('validator')
+
+
+def _remove(*paths):
+    '''Remove files if they exist'''
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
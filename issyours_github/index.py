@@ -0,0 +1,311 @@
+'''
+SQLite index for GitHub issues archive
+
+Index duplicates the information that can be obtained by listing storage
+directories, so that readers do not need to touch the filesystem for that
+'''
+
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+from glob import glob
+
+from issyours_github.api import GitHubTimestamp
+from issyours_github.packed import PackedRecords
+
+log = logging.getLogger('issyours.' + __name__.strip('issyours_'))
+
+
+
+class GitHubIndexError(RuntimeError):
+    '''Raised when index file can not be used'''
+
+
+
+class GitHubIndex:
+    '''
+    SQLite index of files stored by GitHubFetcher
+
+    The same connection may be shared between threads, all queries are
+    serialized with a lock
+    '''
+
+    SCHEMA_VERSION = 3
+    SCHEMA = '''
+        CREATE TABLE IF NOT EXISTS issues (
+            number      INTEGER PRIMARY KEY,
+            title       TEXT,
+            state       TEXT,
+            author      TEXT,
+            labels      TEXT,
+            comments    INTEGER,
+            created_at  INTEGER,
+            updated_at  INTEGER,
+            closed_at   INTEGER
+        );
+        CREATE INDEX IF NOT EXISTS issues_updated_at ON issues (updated_at);
+        CREATE INDEX IF NOT EXISTS issues_closed_at ON issues (closed_at);
+        CREATE TABLE IF NOT EXISTS labels (
+            issue       INTEGER,
+            name        TEXT,
+            PRIMARY KEY (issue, name)
+        );
+        CREATE INDEX IF NOT EXISTS labels_name ON labels (name);
+        CREATE TABLE IF NOT EXISTS files (
+            issue       INTEGER,
+            kind        TEXT,
+            filename    TEXT,
+            PRIMARY KEY (issue, kind, filename)
+        );
+        CREATE TABLE IF NOT EXISTS persons (
+            login       TEXT PRIMARY KEY,
+            name        TEXT,
+            url         TEXT,
+            picture     INTEGER
+        );
+    '''
+    KINDS = {'comment', 'event', 'attachment', 'patch'}
+    SORT_COLUMNS = {
+        # sort_by: ORDER BY expression
+        'created_at': 'number {order}',
+        'modified_at': 'updated_at {order}, number {order}',
+        'closed_at': 'closed_at IS NULL, closed_at {order}, number {order}',
+        'comments': 'comments {order}, number {order}',
+        'status': 'state {order}, number {order}',
+    }
+
+
+    def __init__(self, storage, readonly=False, path=None):
+        '''
+        Open index file in a given storage (GitHubFileStorage).
+        Readonly index must already exist and must match current schema version.
+        Custom `path` may be provided, e.g. ':memory:' for temporary index
+        '''
+        self.storage = storage
+        self.path = path or storage.index_path()
+        self.readonly = readonly
+        self._lock = threading.RLock()
+        if readonly:
+            if not os.path.exists(self.path):
+                raise GitHubIndexError('index file does not exist: {}'.format(self.path))
+            uri = 'file:{}?mode=ro'.format(os.path.abspath(self.path))
+            self._db = sqlite3.connect(uri, uri=True, check_same_thread=False)
+        else:
+            self._db = sqlite3.connect(self.path, check_same_thread=False)
+        version = self._db.execute('PRAGMA user_version').fetchone()[0]
+        if version == 0 and not readonly:
+            with self._db:
+                self._db.executescript(self.SCHEMA)
+                self._db.execute('PRAGMA user_version = {:d}'.format(self.SCHEMA_VERSION))
+        elif version != self.SCHEMA_VERSION:
+            self._db.close()
+            raise GitHubIndexError('unsupported index version {} in {}'.format(version, self.path))
+
+
+    def __repr__(self):
+        return '<{}: {}>'.format(self.__class__.__name__, self.path)
+
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+    def commit(self):
+        with self._lock:
+            self._db.commit()
+
+
+    def _execute(self, query, *params):
+        with self._lock:
+            return self._db.execute(query, params).fetchall()
+
+
+    def add_issue(self, issue):
+        '''Add or update issue record (issue data as returned by GitHub API)'''
+        self._execute(
+            'INSERT OR REPLACE INTO issues VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            issue['number'],
+            issue['title'],
+            issue['state'],
+            issue['user']['login'],
+            json.dumps([[l['name'], l['color']] for l in issue['labels']]),
+            issue.get('comments', 0),
+            _unix(issue['created_at']),
+            _unix(issue['updated_at']),
+            _unix(issue['closed_at']),
+        )
+        self._execute('DELETE FROM labels WHERE issue = ?', issue['number'])
+        with self._lock:
+            self._db.executemany(
+                'INSERT OR IGNORE INTO labels VALUES (?, ?)',
+                ((issue['number'], l['name']) for l in issue['labels']),
+            )
+
+
+    def add_file(self, issue_no, kind, path):
+        '''Add a file that belongs to the issue'''
+        if kind not in self.KINDS:
+            raise ValueError('unknown kind of file: {}'.format(kind))
+        self._execute(
+            'INSERT OR IGNORE INTO files VALUES (?, ?, ?)',
+            int(issue_no),
+            kind,
+            os.path.basename(path),
+        )
+
+
+    def add_person(self, login, person, picture=False):
+        '''Add or update person record from GitHub user data'''
+        self._execute(
+            'INSERT OR REPLACE INTO persons VALUES (?, ?, ?, ?)',
+            login,
+            person.get('name'),
+            person.get('html_url'),
+            int(bool(picture)),
+        )
+
+
+    def add_path(self, path):
+        '''Add a file downloaded into storage directory'''
+        directory, filename = os.path.split(path)
+        if os.path.abspath(directory) == os.path.abspath(self.storage.person_dir()):
+            login = os.path.splitext(filename)[0]
+            with self._lock:
+                self._execute('INSERT OR IGNORE INTO persons (login) VALUES (?)', login)
+                self._execute('UPDATE persons SET picture = 1 WHERE login = ?', login)
+            return
+        kind = _file_kind(filename)
+        if kind:
+            self.add_file(os.path.basename(directory), kind, filename)
+
+
+    def issue_numbers(self, sort_by='created_at', desc=True, status=None, label=None):
+        '''
+        Return the list of issue numbers in the specified order,
+        optionally only those with given status and/or label.
+        Issues that were never closed come last when sorting by closed_at
+        '''
+        rows = self._select_issues('number', sort_by, desc, status, label)
+        return [row[0] for row in rows]
+
+
+    def summaries(self, sort_by='created_at', desc=True, status=None, label=None):
+        '''
+        Return issue metadata rows in the same order as issue_numbers():
+        (number, title, state, author, labels, comments, created_at,
+        updated_at, closed_at). Labels are JSON encoded [name, color] pairs
+        '''
+        columns = 'number, title, state, author, labels, comments, created_at, updated_at, closed_at'
+        return self._select_issues(columns, sort_by, desc, status, label)
+
+
+    def _select_issues(self, columns, sort_by, desc, status, label):
+        '''Query issues table with filtering and sorting'''
+        if sort_by not in self.SORT_COLUMNS:
+            raise ValueError('unsupported sorting method: {}'.format(sort_by))
+        query = ['SELECT {} FROM issues'.format(columns)]
+        conditions, params = [], []
+        if status is not None:
+            conditions.append('state = ?')
+            params.append(status)
+        if label is not None:
+            conditions.append('number IN (SELECT issue FROM labels WHERE name = ?)')
+            params.append(label)
+        if conditions:
+            query.append('WHERE ' + ' AND '.join(conditions))
+        order = 'DESC' if desc else 'ASC'
+        query.append('ORDER BY ' + self.SORT_COLUMNS[sort_by].format(order=order))
+        return self._execute(' '.join(query), *params)
+
+
+    def files(self, issue_no, kind, desc=False):
+        '''Return sorted list of paths to files of the given kind for an issue'''
+        order = 'DESC' if desc else 'ASC'
+        rows = self._execute(
+            'SELECT filename FROM files WHERE issue = ? AND kind = ? '
+            'ORDER BY filename {}'.format(order),
+            int(issue_no),
+            kind,
+        )
+        directory = self.storage.issue_dir(issue_no=issue_no)
+        return [os.path.join(directory, row[0]) for row in rows]
+
+
+    def person_logins(self):
+        '''Return the list of all known persons'''
+        return [row[0] for row in self._execute('SELECT login FROM persons ORDER BY login')]
+
+
+    def person_details(self):
+        '''
+        Return (login, name, url, picture) tuples for all known persons,
+        ordered by login
+        '''
+        return self._execute('SELECT login, name, url, picture FROM persons ORDER BY login')
+
+
+    def has_picture(self, login):
+        '''Check if person's picture was saved'''
+        rows = self._execute('SELECT picture FROM persons WHERE login = ?', login)
+        return bool(rows and rows[0][0])
+
+
+    def rebuild(self):
+        '''Recreate index from scratch by scanning the storage directory'''
+        if self.readonly:
+            raise GitHubIndexError('can not rebuild readonly index')
+        log.info('Rebuilding index: %s', self.path)
+        with self._lock, self._db:
+            for table in ('issues', 'labels', 'files', 'persons'):
+                self._db.execute('DELETE FROM {}'.format(table))
+
+            issues_dir = self.storage.issue_dir()
+            numbers = next(os.walk(issues_dir))[1] if os.path.isdir(issues_dir) else []
+            for number in numbers:
+                issue_path = self.storage.issue_path(issue_no=number)
+                if not os.path.exists(issue_path):
+                    continue
+                with open(issue_path, encoding=self.storage.ENCODING) as f:
+                    self.add_issue(json.load(f))
+                for filename in os.listdir(self.storage.issue_dir(issue_no=number)):
+                    kind = _file_kind(filename)
+                    if kind:
+                        self.add_file(number, kind, filename)
+                if self.storage.issue_layout(issue_no=number) == 'packed':
+                    packed_path = self.storage.packed_path(issue_no=number)
+                    with PackedRecords(packed_path, readonly=True) as records:
+                        for name in records.names():
+                            self.add_file(number, _file_kind(name), name)
+
+            for person_file in glob(os.path.join(self.storage.person_dir(), '*.json')):
+                login = os.path.splitext(os.path.basename(person_file))[0]
+                with open(person_file, encoding=self.storage.ENCODING) as f:
+                    person = json.load(f)
+                self.add_person(login, person, os.path.exists(self.storage.person_image(login)))
+
+
+
+def _unix(isotime):
+    '''Convert GitHub timestamp string to unix time'''
+    if not isotime:
+        return None
+    return GitHubTimestamp(isotime=isotime).unix
+
+
+def _file_kind(filename):
+    '''Detect the kind of file stored in issue directory'''
+    if filename.endswith(('.part', '.part.meta')):  # unfinished downloads
+        return None
+    if filename.startswith('comment-') and filename.endswith('.json'):
+        return 'comment'
+    if filename.startswith('event-') and filename.endswith('.json'):
+        return 'event'
+    if filename.startswith('attach-'):
+        return 'attachment'
+    if filename == 'proposed.patch':
+        return 'patch'
+    return None
@@ -0,0 +1,286 @@
+'''
+Packed storage layout: all comments and events of an issue in a single file
+
+Records are appended to a JSON Lines file, one compact JSON object per line:
+{"data": {...}, "name": "comment-1577836800-42.json"}. Record names are the
+same as file names in the default layout, so that converting between layouts
+does not change anything else (e.g. SQLite index). When a record with the same
+name is appended again (edited comment) the latest copy wins.
+
+Offset index is kept in a small JSON file next to the records. It covers a
+known prefix of the records file, anything appended after that is scanned
+when the index is loaded. This makes appending cheap and keeps the data safe
+if the index was not saved (interrupted fetcher run)
+'''
+
+
+import json
+import logging
+import os
+
+from issyours_github.storage import safe_write, write_json
+
+log = logging.getLogger('issyours.' + __name__.strip('issyours_'))
+
+RECORD_KINDS = ('comment', 'event')
+
+
+
+class PackedRecords:
+    '''
+    Comments and events of a single issue stored in JSON Lines file with an
+    offset index
+
+    Writable instances must be closed (or used as context managers) to save
+    the index. Records file is compacted on close when more than half of it
+    is taken by overwritten records
+    '''
+
+    ENCODING = 'utf-8'
+    INDEX_VERSION = 1
+
+
+    def __init__(self, path, readonly=False):
+        self.path = path
+        self.index_path = os.path.splitext(path)[0] + '.idx'
+        self.readonly = readonly
+        self._offsets = dict()  # record name -> (offset, length)
+        self._size = 0  # bytes of records file covered by offsets
+        self._garbage = 0  # bytes taken by overwritten records
+        self._changed = False
+        self._file = None
+        self._load()
+
+
+    def __repr__(self):
+        return '<{}: {}, records={}>'.format(self.__class__.__name__, self.path, len(self))
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+    def __len__(self):
+        return len(self._offsets)
+
+
+    def __contains__(self, name):
+        return name in self._offsets
+
+
+    def close(self):
+        '''Close records file, save offset index if necessary'''
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if self._changed and not self.readonly:
+            if self._garbage > self._size // 2:
+                self.compact()
+            else:
+                self.save_index()
+
+
+    def names(self, kind=None, desc=False):
+        '''Return sorted names of all records or of records of the given kind'''
+        if kind is None:
+            names = self._offsets
+        else:
+            prefix = kind + '-'
+            names = (name for name in self._offsets if name.startswith(prefix))
+        return sorted(names, reverse=desc)
+
+
+    def read(self, name):
+        '''Return data of the record with a given name'''
+        return json.loads(self._read_line(name).decode(self.ENCODING))['data']
+
+
+    def append(self, name, data):
+        '''Add new record or replace the existing one with the same name'''
+        if self.readonly:
+            raise ValueError('can not append to readonly records: {}'.format(self.path))
+        line = json.dumps(
+            dict(name=name, data=data),
+            sort_keys=True,
+            ensure_ascii=False,
+            separators=(',', ':'),
+        ).encode(self.ENCODING) + b'\n'  # newlines within strings are always escaped
+        f = self._open()
+        f.seek(self._size)
+        f.truncate()  # drop incomplete record left by interrupted write
+        f.write(line)
+        self._add(name, self._size, len(line))
+        self._size += len(line)
+        self._changed = True
+
+
+    def compact(self):
+        '''Rewrite records file without overwritten records'''
+        if self.readonly:
+            raise ValueError('can not compact readonly records: {}'.format(self.path))
+        lines = [(name, self._read_line(name)) for name in self.names()]
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        offsets, offset = dict(), 0
+        for name, line in lines:
+            offsets[name] = (offset, len(line))
+            offset += len(line)
+        safe_write(self.path, b''.join(line for name, line in lines), mode='wb')
+        log.debug('Compacted %s: %s -> %s bytes', self.path, self._size, offset)
+        self._offsets, self._size, self._garbage = offsets, offset, 0
+        self.save_index()
+
+
+    def save_index(self):
+        '''Write offset index to disk'''
+        index = dict(
+            version=self.INDEX_VERSION,
+            size=self._size,
+            garbage=self._garbage,
+            records=[[name, offset, length] for name, (offset, length) in self._offsets.items()],
+        )
+        safe_write(self.index_path, json.dumps(index, separators=(',', ':')))
+        self._changed = False
+
+
+    def _add(self, name, offset, length):
+        previous = self._offsets.get(name)
+        if previous is not None:
+            self._garbage += previous[1]
+        self._offsets[name] = (offset, length)
+
+
+    def _read_line(self, name):
+        offset, length = self._offsets[name]
+        f = self._open()
+        f.seek(offset)
+        return f.read(length)
+
+
+    def _open(self):
+        if self._file is None:
+            if self.readonly:
+                self._file = open(self.path, 'rb')
+            else:
+                directory = os.path.dirname(os.path.abspath(self.path))
+                os.makedirs(directory, exist_ok=True)
+                with open(self.path, 'ab'):  # create if missing
+                    pass
+                self._file = open(self.path, 'r+b')
+        return self._file
+
+
+    def _load(self):
+        '''Load offset index and scan records that are not covered by it'''
+        try:
+            with open(self.index_path, encoding=self.ENCODING) as f:
+                index = json.load(f)
+        except FileNotFoundError:
+            index = None
+        except ValueError:
+            log.warning('Invalid offset index, records will be rescanned: %s', self.index_path)
+            index = None
+        if index and index.get('version') == self.INDEX_VERSION:
+            self._offsets = {name: (offset, length) for name, offset, length in index['records']}
+            self._size = index['size']
+            self._garbage = index['garbage']
+        try:
+            size = os.path.getsize(self.path)
+        except FileNotFoundError:
+            size = 0
+        if size < self._size:  # records file was replaced after the index was saved
+            self._offsets, self._size, self._garbage = dict(), 0, 0
+        if size > self._size:
+            self._scan()
+
+
+    def _scan(self):
+        '''Read records appended after the offset index was saved'''
+        offset = self._size
+        with open(self.path, 'rb') as f:
+            f.seek(offset)
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break  # incomplete record, will be overwritten by the next append
+                try:
+                    name = json.loads(line.decode(self.ENCODING))['name']
+                except (ValueError, KeyError):
+                    log.warning('Invalid record at byte %s, ignoring the rest of %s',
+                                offset, self.path)
+                    break
+                self._add(name, offset, len(line))
+                offset += len(line)
+        self._size = offset
+        self._changed = True
+
+
+
+def record_kind(filename):
+    '''Return the kind of record stored in a file with a given name (or None)'''
+    for kind in RECORD_KINDS:
+        if filename.startswith(kind + '-') and filename.endswith('.json'):
+            return kind
+    return None
+
+
+def pack_issue(storage, issue_no):
+    '''Move separate comment and event files of the issue into packed records'''
+    directory = storage.issue_dir(issue_no=issue_no)
+    filenames = sorted(f for f in os.listdir(directory) if record_kind(f))
+    with PackedRecords(storage.packed_path(issue_no=issue_no)) as records:
+        for filename in filenames:
+            with open(os.path.join(directory, filename), encoding=storage.ENCODING) as f:
+                records.append(filename, json.load(f))
+    for filename in filenames:
+        os.remove(os.path.join(directory, filename))
+
+
+def unpack_issue(storage, issue_no):
+    '''Move packed records of the issue into separate comment and event files'''
+    directory = storage.issue_dir(issue_no=issue_no)
+    records = PackedRecords(storage.packed_path(issue_no=issue_no), readonly=True)
+    with records:
+        for name in records.names():
+            write_json(records.read(name), os.path.join(directory, name))
+    for path in (records.path, records.index_path):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def convert_issue(storage, issue_no, layout):
+    '''
+    Convert comments and events of the issue into a given layout.
+    Return True if anything has been changed
+    '''
+    if layout not in storage.LAYOUTS:
+        raise ValueError('unknown storage layout: {}'.format(layout))
+    directory = storage.issue_dir(issue_no=issue_no)
+    if layout == 'packed':
+        if not any(record_kind(f) for f in os.listdir(directory)):
+            return False
+        pack_issue(storage, issue_no)
+    else:
+        if storage.issue_layout(issue_no=issue_no) == 'files':
+            return False
+        unpack_issue(storage, issue_no)
+    return True
+
+
+def convert_layout(storage, layout):
+    '''
+    Convert all issues in storage directory into a given layout.
+    Return the number of converted issues
+    '''
+    issues_dir = storage.issue_dir()
+    numbers = next(os.walk(issues_dir))[1] if os.path.isdir(issues_dir) else []
+    converted = 0
+    for number in sorted(numbers, key=int):
+        if convert_issue(storage, number, layout):
+            converted += 1
+            log.info('Converted issue #%s into %s layout', number, layout)
+    return converted
@@ -3,15 +3,18 @@ Read GitHub issues from JSON files on local filesystem
 '''
 
 
+import hashlib
 import json
 import logging
 import os
 import re
+import threading
+from functools import lru_cache, partial
 from glob import glob
 from typing import Mapping
 from urllib.parse import urlparse
 
-from markdown import markdown
+from markdown import Markdown, __version__ as markdown_version
 from markdown.extensions import fenced_code, codehilite, nl2br
 
 from issyours.data import (
@@ -20,10 +23,14 @@ from issyours.data import (
     IssueComment,
     IssueEvent,
     IssueLabel,
+    IssueSummary,
     Person,
 )
+from issyours.lazy import DiskCache, LazyFile
 from issyours.reader import ReaderBase
 from issyours_github.fetcher import attachment_urls
+from issyours_github.index import GitHubIndex, GitHubIndexError
+from issyours_github.packed import PackedRecords
 from issyours_github.storage import GitHubFileStorage
 from issyours_github.api import GitHubTimestamp
 
@@ -34,13 +41,35 @@ log = logging.getLogger('issyours.' + __name__.strip('issyours_'))
 class GitHubReader(ReaderBase):
     '''
     Read GitHub issues from local files fetched by GitHubFetcher
+
+    If storage directory contains SQLite index (see GitHubIndex) it is used
+    instead of listing directories, unless `use_index` is False.
+
+    Rendered HTML is cached in `markdown_cache` directory (if provided) and
+    is reused across runs while the source text, markdown configuration
+    and versions of markdown libraries stay the same
     '''
 
-    def __init__(self, repo, directory):
+    MARKDOWN_CACHE_SIZE = 256 * 2**20  # bytes
+    TRUSTED_STORAGE = True  # files are written by GitHubFetcher
+
+    def __init__(self, repo, directory, use_index=True, markdown_cache=None):
         if not os.path.isdir(directory):
             raise ValueError('not a directory: {}'.format(directory))
         super().__init__()
+        self._source = (repo, directory, use_index, markdown_cache)
         self.storage = GitHubFileStorage(repo, directory)
+        self.index = None
+        self._memory_index = None
+        self._memory_index_lock = threading.Lock()
+        self.markdown_cache = None
+        if markdown_cache:
+            self.markdown_cache = DiskCache(markdown_cache, maxsize=self.MARKDOWN_CACHE_SIZE)
+        if use_index and os.path.exists(self.storage.index_path()):
+            try:
+                self.index = GitHubIndex(self.storage, readonly=True)
+            except GitHubIndexError as exc:
+                log.warning('%s, falling back to reading directories', exc)
 
 
     def __repr__(self):
@@ -51,22 +80,27 @@ class GitHubReader(ReaderBase):
         )
 
 
+    def __reduce__(self):
+        '''Pickle only the source configuration, not the caches and open files'''
+        return (self.__class__, self._source)
+
+
     def _read_issue(self, uid):
         log.debug('Reading issue #{} from local backup'.format(uid))
         filepath = self.storage.issue_path(issue_no=uid)
         with open(filepath, 'r', encoding=self.storage.ENCODING) as f:
             data = json.load(f)
-        issue = Issue(
+        issue = self._new(Issue,
             reader=self,
             uid=uid,
             author=self.person(data['user']['login']),
             author_role=data['author_association'],
             status=data['state'],  # TODO: convert to consistent subset of statuses
             title=data['title'],
-            body=render_markdown(data['body']),
+            body=partial(self.render_markdown, data['body']),  # rendered on first access
             original_url=data['html_url'],
             labels=[
-                IssueLabel(name=l['name'], color='#' + l['color'])
+                IssueLabel.interned(l['name'], '#' + l['color'])
                 for l in data['labels']
             ],
             assignees=[self.person(u['login']) for u in data['assignees']],
@@ -75,27 +109,100 @@ class GitHubReader(ReaderBase):
             fetched_at=self._fetched_at(uid),
             closed_at=GitHubTimestamp(isotime=data['closed_at']).datetime \
                       if data['closed_at'] else None,
-            attachments=make_attachments(self.storage, data),
+            attachments=make_attachments(self.storage, data, index=self.index),
         )
         return issue
 
 
-    def issue_uids(self, sort_by='created_at', desc=True):
-        ids = next(os.walk(self.storage.issue_dir()))[1]
-        if sort_by == 'created_at':
+    def issue_uids(self, sort_by='created_at', desc=True, status=None, label=None):
+        self._check_sort_by(sort_by)
+        simple = sort_by == 'created_at' and status is None and label is None
+        if simple and not self.index:
+            ids = next(os.walk(self.storage.issue_dir()))[1]
             return sorted(ids, key=int, reverse=desc)
-        else:
+        numbers = self._metadata.issue_numbers(sort_by, desc, status, label)
+        return [str(number) for number in numbers]
+
+
+    def issue_summaries(self, sort_by='created_at', desc=True, status=None, label=None):
+        '''Read issue summaries from index without loading issues'''
+        self._check_sort_by(sort_by)
+        summaries = []
+        for row in self._metadata.summaries(sort_by, desc, status, label):
+            number, title, state, author, labels, comments, created, updated, closed = row
+            summaries.append(self._new(IssueSummary,
+                uid=str(number),
+                title=title,
+                status=state,
+                author_nickname=author,
+                labels=[IssueLabel.interned(name, '#' + color) for name, color in json.loads(labels)],
+                comments=comments,
+                created_at=GitHubTimestamp(unix=created).datetime,
+                modified_at=GitHubTimestamp(unix=updated).datetime,
+                closed_at=GitHubTimestamp(unix=closed).datetime if closed else None,
+            ))
+        return summaries
+
+
+    def _check_sort_by(self, sort_by):
+        if sort_by not in GitHubIndex.SORT_COLUMNS:
             raise NotImplementedError('{} does not support sorting by {!r}'.format(
                 self.__class__.__name__,
                 sort_by
             ))
 
 
+    @property
+    def _metadata(self):
+        '''
+        Compact table of issue metadata for sorting and filtering.
+        Without index file a temporary in-memory index is built on first use
+        '''
+        if self.index:
+            return self.index
+        with self._memory_index_lock:
+            if self._memory_index is None:
+                log.warning('No index file in %s, scanning all issues (use '
+                            '"issyours-github --rebuild-index" to speed this up)',
+                            self.storage.directory)
+                index = GitHubIndex(self.storage, path=':memory:')
+                index.rebuild()
+                self._memory_index = index
+        return self._memory_index
+
+
     def person_uids(self):
+        if self.index:
+            yield from self.index.person_logins()
+            return
         for filename in glob(os.path.join(self.storage.person_dir(), '*.json')):
             yield os.path.splitext(os.path.basename(filename))[0]
 
 
+    def fingerprint(self):
+        '''
+        Hash of markdown rendering configuration and of person details shown
+        on issue pages. Refreshed profiles and avatar images do not change it
+        unless those details have changed (avatars are published separately
+        under the same URLs). Person details are taken from the index, so
+        profiles are not read on every build
+        '''
+        digest = hashlib.sha256(_markdown_fingerprint().encode('utf-8'))
+        for login, name, url, picture in self._metadata.person_details():
+            digest.update('\0{}\0{}\0{}\0{:d}'.format(
+                login,
+                name,
+                url,
+                bool(picture),
+            ).encode('utf-8'))
+        return digest.hexdigest()
+
+
+    def issue_fingerprint(self, uid):
+        '''Hash of names, sizes and modification times of all issue files'''
+        return _hash_files(self.storage.issue_dir(issue_no=uid))
+
+
     def _fetched_at(self, issue_no):
         '''Read modification time from filesystem'''
         stamp = self.storage._stamp_path(issue_no)
@@ -109,11 +216,15 @@ class GitHubReader(ReaderBase):
         with open(person_file, 'r', encoding=self.storage.ENCODING) as f:
             data = json.load(f)
         image_file = self.storage.person_image(login)
-        if os.path.exists(image_file):
-            picture = open(image_file, 'rb')
+        if self.index:
+            has_picture = self.index.has_picture(login)
+        else:
+            has_picture = os.path.exists(image_file)
+        if has_picture:
+            picture = LazyFile(image_file)
         else:
             picture = None
-        return Person(
+        return self._new(Person,
             reader=self,
             nickname=login,
             fullname=data['name'],
@@ -125,30 +236,23 @@ class GitHubReader(ReaderBase):
     def _get_comments(self, issue, sort_by='created_at', desc=False):
         if not sort_by == 'created_at':
             raise ValueError('unsupported sorting method: {}'.format(sort_by))
-        directory = os.path.dirname(self.storage.issue_path(issue_no=issue.uid))
-        pattern = 'comment-*.json'
-        for filename in sorted(glob(os.path.join(directory, pattern)), reverse=desc):
-            with open(filename, encoding=self.storage.ENCODING) as f:
-                data = json.load(f)
-            yield IssueComment(
+        for data in self._read_records(issue.uid, 'comment', desc):
+            yield self._new(IssueComment,
                 issue=issue,
                 author=self.person(data['user']['login']),
                 author_role=data['author_association'],  # TODO: convert to consistent subset
-                body=render_markdown(data['body']),  # TODO: emoji reactions
+                body=partial(self.render_markdown, data['body']),  # TODO: emoji reactions
                 created_at=GitHubTimestamp(isotime=data['created_at']).datetime,
                 modified_at=GitHubTimestamp(isotime=data['updated_at']).datetime,
-                attachments=make_attachments(self.storage, issue_no=issue.uid, comment_data=data),
+                attachments=make_attachments(self.storage, issue_no=issue.uid, comment_data=data,
+                                             index=self.index),
             )
 
 
     def _get_events(self, issue, sort_by='created_at', desc=False):
         if not sort_by == 'created_at':
             raise ValueError('unsupported sorting method: {}'.format(sort_by))
-        directory = os.path.dirname(self.storage.issue_path(issue_no=issue.uid))
-        pattern = 'event-*.json'
-        for filename in sorted(glob(os.path.join(directory, pattern)), reverse=desc):
-            with open(filename, encoding=self.storage.ENCODING) as f:
-                data = json.load(f)
+        for data in self._read_records(issue.uid, 'event', desc):
             event_type = data['event']
             if event_type not in IssueEvent._known_events:
                 continue
@@ -157,7 +261,7 @@ class GitHubReader(ReaderBase):
             else:
                 author_data = data['actor']
             author_uid = author_data.get('login') if author_data else None
-            yield IssueEvent(
+            yield self._new(IssueEvent,
                 issue=issue,
                 author=self.person(author_uid) if author_uid else None,
                 type=event_type,
@@ -167,6 +271,36 @@ class GitHubReader(ReaderBase):
 
 
 
+    def render_markdown(self, text):
+        '''Render markdown as HTML, use cached results if possible'''
+        if not text or not self.markdown_cache:
+            return render_markdown(text)
+        key = '\n'.join((_markdown_fingerprint(), text))
+        return self.markdown_cache.cached(render_markdown, key, text)
+
+
+    def _read_records(self, issue_no, kind, desc=False):
+        '''Yield data of comments or events for a given issue in order of their names'''
+        if self.storage.issue_layout(issue_no=issue_no) == 'packed':
+            path = self.storage.packed_path(issue_no=issue_no)
+            with PackedRecords(path, readonly=True) as records:
+                for name in records.names(kind, desc):
+                    yield records.read(name)
+            return
+        for filename in self._list_files(issue_no, kind, desc):
+            with open(filename, encoding=self.storage.ENCODING) as f:
+                yield json.load(f)
+
+
+    def _list_files(self, issue_no, kind, desc=False):
+        '''Sorted list of comment or event files for a given issue'''
+        if self.index:
+            return self.index.files(issue_no, kind, desc=desc)
+        directory = self.storage.issue_dir(issue_no=issue_no)
+        pattern = '{}-*.json'.format(kind)
+        return sorted(glob(os.path.join(directory, pattern)), reverse=desc)
+
+
     def _extract_event_data(self, data):
         '''Transform GitHub event data into issyours event data'''
         good_keys = {
@@ -194,7 +328,7 @@ class GitHubReader(ReaderBase):
                 if isinstance(value, Mapping):
                     value = [value,]
                 for l in value:
-                    labels.append(IssueLabel(l['name'], '#' + l['color']))
+                    labels.append(IssueLabel.interned(l['name'], '#' + l['color']))
         if 'assignee' in result:
             result['assignees'] = set(result.get('assignees', []) + [result['assignee']])
             result.pop('assignee')
@@ -214,12 +348,34 @@ def _nested_dict_lookup(dictionary, *keys, default=None):
     return result
 
 
-def make_attachments(storage, issue_data=None, issue_no=None, comment_data=None):
+def _hash_files(directory, *extra):
+    '''Hash of directory listing with file sizes and modification times'''
+    try:
+        entries = sorted(os.scandir(directory), key=lambda entry: entry.name)
+    except FileNotFoundError:
+        return None
+    digest = hashlib.sha256()
+    for value in extra:
+        digest.update(value.encode('utf-8'))
+    for entry in entries:
+        stat = entry.stat()
+        digest.update('\0{}\0{}\0{}'.format(entry.name, stat.st_size, stat.st_mtime_ns).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def make_attachments(storage, issue_data=None, issue_no=None, comment_data=None, index=None):
     '''
     Return a generator that yields attachment objects for a particular
     issue or a comment
     '''
     attachments = []
+    if index:
+        if not issue_no:
+            issue_no = issue_data['number']
+        stored = set(index.files(issue_no, 'attachment')) | set(index.files(issue_no, 'patch'))
+        exists = stored.__contains__
+    else:
+        exists = os.path.exists
 
     if comment_data:
         body = comment_data['body']
@@ -227,7 +383,7 @@ def make_attachments(storage, issue_data=None, issue_no=None, comment_data=None)
         body = issue_data['body']
         issue_no = issue_data['number']
         patch_path = storage.patch_path(issue_data)
-        if os.path.exists(patch_path):
+        if exists(patch_path):
             attachments.append((
                 os.path.basename(patch_path),
                 issue_data['pull_request']['html_url'],
@@ -237,7 +393,7 @@ def make_attachments(storage, issue_data=None, issue_no=None, comment_data=None)
     linked_files = ((url, storage.attachment_path(url, issue_no=issue_no))
                     for url in attachment_urls(body))
     for url, filepath in linked_files:
-        if os.path.exists(filepath):
+        if exists(filepath):
             attachments.append((
                 make_filename(url, filepath),
                 url,
@@ -246,7 +402,7 @@ def make_attachments(storage, issue_data=None, issue_no=None, comment_data=None)
 
     def generator():
         for name, url, filepath in attachments:
-            yield IssueAttachment(name=name, original_url=url, stream=open(filepath, 'rb'))
+            yield IssueAttachment(name=name, original_url=url, stream=LazyFile(filepath))
 
     return generator
 
@@ -288,6 +444,31 @@ MARKDOWN_CONFIG={
     },
     'output_format': 'html5',
 }
+_markdown = threading.local()
 def render_markdown(text):
     '''Render markdown as HTML following GitHub conventions'''
-    return markdown(text, **MARKDOWN_CONFIG)
+    # Creating Markdown object is expensive (all extensions are initialized
+    # from scratch), so each thread reuses its own instance
+    renderer = getattr(_markdown, 'renderer', None)
+    if renderer is None:
+        renderer = _markdown.renderer = Markdown(**MARKDOWN_CONFIG)
+    return renderer.reset().convert(text)
+
+
+@lru_cache(maxsize=1)
+def _markdown_fingerprint():
+    '''
+    String that changes whenever markdown rendering may produce different
+    output for the same input
+    '''
+    import pygments
+    import pymdownx
+    versions = {
+        'markdown': markdown_version,
+        'pygments': pygments.__version__,
+        'pymdownx': getattr(pymdownx, '__version__', None),
+    }
+    def qualname(obj):
+        return '{}.{}'.format(obj.__module__, obj.__qualname__)
+    config = json.dumps([MARKDOWN_CONFIG, versions], sort_keys=True, default=qualname)
+    return hashlib.sha256(config.encode('utf-8')).hexdigest()
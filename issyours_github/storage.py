@@ -4,17 +4,27 @@ Common storage interaction methods used both by fetcher and reader
 
 import base64
 import hashlib
+import json
 import os
+from tempfile import mkstemp
 
 from issyours_github.api import GitHubTimestamp
 
 
 
 class GitHubFileStorage:
-    '''Common base class for fetcher and reader'''
+    '''
+    Common base class for fetcher and reader
+
+    Comments and events of each issue are stored either as separate JSON
+    files ('files' layout) or in a single packed records file ('packed'
+    layout, see issyours_github.packed). Both layouts may be mixed within
+    one storage directory
+    '''
 
 
     ENCODING = 'utf-8'
+    LAYOUTS = ('files', 'packed')
 
 
     def __init__(self, repo, directory):
@@ -58,6 +68,18 @@ class GitHubFileStorage:
         return os.path.join(self.issue_dir(issue), filename)
 
 
+    def packed_path(self, issue=None, issue_no=None):
+        '''Path to packed records file with all comments and events of the issue'''
+        return os.path.join(self.issue_dir(issue, issue_no), 'records.jsonl')
+
+
+    def issue_layout(self, issue=None, issue_no=None):
+        '''Detect the layout used to store comments and events of the issue'''
+        if os.path.exists(self.packed_path(issue, issue_no)):
+            return 'packed'
+        return 'files'
+
+
     def person_dir(self):
         '''Directory where all person entries are stored'''
         return os.path.join(self.directory, 'people')
@@ -80,12 +102,18 @@ class GitHubFileStorage:
     def attachment_path(self, attach_url, issue=None, issue_no=None):
         '''Path to an attachment file'''
         directory = self.issue_dir(issue, issue_no)
+        filename = 'attach-{}'.format(_url_hash(attach_url))
+        return os.path.join(directory, filename)
 
-        hashed_name = hashlib.md5(attach_url.encode('utf-8')).digest()
-        shorter_hash = base64.urlsafe_b64encode(hashed_name).decode('utf-8').rstrip('=')
-        filename = 'attach-{}'.format(shorter_hash)
 
-        return os.path.join(directory, filename)
+    def cache_dir(self):
+        '''Directory where cached API responses are stored'''
+        return os.path.join(self.directory, 'cache')
+
+
+    def cache_path(self, url):
+        '''Path to cached API response for a given URL'''
+        return os.path.join(self.cache_dir(), '{}.json'.format(_url_hash(url)))
 
 
     def patch_path(self, issue):
@@ -93,6 +121,11 @@ class GitHubFileStorage:
         return os.path.join(self.issue_dir(issue), 'proposed.patch')
 
 
+    def index_path(self):
+        '''Path to SQLite index file'''
+        return os.path.join(self.directory, 'index.sqlite')
+
+
     def _stamp_path(self, issue_no=None):
         '''Calculate path to stamp file'''
         if issue_no:
@@ -100,3 +133,32 @@ class GitHubFileStorage:
         else:
             directory = self.directory
         return os.path.join(directory, 'fetcher.json')
+
+
+
+def _url_hash(url):
+    '''Short filesystem-safe hash of URL'''
+    hashed_name = hashlib.md5(url.encode('utf-8')).digest()
+    return base64.urlsafe_b64encode(hashed_name).decode('utf-8').rstrip('=')
+
+
+def write_json(dictionary, filepath):
+    '''Serialize a dictionary into a JSON file'''
+    serialized = json.dumps(dictionary, indent=2, sort_keys=True, ensure_ascii=False)
+    safe_write(filepath, serialized)
+
+
+def safe_write(filepath, content, mode='w'):
+    '''Safely (over)write a small file'''
+    directory, filename = os.path.split(os.path.abspath(filepath))
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+
+    text_mode = 'b' not in mode
+    if text_mode:
+        content = content.encode('utf-8')
+
+    tmp, tmppath = mkstemp(prefix=filename, dir=directory, text=text_mode)
+    os.write(tmp, content)
+    os.close(tmp)
+    os.replace(tmppath, filepath)
@@ -25,6 +25,9 @@ setup(
         'requests',
     ],
     extras_require={
+        'async': [
+            'aiohttp',
+        ],
         'with-default-theme': [
             'alchemy @ https://github.com/nairobilug/pelican-alchemy/tarball/master',
         ],
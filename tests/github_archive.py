@@ -0,0 +1,108 @@
+'''
+Synthetic GitHub issues archive for tests
+'''
+
+
+from tempfile import TemporaryDirectory
+
+from issyours_github.api import GitHubTimestamp
+from issyours_github.fetcher import GitHubFetcher, write_json
+from issyours_github.packed import convert_layout
+from issyours_github.storage import GitHubFileStorage
+
+
+REPO = 'owner/project'
+USERS = ('alice', 'bob', 'carol')
+
+
+def isotime(unix):
+    return GitHubTimestamp(unix=unix).isotime
+
+
+def make_issue(number, comments=2):
+    created = 1500000000 + number * 3600
+    attach_url = 'https://user-images.githubusercontent.com/1/{}.png'.format(number)
+    return {
+        'number': number,
+        'title': 'Issue number {}'.format(number),
+        'body': 'Body of *issue* {}\n\n![screenshot]({})'.format(number, attach_url),
+        'state': 'closed' if number % 3 == 0 else 'open',
+        'user': {'login': USERS[number % len(USERS)]},
+        'author_association': 'CONTRIBUTOR',
+        'html_url': 'https://github.com/{}/issues/{}'.format(REPO, number),
+        'labels': [{'name': 'bug', 'color': 'ff0000'}] if number % 2 else [],
+        'assignees': [{'login': USERS[0]}],
+        'comments': comments,
+        'created_at': isotime(created),
+        'updated_at': isotime(created + number * 60),
+        'closed_at': isotime(created + 7200) if number % 3 == 0 else None,
+    }
+
+
+def make_comment(number, index):
+    created = 1500000000 + number * 3600 + index * 60
+    return {
+        'id': number * 1000 + index,
+        'user': {'login': USERS[index % len(USERS)]},
+        'author_association': 'NONE',
+        'body': 'Comment {} on issue {}'.format(index, number),
+        'created_at': isotime(created),
+        'updated_at': isotime(created),
+    }
+
+
+def make_event(number, index):
+    created = 1500000000 + number * 3600 + index * 60 + 30
+    return {
+        'id': number * 1000 + index,
+        'event': 'labeled',
+        'actor': {'login': USERS[index % len(USERS)]},
+        'label': {'name': 'bug', 'color': 'ff0000'},
+        'created_at': isotime(created),
+    }
+
+
+def make_person(login):
+    return {
+        'login': login,
+        'name': login.title(),
+        'html_url': 'https://github.com/{}'.format(login),
+        'updated_at': isotime(1500000000),
+    }
+
+
+class Archive(TemporaryDirectory):
+    '''Temporary directory filled with GitHubFetcher-like data'''
+
+    def __init__(self, issues=5, comments=2, events=1, layout='files'):
+        super().__init__()
+        self.issues = issues
+        self.comments = comments
+        self.events = events
+        self.storage = GitHubFileStorage(REPO, self.name)
+        self.populate()
+        convert_layout(self.storage, layout)
+
+
+    def populate(self):
+        storage = self.storage
+        fetcher = GitHubFetcher.__new__(GitHubFetcher)  # only stamp methods are used
+        GitHubFileStorage.__init__(fetcher, REPO, self.name)
+        fetcher.index = None
+        for number in range(1, self.issues + 1):
+            issue = make_issue(number, self.comments)
+            write_json(issue, storage.issue_path(issue))
+            for index in range(self.comments):
+                comment = make_comment(number, index)
+                write_json(comment, storage.comment_path(issue, comment))
+            for index in range(self.events):
+                event = make_event(number, index)
+                write_json(event, storage.event_path(issue, event))
+            attach_url = 'https://user-images.githubusercontent.com/1/{}.png'.format(number)
+            with open(storage.attachment_path(attach_url, issue), 'wb') as f:
+                f.write(b'PNG' * number)
+            fetcher.write_stamp(issue)
+        for login in USERS:
+            write_json(make_person(login), storage.person_path(login))
+            with open(storage.person_image(login), 'wb') as f:
+                f.write(login.encode())
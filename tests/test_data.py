@@ -0,0 +1,168 @@
+'''
+Unit tests for data classes
+'''
+
+
+import unittest
+from datetime import datetime
+from itertools import islice
+from types import SimpleNamespace
+
+import attr
+
+from issyours.data import Issue, IssueLabel, Person
+from issyours.reader import ReaderBase
+from issyours_github import GitHubReader
+
+from tests.github_archive import Archive, REPO
+
+
+class TrustedConstructionTests(unittest.TestCase):
+
+    def setUp(self):
+        self.archive = Archive(issues=1)
+        self.reader = GitHubReader(REPO, self.archive.name)
+
+
+    def tearDown(self):
+        self.archive.cleanup()
+
+
+    def test_same_objects(self):
+        person = Person(reader=self.reader, nickname='alice')
+        fields = dict(
+            reader=self.reader,
+            uid='1',
+            author=person,
+            author_role=' OWNER ',
+            labels=[IssueLabel('bug', '#ff0000')],
+            created_at=datetime(2020, 1, 1),
+        )
+        trusted = Issue.trusted(**fields)
+        self.assertIs(type(trusted), Issue)
+        self.assertEqual(trusted, Issue(**fields))
+        self.assertEqual(trusted.author_role, 'OWNER')  # converters are applied
+        self.assertEqual(trusted.assignees, [])  # defaults too
+        self.assertEqual(Person.trusted(self.reader, 'alice'), person)
+
+
+    def test_no_validation(self):
+        with self.assertRaises(ValueError):
+            IssueLabel('bug', 'red')
+        self.assertEqual(IssueLabel.trusted('bug', 'red').color, 'red')
+        with self.assertRaises(TypeError):
+            Issue(reader=self.reader, uid='1', author=None, created_at='yesterday')
+        Issue.trusted(reader=self.reader, uid='1', author=None, created_at='yesterday')
+
+
+
+class FeedTests(unittest.TestCase):
+
+    def test_github_feed(self):
+        with Archive(issues=3, comments=4, events=3) as directory:
+            reader = GitHubReader(REPO, directory)
+            issue = reader.issue('2')
+            feed = [(item.created_at, kind) for item, kind in issue.feed()]
+            self.assertEqual(feed, sorted(feed))
+            self.assertEqual([kind for _, kind in feed].count('event'), 3)
+            self.assertEqual([(i.created_at, k) for i, k in issue.feed(desc=True)], feed[::-1])
+
+
+    def test_many_sources(self):
+        '''Any number of sources is merged lazily, ties keep the order of sources'''
+        def stream(kind, minutes, desc, consumed):
+            for minute in sorted(minutes, reverse=desc):
+                consumed.append((kind, minute))
+                yield SimpleNamespace(created_at=datetime(2020, 1, 1, 0, minute), kind=kind)
+
+        class Reader(GitHubReader):
+            def _feed_sources(self, issue, sort_by='created_at', desc=False):
+                return [(kind, stream(kind, minutes, desc, consumed))
+                        for kind, minutes in sources.items()]
+
+        sources = {'comment': [1, 5, 7], 'event': [2, 5, 9], 'review': [0, 5, 8, 10]}
+        consumed = []
+        with Archive(issues=1) as directory:
+            issue = Reader(REPO, directory).issue('1')
+            feed = issue.feed()
+            self.assertEqual([(item.created_at.minute, kind) for item, kind in islice(feed, 4)],
+                             [(0, 'review'), (1, 'comment'), (2, 'event'), (5, 'comment')])
+            self.assertLess(len(consumed), 10)  # sources are not read in full
+            self.assertEqual([kind for item, kind in feed][:2], ['event', 'review'])
+            self.assertEqual(
+                [(item.created_at.minute, kind) for item, kind in issue.feed(desc=True)][4:7],
+                [(5, 'comment'), (5, 'event'), (5, 'review')],
+            )
+
+
+
+class DeferredBodyTests(unittest.TestCase):
+
+    def test_render_on_access(self):
+        rendered = []
+
+        class Reader(GitHubReader):
+            ISSUE_CACHE_BYTES = 2**20  # size estimation must not render the body
+
+            def render_markdown(self, text):
+                rendered.append(text)
+                return super().render_markdown(text)
+
+        with Archive(issues=2, comments=3) as directory:
+            reader = Reader(REPO, directory)
+            issue = reader.issue('1')
+            comments = list(issue.comments())
+            self.assertEqual(rendered, [])
+            self.assertTrue(issue.body.startswith('<'))
+            self.assertIs(issue.body, issue.body)  # rendered only once
+            self.assertEqual(len(rendered), 1)
+            self.assertEqual([c.body for c in comments],
+                             [GitHubReader(REPO, directory).render_markdown(t) for t in rendered[1:]])
+
+
+    def test_plain_values(self):
+        reader = SimpleNamespace()
+        issue = Issue.trusted(reader=reader, uid='1', author=None, body='<p>text</p>')
+        self.assertEqual(issue.body, '<p>text</p>')
+        issue = Issue.trusted(reader=reader, uid='1', author=None, body=lambda: '<p>late</p>')
+        self.assertEqual(issue.body, '<p>late</p>')
+        with self.assertRaises(AttributeError):
+            issue.body = 'changed'
+
+
+    def test_attrs_interface(self):
+        '''Deferred body is still a regular attrs field'''
+        with Archive(issues=1) as directory:
+            reader = GitHubReader(REPO, directory)
+        issue = Issue(reader=reader, uid='1', author=None, body=lambda: '<p>late</p>')
+        self.assertEqual(attr.asdict(issue, recurse=False)['body'], '<p>late</p>')
+        self.assertNotIn('_body', repr(issue))
+        changed = attr.evolve(issue, body='<p>changed</p>')
+        self.assertEqual(changed.body, '<p>changed</p>')
+        self.assertEqual(issue.body, '<p>late</p>')
+        changed = attr.evolve(issue, body=lambda: '<p>deferred</p>')
+        self.assertEqual(changed.body, '<p>deferred</p>')
+
+
+
+class LegacyReaderTests(unittest.TestCase):
+    '''Readers that do not support filtering issues'''
+
+    class Reader(GitHubReader):
+        def issue_uids(self, sort_by='created_at', desc=True):
+            return super().issue_uids(sort_by, desc)
+
+
+    def test_no_filters(self):
+        with Archive(issues=3) as directory:
+            reader = self.Reader(REPO, directory)
+            self.assertEqual([issue.uid for issue in reader.issues()], ['3', '2', '1'])
+            summaries = ReaderBase.issue_summaries(reader, desc=False)
+            self.assertEqual([s.uid for s in summaries], ['1', '2', '3'])
+
+
+    def test_unsupported_filter(self):
+        with Archive(issues=3) as directory:
+            reader = self.Reader(REPO, directory)
+            with self.assertRaises(NotImplementedError):
+                list(reader.issues(status='open'))
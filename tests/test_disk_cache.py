@@ -0,0 +1,58 @@
+'''
+Unit tests for persistent rendered markdown cache
+'''
+
+
+import os
+import unittest
+from tempfile import TemporaryDirectory
+
+from issyours.lazy import DiskCache
+from issyours_github import GitHubReader
+
+from tests.github_archive import Archive, REPO
+
+
+class DiskCacheTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = TemporaryDirectory()
+
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+
+    def test_counters(self):
+        cache = DiskCache(self.tmp.name)
+        self.assertIsNone(cache.get('hello'))
+        cache.set('hello', 'world')
+        self.assertEqual(cache.get('hello'), 'world')
+        self.assertEqual(DiskCache(self.tmp.name).get('hello'), 'world')
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+
+    def test_eviction(self):
+        cache = DiskCache(self.tmp.name, maxsize=1000, shrink_to=0.5)
+        for number in range(20):
+            cache.set(str(number), 'x' * 100)
+            path = cache._path(str(number))
+            os.utime(path, (number, number))  # make recency deterministic
+        size = sum(size for _, _, size in cache._files())
+        self.assertLessEqual(size, 1000)
+        self.assertGreater(cache.evictions, 0)
+        self.assertIsNotNone(cache.get('19'))
+        self.assertIsNone(cache.get('0'))
+
+
+    def test_reader(self):
+        '''Rendered bodies are reused by another reader instance'''
+        with Archive(issues=3) as directory:
+            first = GitHubReader(REPO, directory, markdown_cache=self.tmp.name)
+            bodies = [first.issue(uid).body for uid in first.issue_uids()]
+            self.assertEqual(first.markdown_cache.misses, 3)
+
+            second = GitHubReader(REPO, directory, markdown_cache=self.tmp.name)
+            self.assertEqual(bodies, [second.issue(uid).body for uid in second.issue_uids()])
+            self.assertEqual((second.markdown_cache.hits, second.markdown_cache.misses), (3, 0))
+            self.assertIn('<em>issue</em>', bodies[0])
@@ -0,0 +1,215 @@
+'''
+Test GitHub API clients (sync and asyncio) against local stub HTTP server
+'''
+
+
+import asyncio
+import json
+import threading
+import unittest
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import urlparse, parse_qs
+
+try:
+    from issyours_github.aio import AsyncGitHubAPI
+except (ImportError, SyntaxError):  # async generators require Python 3.6+
+    AsyncGitHubAPI = None
+
+from issyours_github.api import GitHubAPI, GitHubNotModifiedException
+
+
+LAST_MODIFIED = 'Sat, 28 Dec 2019 01:02:03 GMT'
+
+
+async def collect(iterable):
+    '''Return a list of items from asynchronous iterable (no async comprehensions in 3.5)'''
+    result = []
+    async for item in iterable:
+        result.append(item)
+    return result
+
+
+class StubServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+
+class StubGitHub(BaseHTTPRequestHandler):
+    '''Minimal imitation of GitHub REST API'''
+
+    ISSUES = 7
+    PER_PAGE = 3
+    NOT_MODIFIED = {2, 5}
+
+    def log_message(self, *a):
+        pass
+
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        root = 'http://{}:{}'.format(*self.server.server_address)
+        parts = url.path.strip('/').split('/')
+        self.server.requests.append((url.path, dict(self.headers)))
+
+        if parts[:4] == ['repos', 'owner', 'repo', 'issues'] and len(parts) == 4:
+            page = int(parse_qs(url.query).get('page', ['1'])[0])
+            numbers = range((page - 1) * self.PER_PAGE + 1,
+                            min(page * self.PER_PAGE, self.ISSUES) + 1)
+            body = [{'number': n, 'url': '{}/repos/owner/repo/issues/{}'.format(root, n)}
+                    for n in numbers]
+            links = None
+            if page * self.PER_PAGE < self.ISSUES:
+                links = '<{}/repos/owner/repo/issues?page={}>; rel="next"'.format(root, page + 1)
+            return self.reply(200, body, links=links)
+
+        if parts[:4] == ['repos', 'owner', 'repo', 'issues'] and len(parts) == 5:
+            number = int(parts[4])
+            if 'If-Modified-Since' in self.headers and number in self.NOT_MODIFIED:
+                return self.reply(304)
+            return self.reply(200, {'number': number, 'title': 'Issue {}'.format(number)},
+                              extra={'Last-Modified': LAST_MODIFIED})
+
+        if parts[0] == 'users':
+            if 'If-Modified-Since' in self.headers:
+                return self.reply(304)
+            return self.reply(200, {'login': parts[1]})
+
+        return self.reply(404, {'message': 'Not Found'})
+
+
+    def reply(self, status, body=None, links=None, extra=None):
+        content = json.dumps(body).encode('utf-8') if body is not None else b''
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.send_header('X-RateLimit-Remaining', '4999')
+        self.send_header('X-RateLimit-Reset', '1577494923')
+        if links:
+            self.send_header('Link', links)
+        for header, value in (extra or {}).items():
+            self.send_header(header, value)
+        self.end_headers()
+        self.wfile.write(content)
+
+
+
+class SyncAPITests(unittest.TestCase):
+
+    def setUp(self):
+        self.server = StubServer(('127.0.0.1', 0), StubGitHub)
+        self.server.requests = []
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+    def client(self):
+        github = GitHubAPI('secret')
+        github.api.API_ROOT = 'http://{}:{}'.format(*self.server.server_address)
+        return github
+
+
+    def test_list_only(self):
+        '''Check that no per-issue requests are made by default'''
+        issues = list(self.client().issues('owner', 'repo'))
+        self.assertEqual([i['number'] for i in issues], list(range(1, StubGitHub.ISSUES + 1)))
+        for issue in issues:
+            self.assertNotIn('header-last-modified', issue)
+        for path, headers in self.server.requests:
+            self.assertEqual(path, '/repos/owner/repo/issues')
+
+
+    def test_refetch(self):
+        '''Check per-issue requests and skipping of unchanged issues'''
+        since = datetime(2019, 12, 28)
+        issues = list(self.client().issues('owner', 'repo', since=since, refetch=True))
+        expected = [n for n in range(1, StubGitHub.ISSUES + 1) if n not in StubGitHub.NOT_MODIFIED]
+        self.assertEqual([i['number'] for i in issues], expected)
+        for issue in issues:
+            self.assertEqual(issue['header-last-modified'], LAST_MODIFIED)
+
+
+
+@unittest.skipIf(AsyncGitHubAPI is None, 'requires aiohttp and Python 3.6+')
+class AsyncAPITests(unittest.TestCase):
+
+    def setUp(self):
+        self.server = StubServer(('127.0.0.1', 0), StubGitHub)
+        self.server.requests = []
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        self.root = 'http://{}:{}/'.format(*self.server.server_address)
+
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+    def run_async(self, coroutine):
+        loop = asyncio.new_event_loop()
+        try:
+            return loop.run_until_complete(coroutine)
+        finally:
+            loop.close()
+
+
+    def client(self):
+        github = AsyncGitHubAPI('secret', pool_size=2)
+        github.api.API_ROOT = self.root
+        return github
+
+
+    def test_issues(self):
+        '''Check pagination and per-issue requests'''
+        async def fetch():
+            async with self.client() as github:
+                return await collect(github.issues('owner', 'repo', refetch=True))
+        issues = self.run_async(fetch())
+        self.assertEqual([i['number'] for i in issues], list(range(1, StubGitHub.ISSUES + 1)))
+        for issue in issues:
+            self.assertEqual(issue['header-last-modified'], LAST_MODIFIED)
+        for path, headers in self.server.requests:
+            self.assertEqual(headers['Authorization'], 'token secret')
+
+
+    def test_not_modified(self):
+        '''Check that unchanged issues are skipped'''
+        async def fetch():
+            async with self.client() as github:
+                since = datetime(2019, 12, 28)
+                issues = github.issues('owner', 'repo', since=since, refetch=True)
+                return [i['number'] for i in await collect(issues)]
+        numbers = self.run_async(fetch())
+        expected = [n for n in range(1, StubGitHub.ISSUES + 1) if n not in StubGitHub.NOT_MODIFIED]
+        self.assertEqual(numbers, expected)
+
+
+    def test_list_only(self):
+        '''Check that no per-issue requests are made by default'''
+        async def fetch():
+            async with self.client() as github:
+                return [i['number'] for i in await collect(github.issues('owner', 'repo'))]
+        numbers = self.run_async(fetch())
+        self.assertEqual(numbers, list(range(1, StubGitHub.ISSUES + 1)))
+        for path, headers in self.server.requests:
+            self.assertEqual(path, '/repos/owner/repo/issues')
+
+
+    def test_person(self):
+        async def fetch():
+            async with self.client() as github:
+                return await github.person('octocat')
+        self.assertEqual(self.run_async(fetch()), {'login': 'octocat'})
+
+        async def fetch_since():
+            async with self.client() as github:
+                return await github.person('octocat', since=datetime(2019, 12, 28))
+        with self.assertRaises(GitHubNotModifiedException):
+            self.run_async(fetch_since())
@@ -0,0 +1,97 @@
+'''
+Test conditional requests with cached GitHub API responses
+'''
+
+
+import json
+import os
+import threading
+import time
+import unittest
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from tempfile import TemporaryDirectory
+
+from issyours_github.api import GitHubAPI
+from issyours_github.fetcher import GitHubResponseCache
+from issyours_github.storage import GitHubFileStorage
+
+
+ETAG = '"comments-v1"'
+COMMENTS = [{'id': 1, 'body': 'first'}, {'id': 2, 'body': 'second'}]
+
+
+class StubGitHub(BaseHTTPRequestHandler):
+    '''Comments endpoint that supports If-None-Match'''
+
+    def log_message(self, *a):
+        pass
+
+
+    def do_GET(self):
+        self.server.requests.append((self.path, self.headers.get('If-None-Match')))
+        if self.headers.get('If-None-Match') == ETAG:
+            self.send_response(304)
+            body = b''
+        else:
+            self.send_response(200)
+            body = json.dumps(COMMENTS).encode()
+            self.send_header('Content-Type', 'application/json')
+        self.send_header('ETag', ETAG)
+        self.send_header('X-RateLimit-Remaining', '100')
+        self.send_header('X-RateLimit-Reset', str(int(time.time()) + 3600))
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+
+class ResponseCacheTests(unittest.TestCase):
+
+    def setUp(self):
+        self.server = HTTPServer(('127.0.0.1', 0), StubGitHub)
+        self.server.requests = []
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        self.tmp = TemporaryDirectory()
+        self.storage = GitHubFileStorage('owner/repo', self.tmp.name)
+        self.cache = GitHubResponseCache(self.storage)
+
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.tmp.cleanup()
+
+
+    def comments(self, since):
+        api = GitHubAPI('token', cache=self.cache)
+        api.api.API_ROOT = 'http://{}:{}'.format(*self.server.server_address)
+        return list(api.comments('owner', 'repo', 1, since=since))
+
+
+    def test_newer_since(self):
+        '''Next run with a newer stamp revalidates the same cache entry'''
+        first = self.comments(since=datetime(2020, 1, 1))
+        second = self.comments(since=datetime(2020, 2, 1))
+        self.assertEqual(first, COMMENTS)
+        self.assertEqual(second, COMMENTS)
+        (path1, etag1), (path2, etag2) = self.server.requests
+        self.assertIn('since=2020-01-01', path1)
+        self.assertIn('since=2020-02-01', path2)
+        self.assertEqual((etag1, etag2), (None, ETAG))
+        self.assertEqual(len(os.listdir(self.storage.cache_dir())), 1)
+
+
+    def test_prune(self):
+        for number in range(10):
+            self.cache.set('https://example.com/{}'.format(number), {'content': 'x' * 1000})
+            path = self.storage.cache_path('https://example.com/{}'.format(number))
+            os.utime(path, (number, number))
+        self.cache.get('https://example.com/0')  # recently used
+        self.cache.maxsize = 5000
+        self.cache.prune()
+        self.assertLessEqual(len(os.listdir(self.storage.cache_dir())), 4)
+        self.assertIsNotNone(self.cache.get('https://example.com/0'))
+        self.assertIsNotNone(self.cache.get('https://example.com/9'))
+        self.assertIsNone(self.cache.get('https://example.com/1'))
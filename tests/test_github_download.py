@@ -0,0 +1,175 @@
+'''
+Test streaming downloads in GitHub fetcher
+'''
+
+
+import json
+import os
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from tempfile import TemporaryDirectory
+from types import SimpleNamespace
+
+from issyours_github import GitHubFetcher
+from issyours_github.fetcher import attachment_urls, download
+
+
+CONTENT = bytes(range(256)) * 1000
+
+
+class StubFileServer(BaseHTTPRequestHandler):
+    '''Serve CONTENT with optional support for Range and If-Range headers'''
+
+    ETAG = '"v1"'
+
+    def log_message(self, *a):
+        pass
+
+
+    def do_GET(self):
+        self.server.ranges.append(self.headers.get('Range'))
+        self.server.if_range.append(self.headers.get('If-Range'))
+        self.server.auth.append(self.headers.get('Authorization'))
+        start = 0
+        if self.headers.get('Range') and self.server.accept_ranges \
+        and self.headers.get('If-Range', self.ETAG) == self.ETAG:
+            start = int(self.headers['Range'].split('=')[1].rstrip('-'))
+        content = CONTENT[start:]
+        if start:
+            start += self.server.range_error
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes {}-{}/{}'.format(
+                start, len(CONTENT) - 1, len(CONTENT)))
+        else:
+            self.send_response(200)
+        self.send_header('ETag', self.ETAG)
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+
+
+class DownloadTests(unittest.TestCase):
+
+    def setUp(self):
+        self.server = HTTPServer(('127.0.0.1', 0), StubFileServer)
+        self.server.ranges = []
+        self.server.auth = []
+        self.server.if_range = []
+        self.server.accept_ranges = True
+        self.server.range_error = 0
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        self.url = 'http://{}:{}/file'.format(*self.server.server_address)
+        self.tmp = TemporaryDirectory()
+        self.dest = os.path.join(self.tmp.name, 'nested', 'attach')
+
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.tmp.cleanup()
+
+
+    def read(self):
+        with open(self.dest, 'rb') as f:
+            return f.read()
+
+
+    def partial(self, content, validator=StubFileServer.ETAG):
+        '''Leave partial file as if previous download was interrupted'''
+        os.makedirs(os.path.dirname(self.dest))
+        with open(self.dest + '.part', 'wb') as f:
+            f.write(content)
+        if validator:
+            with open(self.dest + '.part.meta', 'w') as f:
+                json.dump(dict(url=self.url, validator=validator), f)
+
+
+    def test_download(self):
+        download(self.url, self.dest, chunk_size=1000)
+        self.assertEqual(self.read(), CONTENT)
+        self.assertFalse(os.path.exists(self.dest + '.part'))
+        self.assertFalse(os.path.exists(self.dest + '.part.meta'))
+
+
+    def test_resume(self):
+        self.partial(CONTENT[:1234])
+        download(self.url, self.dest)
+        self.assertEqual(self.server.ranges, ['bytes=1234-'])
+        self.assertEqual(self.server.if_range, [StubFileServer.ETAG])
+        self.assertEqual(self.read(), CONTENT)
+
+
+    def test_resume_changed(self):
+        '''File has changed on server since the partial download'''
+        self.partial(b'garbage', validator='"v0"')
+        download(self.url, self.dest)
+        self.assertEqual(self.server.if_range, ['"v0"'])
+        self.assertEqual(self.read(), CONTENT)
+
+
+    def test_resume_without_validator(self):
+        self.partial(b'garbage', validator=None)
+        download(self.url, self.dest)
+        self.assertEqual(self.server.ranges, [None])
+        self.assertEqual(self.read(), CONTENT)
+
+
+    def test_resume_unsupported(self):
+        '''Server ignores Range header and sends the whole file'''
+        self.server.accept_ranges = False
+        self.partial(b'garbage')
+        download(self.url, self.dest)
+        self.assertEqual(self.read(), CONTENT)
+
+
+    def test_wrong_content_range(self):
+        '''Partial response that does not continue the partial file'''
+        self.server.range_error = 10
+        self.partial(CONTENT[:1234])
+        download(self.url, self.dest)
+        self.assertEqual(self.server.ranges, ['bytes=1234-', None])
+        self.assertEqual(self.read(), CONTENT)
+
+
+    def test_no_credentials(self):
+        '''Download queue does not send OAuth token to arbitrary hosts'''
+        fetcher = GitHubFetcher('owner/project', self.tmp.name, token='secret',
+                                http_cache=False, index=False)
+        fetcher.open_downloads()
+        fetcher.downloads.put(self.url, self.dest)
+        fetcher.downloads.join()
+        self.assertEqual(self.read(), CONTENT)
+        self.assertEqual(self.server.auth, [None])
+
+
+    def test_attachment_hosts(self):
+        body = '''
+            https://user-images.githubusercontent.com/1/a.png
+            https://github.com/owner/project/files/2/log.txt
+            https://evil.example#githubusercontent.com/x
+            https://evilgithubusercontent.com/x
+            https://githubusercontent.com.evil.example/x
+            https://github.com.evil.example/owner/project/files/3/x
+        '''
+        self.assertEqual(list(attachment_urls(body)), [
+            'https://user-images.githubusercontent.com/1/a.png',
+            'https://github.com/owner/project/files/2/log.txt',
+        ])
+
+
+    def test_worker_error(self):
+        '''Failure of issue worker is not masked by download errors'''
+        def fetch_issue(issue):
+            future = fetcher.downloads.put('http://127.0.0.1:1/refused', self.dest)
+            future.exception()  # wait for connection error
+            raise RuntimeError('worker failed')
+
+        fetcher = GitHubFetcher('owner/project', self.tmp.name, token='secret',
+                                http_cache=False, index=False)
+        fetcher.api = SimpleNamespace(issues=lambda *a, **ka: iter([{'number': 1}]))
+        fetcher.fetch_issue = fetch_issue
+        with self.assertRaisesRegex(RuntimeError, 'worker failed'):
+            fetcher.fetch()
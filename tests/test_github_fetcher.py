@@ -0,0 +1,112 @@
+'''
+Test concurrent fetching of GitHub issues with a stub API
+'''
+
+
+import os
+import threading
+import unittest
+from tempfile import TemporaryDirectory
+
+from issyours_github.api import GitHubNotModifiedException, GitHubTimestamp
+from issyours_github.fetcher import GitHubFetcher
+from issyours_github.storage import GitHubFileStorage
+
+from tests.github_archive import REPO, make_comment, make_event, make_issue
+
+
+class StubAPI:
+    '''Serve synthetic issues, optionally fail on comments of a single issue'''
+
+    def __init__(self, issues, fail=None, barrier=None):
+        self.numbers = range(1, issues + 1)
+        self.fail = fail
+        self.barrier = barrier
+        self.since = []
+
+
+    def issues(self, owner, repo, since=None, refetch=False):
+        self.since.append(since)
+        for number in self.numbers:
+            issue = make_issue(number)
+            issue.update(body='No attachments', comments_url=number, events_url=number)
+            yield issue
+
+
+    def comments(self, url, since):
+        if self.barrier:
+            self.barrier.wait()  # all workers must be busy at the same time
+        if url == self.fail:
+            raise RuntimeError('comments of issue {} are not available'.format(url))
+        return iter([make_comment(url, index) for index in range(2)])
+
+
+    def events(self, url, since):
+        return iter([make_event(url, 0)])
+
+
+    def person(self, nickname, since=None):
+        raise GitHubNotModifiedException()
+
+
+
+class FetcherTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = TemporaryDirectory()
+
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+
+    def fetcher(self, api, jobs=3):
+        fetcher = GitHubFetcher(REPO, self.tmp.name, token=None, jobs=jobs,
+                                http_cache=False, index=False)
+        fetcher.api = api
+        return fetcher
+
+
+    def stamped(self, number=None):
+        return os.path.exists(GitHubFileStorage(REPO, self.tmp.name)._stamp_path(number))
+
+
+    def test_concurrent(self):
+        '''Issues are fetched by several workers, each one is stamped'''
+        api = StubAPI(issues=9, barrier=threading.Barrier(3, timeout=5))
+        self.fetcher(api, jobs=3).fetch()
+        for number in api.numbers:
+            self.assertTrue(self.stamped(number), 'issue #{} is not stamped'.format(number))
+            issue_dir = os.path.join(self.tmp.name, 'issues', str(number))
+            self.assertEqual(len([f for f in os.listdir(issue_dir) if f.startswith('comment-')]), 2)
+        self.assertTrue(self.stamped())
+
+
+    def test_resume(self):
+        '''Failed issue is not stamped and is fetched again on the next run'''
+        api = StubAPI(issues=6, fail=4)
+        with self.assertRaisesRegex(RuntimeError, 'issue 4'):
+            self.fetcher(api, jobs=2).fetch()
+        self.assertFalse(self.stamped(4))
+        self.assertFalse(self.stamped())
+
+        api = StubAPI(issues=6)
+        self.fetcher(api, jobs=2).fetch()
+        self.assertEqual(api.since, [None])
+        for number in api.numbers:
+            self.assertTrue(self.stamped(number))
+        self.assertTrue(self.stamped())
+
+
+    def test_stamp_without_header(self):
+        '''Issues from list pages are stamped with their updated_at value'''
+        fetcher = self.fetcher(StubAPI(issues=0))
+        issue = make_issue(1)
+        fetcher.write_stamp(issue)
+        self.assertEqual(GitHubTimestamp(fetcher.read_stamp(1)),
+                         GitHubTimestamp(isotime=issue['updated_at']))
+
+        issue['header-last-modified'] = 'Sat, 28 Dec 2019 01:02:03 GMT'
+        fetcher.write_stamp(issue)
+        self.assertEqual(GitHubTimestamp(fetcher.read_stamp(1)),
+                         GitHubTimestamp(header=issue['header-last-modified']))
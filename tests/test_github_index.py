@@ -0,0 +1,159 @@
+'''
+Check that GitHubReader returns the same data with and without SQLite index
+'''
+
+
+import sqlite3
+import unittest
+from types import SimpleNamespace
+
+import attr
+
+from issyours.reader import ReaderBase
+from issyours_github import GitHubFetcher, GitHubReader, cli
+from issyours_github.api import GitHubTimestamp
+from issyours_github.index import GitHubIndex
+
+from tests.github_archive import Archive, REPO, make_person
+
+
+class IndexTests(unittest.TestCase):
+
+    def setUp(self):
+        self.archive = Archive(issues=12, comments=3, events=2)
+        index = GitHubIndex(self.archive.storage)
+        index.rebuild()
+        index.close()
+
+
+    def tearDown(self):
+        self.archive.cleanup()
+
+
+    def readers(self):
+        plain = GitHubReader(REPO, self.archive.name, use_index=False)
+        indexed = GitHubReader(REPO, self.archive.name)
+        self.assertIsNone(plain.index)
+        self.assertIsNotNone(indexed.index)
+        return plain, indexed
+
+
+    def test_listing(self):
+        plain, indexed = self.readers()
+        for desc in (True, False):
+            with self.subTest(desc=desc):
+                self.assertEqual(plain.issue_uids(desc=desc), indexed.issue_uids(desc=desc))
+        self.assertEqual(sorted(plain.person_uids()), sorted(indexed.person_uids()))
+
+
+    def test_issue_contents(self):
+        plain, indexed = self.readers()
+        for uid in plain.issue_uids():
+            with self.subTest(uid=uid):
+                one, two = plain.issue(uid), indexed.issue(uid)
+                self.assertEqual(
+                    [(c.created_at, c.body) for c in one.comments()],
+                    [(c.created_at, c.body) for c in two.comments()],
+                )
+                self.assertEqual(
+                    [(e.created_at, e.type) for e in one.events(desc=True)],
+                    [(e.created_at, e.type) for e in two.events(desc=True)],
+                )
+                self.assertEqual(
+                    [a.original_url for a in one.attachments()],
+                    [a.original_url for a in two.attachments()],
+                )
+                self.assertEqual(len(list(two.attachments())), 1)
+                self.assertIsNotNone(two.author.picture)
+
+
+    def test_sorting(self):
+        '''Compare precomputed sort order with the one obtained from full issues'''
+        plain, indexed = self.readers()
+        issues = [plain.issue(uid) for uid in plain.issue_uids()]
+        keys = {
+            'modified_at': lambda i: i.modified_at,
+            'comments': lambda i: len(list(i.comments())),
+            'status': lambda i: i.status,
+        }
+        for sort_by, key in keys.items():
+            for desc in (True, False):
+                with self.subTest(sort_by=sort_by, desc=desc):
+                    expected = [i.uid for i in sorted(
+                        sorted(issues, key=lambda i: int(i.uid), reverse=desc),
+                        key=key,
+                        reverse=desc,
+                    )]
+                    self.assertEqual(indexed.issue_uids(sort_by, desc), expected)
+                    self.assertEqual(plain.issue_uids(sort_by, desc), expected)
+
+        closed = indexed.issue_uids('closed_at', desc=True)
+        self.assertEqual(
+            [uid for uid in closed if plain.issue(uid).closed_at],
+            [i.uid for i in sorted(issues, key=lambda i: i.closed_at or i.created_at, reverse=True)
+             if i.closed_at],
+        )
+        self.assertTrue(all(not plain.issue(uid).closed_at for uid in closed[len(closed) // 3:]))
+
+
+    def test_filters(self):
+        plain, indexed = self.readers()
+        for reader in plain, indexed:
+            with self.subTest(reader=reader):
+                closed = reader.issue_uids(status='closed')
+                self.assertEqual(closed, [str(n) for n in range(12, 0, -1) if n % 3 == 0])
+                bugs = reader.issue_uids(label='bug', desc=False)
+                self.assertEqual(bugs, [str(n) for n in range(1, 13) if n % 2])
+                both = [i.uid for i in reader.issues(status='closed', label='bug')]
+                self.assertEqual(both, ['9', '3'])
+                with self.assertRaises(NotImplementedError):
+                    reader.issue_uids('title')
+
+
+    def test_summaries(self):
+        '''Summaries from index match the ones created from full issues'''
+        plain, indexed = self.readers()
+        for reader in plain, indexed:
+            with self.subTest(reader=reader):
+                reader._read_issue = None  # summaries do not load issues
+                summaries = reader.issue_summaries('comments', status='open')
+                del reader._read_issue
+                expected = ReaderBase.issue_summaries(reader, 'comments', status='open')
+                self.assertEqual([attr.evolve(s, comments=None) for s in summaries], expected)
+                self.assertEqual([s.uid for s in summaries], reader.issue_uids('comments', status='open'))
+                self.assertEqual(summaries[0].comments, 3)
+
+
+    def test_fingerprint(self):
+        '''Reader fingerprint uses person details from index without reading profiles'''
+        plain, indexed = self.readers()
+        indexed._read_person = None
+        self.assertEqual(indexed.fingerprint(), plain.fingerprint())
+
+        index = GitHubIndex(self.archive.storage)
+        person = make_person('alice')
+        index.add_person('alice', person, picture=True)
+        index.commit()
+        self.assertEqual(GitHubReader(REPO, self.archive.name).fingerprint(), plain.fingerprint())
+        person['name'] = 'Alice Liddell'
+        index.add_person('alice', person, picture=True)
+        index.commit()
+        index.close()
+        self.assertNotEqual(GitHubReader(REPO, self.archive.name).fingerprint(), plain.fingerprint())
+
+
+    def test_fetch_without_index(self):
+        '''Fetching without index removes the file that would become stale'''
+        fetcher = GitHubFetcher(REPO, self.archive.name, token=None, http_cache=False, index=False)
+        fetcher.api = SimpleNamespace(issues=lambda *a, **ka: iter([]))
+        fetcher.last_modified = GitHubTimestamp(unix=1600000000)
+        fetcher.fetch()
+        self.assertIsNone(GitHubReader(REPO, self.archive.name).index)
+
+
+    def test_rebuild_unsupported(self):
+        path = self.archive.storage.index_path()
+        with sqlite3.connect(path) as db:
+            db.execute('PRAGMA user_version = 999')
+        with self.assertRaisesRegex(SystemExit, 'unsupported index version'):
+            cli.run([REPO, self.archive.name, '--rebuild-index'])
@@ -0,0 +1,159 @@
+'''
+Test packed storage layout for GitHub issues archive
+'''
+
+
+import os
+import unittest
+from tempfile import TemporaryDirectory
+from types import SimpleNamespace
+
+from issyours_github import GitHubFetcher, GitHubReader
+from issyours_github.api import GitHubNotModifiedException
+from issyours_github.index import GitHubIndex
+from issyours_github.packed import PackedRecords, convert_layout
+from issyours_github.storage import GitHubFileStorage
+
+from tests.github_archive import Archive, REPO, make_comment, make_event, make_issue
+
+
+class PackedRecordsTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'records.jsonl')
+
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+
+    def test_append_and_read(self):
+        with PackedRecords(self.path) as records:
+            records.append('comment-2-1.json', {'body': 'second\nline'})
+            records.append('event-1-1.json', {'event': 'closed'})
+            records.append('comment-1-1.json', {'body': 'first'})
+            records.append('comment-2-1.json', {'body': 'edited'})
+        records = PackedRecords(self.path, readonly=True)
+        self.assertEqual(records.names('comment'), ['comment-1-1.json', 'comment-2-1.json'])
+        self.assertEqual(records.names('comment', desc=True)[0], 'comment-2-1.json')
+        self.assertEqual(records.names(), sorted(records.names()))
+        self.assertEqual(records.read('comment-2-1.json'), {'body': 'edited'})
+        self.assertEqual(len(records), 3)
+        with self.assertRaises(ValueError):
+            records.append('event-2-2.json', {})
+        records.close()
+
+
+    def test_unsaved_index(self):
+        '''Records appended after the index was saved are found by scanning'''
+        with PackedRecords(self.path) as records:
+            records.append('comment-1-1.json', {'body': 'saved'})
+        records = PackedRecords(self.path)
+        records.append('comment-2-1.json', {'body': 'not indexed'})
+        records._file.close()  # interrupted before saving the index
+        with open(self.path, 'ab') as f:
+            f.write(b'{"data":{"body":"incompl')
+        records = PackedRecords(self.path)
+        self.assertEqual(records.read('comment-2-1.json'), {'body': 'not indexed'})
+        records.append('comment-3-1.json', {'body': 'after'})
+        records.close()
+        with PackedRecords(self.path, readonly=True) as records:
+            self.assertEqual(len(records), 3)
+            self.assertEqual(records.read('comment-3-1.json'), {'body': 'after'})
+
+
+    def test_compaction(self):
+        with PackedRecords(self.path) as records:
+            for version in range(5):
+                records.append('comment-1-1.json', {'version': version})
+            records.append('comment-2-1.json', {'version': 0})
+        with open(self.path, 'rb') as f:
+            self.assertEqual(len(f.readlines()), 2)
+        with PackedRecords(self.path, readonly=True) as records:
+            self.assertEqual(records.read('comment-1-1.json'), {'version': 4})
+
+
+
+class PackedLayoutTests(unittest.TestCase):
+
+    def read_all(self, reader):
+        result = []
+        for uid in reader.issue_uids():
+            issue = reader.issue(uid)
+            result.append((
+                uid,
+                [(c.created_at, c.author.nickname, c.body) for c in issue.comments(desc=True)],
+                [(e.created_at, e.type, e.data) for e in issue.events()],
+                [(item.created_at, kind) for item, kind in issue.feed()],
+            ))
+        return result
+
+
+    def test_same_data(self):
+        with Archive(issues=6, comments=3, events=2) as files, \
+             Archive(issues=6, comments=3, events=2, layout='packed') as packed:
+            expected = self.read_all(GitHubReader(REPO, files))
+            self.assertEqual(self.read_all(GitHubReader(REPO, packed)), expected)
+            issue_dir = os.path.join(packed, 'issues', '1')
+            self.assertFalse([f for f in os.listdir(issue_dir) if f.startswith('comment-')])
+
+            index = GitHubIndex(GitHubFileStorage(REPO, packed))
+            index.rebuild()
+            self.assertEqual(len(index.files(1, 'comment')), 3)
+            index.close()
+            self.assertEqual(self.read_all(GitHubReader(REPO, packed)), expected)
+
+
+    def test_conversion_roundtrip(self):
+        def snapshot(directory):
+            contents = dict()
+            for root, dirs, files in os.walk(os.path.join(directory, 'issues')):
+                for filename in files:
+                    with open(os.path.join(root, filename), 'rb') as f:
+                        contents[os.path.relpath(f.name, directory)] = f.read()
+            return contents
+
+        with Archive(issues=4, comments=2, events=2) as directory:
+            storage = GitHubFileStorage(REPO, directory)
+            before = snapshot(directory)
+            self.assertEqual(convert_layout(storage, 'packed'), 4)
+            self.assertEqual(convert_layout(storage, 'packed'), 0)
+            self.assertLess(len(snapshot(directory)), len(before))
+            self.assertEqual(convert_layout(storage, 'files'), 4)
+            self.assertEqual(snapshot(directory), before)
+
+
+    def test_fetcher(self):
+        issue = make_issue(1, comments=2)
+        issue.update(comments_url='comments', events_url='events')
+        comments = [make_comment(1, index) for index in range(2)]
+        with Archive(issues=1, comments=1, events=1) as directory:
+            fetcher = GitHubFetcher(REPO, directory, token=None, http_cache=False,
+                                    index=False, layout='packed')
+            fetcher.api = SimpleNamespace(
+                comments=lambda url, since: iter(comments),
+                events=lambda url, since: iter([make_event(1, 1)]),
+                person=self.not_modified,
+            )
+            fetcher.downloads = SimpleNamespace(
+                put=lambda *a: None,
+                after=lambda downloads, callback: callback(),
+            )
+            comments[0]['body'] = 'Edited comment'
+            fetcher.fetch_issue(issue)
+
+            issue_dir = os.path.join(directory, 'issues', '1')
+            self.assertFalse([f for f in os.listdir(issue_dir) if f.endswith('.json')
+                              and f not in {'issue.json', 'fetcher.json'}])
+            reader = GitHubReader(REPO, directory)
+            self.assertEqual(
+                [c.body for c in reader.issue('1').comments()],
+                ['<p>Edited comment</p>', '<p>Comment 1 on issue 1</p>'],
+            )
+            self.assertEqual(len(list(reader.issue('1').events())), 2)
+
+
+    @staticmethod
+    def not_modified(*a, **ka):
+        raise GitHubNotModifiedException()
@@ -0,0 +1,155 @@
+'''
+Unit tests for in-memory caches of lazy objects
+'''
+
+
+import gc
+import threading
+import time
+import unittest
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from issyours.lazy import LazyAwareCache, LazyObject, MultiCache
+from issyours_github import GitHubReader
+
+from tests.github_archive import Archive, REPO
+
+
+class Item:
+    '''Weak-referenceable cache value'''
+
+    def __init__(self, value):
+        self.value = value
+
+
+class CacheTests(unittest.TestCase):
+
+    def test_lru(self):
+        cache = MultiCache(maxsize=3)
+        items = [Item(n) for n in range(5)]
+        for number in range(3):
+            cache[number] = items[number]
+        cache[0]  # most recently used now
+        cache[3] = items[3]
+        self.assertEqual(list(cache._strong_cache), [2, 0, 3])
+        self.assertIn(1, cache)  # still referenced by items list
+        del items[1]
+        self.assertNotIn(1, cache)
+
+        cache[2]  # weak reference hit returns to strong cache
+        self.assertEqual(list(cache._strong_cache), [0, 3, 2])
+
+
+    def test_uninitialized_first(self):
+        cache = LazyAwareCache(maxsize=3)
+        lazies = [LazyObject(Item, n) for n in range(5)]
+        for number in range(3):
+            cache[number] = lazies[number]
+        lazies[0].value  # initialize the least recently used item
+        cache[3] = lazies[3]
+        self.assertEqual(list(cache._strong_cache), [0, 2, 3])
+        lazies[2].value
+        lazies[3].value
+        cache[4] = lazies[4]
+        self.assertEqual(list(cache._strong_cache), [0, 2, 3])  # only uninitialized one
+        lazies[1].value
+        cache[1] = lazies[1]
+        self.assertEqual(list(cache._strong_cache), [2, 3, 1])  # all initialized: plain LRU
+
+
+    def test_maxbytes(self):
+        cache = LazyAwareCache(maxsize=100, maxbytes=4000, sizeof=lambda item: item.value)
+        overhead = LazyAwareCache.LAZY_OBJECT_SIZE
+        lazies = [LazyObject(Item, 1000) for n in range(4)]
+        for number, lazy in enumerate(lazies):
+            cache[number] = lazy
+        self.assertEqual(cache.stats()['bytes'], 4 * overhead)
+        lazies[0].value
+        lazies[1].value
+        self.assertEqual(list(cache._strong_cache), [0, 1, 2, 3])
+        self.assertEqual(cache.stats()['bytes'], 4000)
+        lazies[2].value  # over budget: drop uninitialized item, then the least recently used
+        self.assertEqual(list(cache._strong_cache), [1, 2])
+        self.assertEqual(cache.stats()['bytes'], 2 * (overhead + 1000))
+
+        big = LazyObject(Item, 10000)
+        big.value
+        cache['big'] = big  # larger than the whole budget, kept alone
+        self.assertEqual(list(cache._strong_cache), ['big'])
+        self.assertEqual(cache.stats()['bytes'], overhead + 10000)
+
+
+    def test_evicted_uninitialized(self):
+        '''Evicted objects are released without waiting for garbage collector'''
+        cache = LazyAwareCache(maxsize=2, maxbytes=10**6, sizeof=lambda item: item.value)
+        gc.disable()
+        try:
+            for number in range(10):
+                cache[number] = LazyObject(Item, number)
+            self.assertEqual(cache.stats()['weaksize'], 2)
+        finally:
+            gc.enable()
+
+
+    def test_reader_budget(self):
+        class Reader(GitHubReader):
+            ISSUE_CACHE_BYTES = 20000
+        with Archive(issues=30) as directory:
+            reader = Reader(REPO, directory)
+            for issue in reader.issues():
+                issue.title
+            stats = reader.cache_stats()['issues']
+            self.assertGreater(stats['bytes'], 10000)
+            self.assertLessEqual(stats['bytes'], 20000)
+            self.assertLess(stats['lrusize'], 30)
+            self.assertIsNone(reader.cache_stats()['persons']['bytes'])
+
+
+class ThreadSafetyTests(unittest.TestCase):
+
+    THREADS = 16
+
+
+    def hammer(self, function, repeat=200):
+        '''Call function from many threads at once, return all results'''
+        barrier = threading.Barrier(self.THREADS)
+        def worker(number):
+            barrier.wait()
+            return [function(number, step) for step in range(repeat)]
+        with ThreadPoolExecutor(self.THREADS) as pool:
+            return [r for results in pool.map(worker, range(self.THREADS)) for r in results]
+
+
+    def test_single_flight(self):
+        calls = Counter()
+        def constructor(number):
+            calls[number] += 1
+            time.sleep(0.001)  # widen the race window
+            return Item(number)
+        lazies = [LazyObject(constructor, n) for n in range(20)]
+        results = self.hammer(lambda thread, step: lazies[step % 20].value)
+        self.assertEqual(results, list(range(20)) * (len(results) // 20))
+        self.assertEqual(calls, Counter(range(20)))
+
+
+    def test_reader(self):
+        '''All threads receive the same issue objects, each read only once'''
+        with Archive(issues=30) as directory:
+            reader = GitHubReader(REPO, directory)
+            reader._issues_cache = LazyAwareCache(maxsize=10)  # force evictions
+            calls = Counter()
+            read_issue = reader._read_issue
+            def counting_read(uid):
+                calls[uid] += 1
+                return read_issue(uid)
+            reader._read_issue = counting_read
+            keep = {}  # strong references: evicted issues stay in weak cache
+            def get(thread, step):
+                uid = str((thread + step) % 30 + 1)
+                issue = reader.issue(uid)
+                self.assertEqual(issue.title, 'Issue number {}'.format(uid))
+                return keep.setdefault(uid, issue) is issue
+            self.assertTrue(all(self.hammer(get, repeat=60)))
+            self.assertEqual(calls, Counter(str(n) for n in range(1, 31)))
+            self.assertLessEqual(len(reader._issues_cache._strong_cache), 10)
@@ -0,0 +1,207 @@
+'''
+Build a small website with Pelican and check the output
+'''
+
+
+import filecmp
+import gc
+import multiprocessing
+import os
+import unittest
+import warnings
+from tempfile import TemporaryDirectory
+
+from pelican import Pelican
+from pelican.settings import read_settings
+
+import issyours.pelican
+from issyours_github import GitHubReader
+
+from tests.github_archive import Archive, REPO, make_comment, make_person
+from issyours_github.fetcher import write_json
+
+
+def build(archive, output, **settings):
+    '''Render website for an archive into output directory'''
+    config = dict(
+        PATH=archive.name,
+        OUTPUT_PATH=output,
+        PLUGINS=[issyours.pelican],
+        SITENAME='Test',
+        TIMEZONE='UTC',
+        RELATIVE_URLS=True,
+        DEFAULT_PAGINATION=5,
+        ISSYOURS_SOURCES={GitHubReader(REPO, archive.name): {'prefix': 'GH'}},
+        FEED_ALL_ATOM=None,
+        CATEGORY_FEED_ATOM=None,
+        CACHE_CONTENT=False,
+        LOAD_CONTENT_CACHE=False,
+    )
+    config.update(settings)
+    Pelican(read_settings(override=config)).run()
+
+
+def mtimes(directory):
+    '''Modification times of all files written by IssueGenerator'''
+    return {path: os.stat(os.path.join(directory, path)).st_mtime_ns
+            for path in tree(directory)
+            if path.split(os.sep)[0] in {'issue', 'issues', 'attachments'}}
+
+
+def tree(directory):
+    '''Relative paths of all files in directory'''
+    return sorted(
+        os.path.relpath(os.path.join(root, f), directory)
+        for root, dirs, files in os.walk(directory)
+        for f in files
+    )
+
+
+class PelicanOutputTests(unittest.TestCase):
+
+    def setUp(self):
+        self.archive = Archive(issues=20)
+        self.output = TemporaryDirectory()
+
+
+    def tearDown(self):
+        self.archive.cleanup()
+        self.output.cleanup()
+
+
+    def assertSameOutput(self, one, two):
+        files = tree(one)
+        self.assertEqual(files, tree(two))
+        match, mismatch, errors = filecmp.cmpfiles(one, two, files, shallow=False)
+        self.assertEqual(mismatch + errors, [])
+
+
+    @unittest.skipIf('fork' not in multiprocessing.get_all_start_methods(),
+                     'parallel rendering requires fork()')
+    def test_parallel(self):
+        '''Parallel rendering produces the same output as sequential one'''
+        sequential = os.path.join(self.output.name, 'sequential')
+        parallel = os.path.join(self.output.name, 'parallel')
+        build(self.archive, sequential, ISSYOURS_MANIFEST='')
+        build(self.archive, parallel, ISSYOURS_JOBS=3, ISSYOURS_MANIFEST='')
+        self.assertIn(os.path.join('issue', 'GH20.html'), tree(parallel))
+        self.assertSameOutput(sequential, parallel)
+
+
+    def test_incremental(self):
+        '''Only changed issues are rendered again'''
+        class Reader(GitHubReader):
+            summaries = []
+            def issue_summaries(self, *a, **ka):
+                self.summaries.append(a)
+                return super().issue_summaries(*a, **ka)
+
+        sources = {Reader(REPO, self.archive.name): {'prefix': 'GH'}}
+        output = os.path.join(self.output.name, 'incremental')
+        build(self.archive, output, ISSYOURS_SOURCES=sources)
+        self.assertIn('.issyours-manifest.json', tree(output))
+        self.assertEqual(len(Reader.summaries), 1)
+        before = mtimes(output)
+        build(self.archive, output, ISSYOURS_SOURCES=sources)
+        self.assertEqual(mtimes(output), before)
+        self.assertEqual(len(Reader.summaries), 1)  # index page was not rendered again
+
+        comment = make_comment(7, 0)
+        comment['body'] = 'Edited comment'
+        path = self.archive.storage.comment_path({'number': 7}, comment)
+        write_json(comment, path)
+        os.utime(path, ns=(before[os.path.join('issue', 'GH7.html')] + 10**9,) * 2)
+        build(self.archive, output, ISSYOURS_SOURCES=sources)
+        changed = {path for path, mtime in mtimes(output).items() if before.get(path) != mtime}
+        self.assertIn(os.path.join('issue', 'GH7.html'), changed)
+        self.assertIn(os.path.join('issues', 'GH', 'index.html'), changed)
+        self.assertNotIn(os.path.join('issue', 'GH6.html'), changed)
+
+        full = os.path.join(self.output.name, 'full')
+        build(self.archive, full, ISSYOURS_MANIFEST='')
+        self.assertNotIn('.issyours-manifest.json', tree(full))
+        os.remove(os.path.join(output, '.issyours-manifest.json'))
+        self.assertSameOutput(output, full)
+
+
+    def test_generated_uids(self):
+        '''Readers may yield issue uids instead of returning a list'''
+        class Reader(GitHubReader):
+            def issue_uids(self, *a, **ka):
+                yield from super().issue_uids(*a, **ka)
+
+        sources = {Reader(REPO, self.archive.name): {'prefix': 'GH'}}
+        output = os.path.join(self.output.name, 'generated')
+        build(self.archive, output, ISSYOURS_SOURCES=sources)
+        before = mtimes(output)
+        build(self.archive, output, ISSYOURS_SOURCES=sources)
+        self.assertEqual(mtimes(output), before)
+
+        full = os.path.join(self.output.name, 'full')
+        build(self.archive, full, ISSYOURS_MANIFEST='')
+        os.remove(os.path.join(output, '.issyours-manifest.json'))
+        self.assertSameOutput(output, full)
+
+
+    def test_person_refresh(self):
+        '''Refreshed profiles do not invalidate issue pages, avatars are updated'''
+        output = self.output.name
+        build(self.archive, output)
+        before = mtimes(output)
+        storage = self.archive.storage
+        person = make_person('alice')
+        person['updated_at'] = '2020-01-01T00:00:00Z'
+        write_json(person, storage.person_path('alice'))
+        with open(storage.person_image('alice'), 'wb') as f:
+            f.write(b'new avatar')
+        build(self.archive, output)
+        avatar = os.path.join('issues', 'avatars', 'GH', 'alice')
+        changed = {path for path, mtime in mtimes(output).items() if before.get(path) != mtime}
+        self.assertEqual(changed, {avatar})
+        with open(os.path.join(output, avatar), 'rb') as f:
+            self.assertEqual(f.read(), b'new avatar')
+
+        person['name'] = 'Alice Liddell'
+        write_json(person, storage.person_path('alice'))
+        build(self.archive, output)
+        after = mtimes(output)
+        self.assertNotEqual(after[os.path.join('issue', 'GH1.html')],
+                            before[os.path.join('issue', 'GH1.html')])
+
+
+    def test_publish_mode(self):
+        '''Attachments are hardlinked or copied once'''
+        attachment = os.path.join('attachments', 'GH4', '4.png')
+        source = self.archive.storage.attachment_path(
+            'https://user-images.githubusercontent.com/1/4.png', issue_no=4)
+
+        linked = os.path.join(self.output.name, 'linked')
+        build(self.archive, linked, ISSYOURS_PUBLISH_MODE='link', ISSYOURS_MANIFEST='')
+        self.assertTrue(os.path.samefile(source, os.path.join(linked, attachment)))
+
+        copied = os.path.join(self.output.name, 'copied')
+        build(self.archive, copied, ISSYOURS_MANIFEST='')
+        self.assertFalse(os.path.samefile(source, os.path.join(copied, attachment)))
+        before = mtimes(copied)
+        build(self.archive, copied, ISSYOURS_MANIFEST='')
+        after = mtimes(copied)
+        self.assertEqual(after[attachment], before[attachment])
+        self.assertNotEqual(after[os.path.join('issue', 'GH4.html')],
+                            before[os.path.join('issue', 'GH4.html')])
+        self.assertSameOutput(linked, copied)
+
+
+    @unittest.skipUnless(os.path.isdir('/proc/self/fd'), 'requires /proc filesystem')
+    def test_file_descriptors(self):
+        '''Attachments and avatars do not keep files open'''
+        reader = GitHubReader(REPO, self.archive.name)
+        def count():
+            gc.collect()
+            return len(os.listdir('/proc/self/fd'))
+        before = count()
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always', ResourceWarning)
+            build(self.archive, self.output.name, ISSYOURS_SOURCES={reader: {'prefix': 'GH'}})
+            self.assertEqual(count(), before)
+        self.assertEqual([w for w in caught if issubclass(w.category, ResourceWarning)], [])
+        self.assertTrue(reader.person('alice').picture)  # still cached by reader
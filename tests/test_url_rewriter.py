@@ -0,0 +1,74 @@
+'''
+Unit tests for URL rewrite rules
+'''
+
+
+import unittest
+
+from issyours.pelican import URLRewriter
+
+
+LINK = '<p>See <a class="x" href="{}">link</a> and <img src="{}"></p>'
+
+
+class URLRewriterTests(unittest.TestCase):
+
+    def rewrite(self, rules, url, prefix='GH'):
+        rewriter = URLRewriter({'ISSYOURS_REWRITE_URLS': rules})
+        html = rewriter.rewrite(LINK.format(url, url), prefix)
+        self.assertTrue(html.endswith('<img src="{}"></p>'.format(url)))  # only href is rewritten
+        return html[len('<p>See <a class="x" href="'):html.index('">link')]
+
+
+    def test_backrefs(self):
+        rules = {'GH': {
+            r'https://github.com/(\w+)/(\w+)/issues/(\d+)': r'/issues/\2/\3.html?owner=\1',
+            r'https://(example)\.(com)/': r'https://\2.\1/',
+        }}
+        self.assertEqual(self.rewrite(rules, 'https://github.com/sio/issyours/issues/7'),
+                         '/issues/issyours/7.html?owner=sio')
+        self.assertEqual(self.rewrite(rules, 'https://example.com/'), 'https://com.example/')
+        self.assertEqual(self.rewrite(rules, 'https://example.org/'), 'https://example.org/')
+
+
+    def test_scopes(self):
+        rules = {
+            None: {r'http://(.+)': r'https://\1'},
+            'GH': {r'https://old\.host/(.*)': r'https://new.host/\1'},
+        }
+        self.assertEqual(self.rewrite(rules, 'http://old.host/page'), 'https://new.host/page')
+        self.assertEqual(self.rewrite(rules, 'http://old.host/page', prefix='XY'),
+                         'https://old.host/page')
+
+
+    def test_first_match(self):
+        rules = {'GH': {
+            r'https://a\.com/(.*)': r'https://b.com/\1',
+            r'https://b\.com/(.*)': r'https://c.com/\1',
+            r'https://(.*)': r'https://d.com/\1',
+        }}
+        self.assertEqual(self.rewrite(rules, 'https://a.com/x'), 'https://b.com/x')
+        self.assertEqual(self.rewrite(rules, 'https://b.com/x'), 'https://c.com/x')
+        self.assertEqual(self.rewrite(rules, 'https://e.com/x'), 'https://d.com/e.com/x')
+
+
+    def test_named_groups(self):
+        '''Rules that can not be combined are applied one by one'''
+        rules = {'GH': {
+            r'https://a\.com/(?P<path>.*)': r'https://b.com/\g<path>',
+            r'https://b\.com/(?P<path>.*)': r'https://c.com/\g<path>',
+        }}
+        with self.assertLogs('issyours.pelican', 'WARNING'):
+            self.assertEqual(self.rewrite(rules, 'https://a.com/x'), 'https://c.com/x')
+
+
+    def test_cache(self):
+        rewriter = URLRewriter({'ISSYOURS_REWRITE_URLS': {'GH': {r'http://(.*)': r'https://\1'}}})
+        bodies = [LINK.format('http://a.com', '') for _ in range(3)]  # equal, not identical
+        bodies.append('<p>no links</p>')
+        for prefix in ('GH', 'GH', 'XY'):
+            self.assertEqual(
+                [rewriter.rewrite(body, prefix) for body in bodies][:3],
+                [LINK.format('https://a.com' if prefix == 'GH' else 'http://a.com', '')] * 3,
+            )
+        self.assertEqual(rewriter.stats(), dict(hits=5, misses=1, size=1))